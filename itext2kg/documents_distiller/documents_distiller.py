@@ -1,5 +1,9 @@
-from typing import List
-from ..utils import LangchainOutputParser
+import copy
+import hashlib
+import json
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List
+from ..utils import LangchainOutputParser, ResponseCache, RateLimiter
 
 
 class DocumentsDistiller:
@@ -7,14 +11,68 @@ class DocumentsDistiller:
     A class designed to distill essential information from multiple documents into a combined
     structure, using natural language processing tools to extract and consolidate information.
     """
-    def __init__(self, llm_model) -> None:
+    def __init__(self, llm_model, response_cache:ResponseCache=None, rate_limiter:RateLimiter=None) -> None:
         """
         Initializes the DocumentsDistiller with specified language model
         
         Args:
         llm_model: The language model instance to be used for generating semantic blocks.
+        response_cache (ResponseCache, optional): A cache of the LLM responses, so that distilling unchanged documents again 
+                                                  does not call the model. Defaults to None.
+        rate_limiter (RateLimiter, optional): The rate limiter of the LLM calls. Defaults to None, i.e. the process-wide 
+                                              `RateLimiter.default()`, shared with the iText2KG instances created without a rate limiter.
         """
-        self.langchain_output_parser = LangchainOutputParser(llm_model=llm_model, embeddings_model=None)
+        self.langchain_output_parser = LangchainOutputParser(llm_model=llm_model, embeddings_model=None, response_cache=response_cache, rate_limiter=rate_limiter)
+    
+    @staticmethod
+    def __item_hash(item) -> str:
+        """
+        A hash of a list item (str, dict, ...) identifying the duplicated items.
+        """
+        return hashlib.sha1(json.dumps(item, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def __combine_into(combined_dict:dict, d:dict, seen_items:Dict[str, set] = None) -> dict:
+        """
+        Fold a dictionary into the combined dictionary, merging values based on their types.
+        
+        Args:
+        combined_dict (dict): The combined dictionary, updated in place.
+        d (dict): The dictionary to fold, None for a document whose distillation failed.
+        seen_items (Dict[str, set], optional): The hashes of the list items already combined, per key. When provided, the 
+                                               duplicated list items are skipped. Defaults to None.
+        
+        Returns:
+        dict: The combined dictionary.
+        """
+        # The documents whose distillation failed have no output.
+        if d is None:
+            return combined_dict
+        for key, value in d.items():
+            if isinstance(value, list) and seen_items is not None:
+                if key not in combined_dict or not isinstance(combined_dict[key], list):
+                    combined_dict[key] = []
+                    seen_items[key] = set()
+                for item in value:
+                    item_hash = DocumentsDistiller.__item_hash(item)
+                    if item_hash not in seen_items[key]:
+                        seen_items[key].add(item_hash)
+                        combined_dict[key].append(item)
+            elif key in combined_dict:
+                if isinstance(value, list) and isinstance(combined_dict[key], list):
+                    combined_dict[key].extend(value)
+                elif isinstance(value, str) and isinstance(combined_dict[key], str):
+                    if value and combined_dict[key]:
+                        combined_dict[key] += f' {value}'
+                    elif value:
+                        combined_dict[key] = value
+                elif isinstance(value, dict) and isinstance(combined_dict[key], dict):
+                    combined_dict[key].update(value)
+                else:
+                    combined_dict[key] = value
+            else:
+                combined_dict[key] = value
+        return combined_dict
     
     @staticmethod
     def __combine_dicts(dict_list:List[dict]):
@@ -30,26 +88,12 @@ class DocumentsDistiller:
         combined_dict = {}
         
         for d in dict_list:
-            for key, value in d.items():
-                if key in combined_dict:
-                    if isinstance(value, list) and isinstance(combined_dict[key], list):
-                        combined_dict[key].extend(value)
-                    elif isinstance(value, str) and isinstance(combined_dict[key], str):
-                        if value and combined_dict[key]:
-                            combined_dict[key] += f' {value}'
-                        elif value:
-                            combined_dict[key] = value
-                    elif isinstance(value, dict) and isinstance(combined_dict[key], dict):
-                        combined_dict[key].update(value)
-                    else:
-                        combined_dict[key] = value
-                else:
-                    combined_dict[key] = value
+            DocumentsDistiller.__combine_into(combined_dict, d)
         
         return combined_dict
 
 
-    def distill(self, documents: List[str], output_data_structure, IE_query:str) -> dict:
+    def distill(self, documents: List[str], output_data_structure, IE_query:str, max_concurrency:int=None) -> dict:
         """
         Distill information from multiple documents based on a specific information extraction query.
         
@@ -57,10 +101,21 @@ class DocumentsDistiller:
         documents (List[str]): A list of documents from which to extract information.
         output_data_structure: The data structure definition for formatting the output JSON.
         IE_query (str): The query to provide to the language model for extracting information.
+        max_concurrency (int, optional): When set, the documents are distilled concurrently in a batch, with at most max_concurrency 
+                                         calls to the language model at the same time. A failed document is then skipped without 
+                                         aborting the others. Defaults to None, i.e. one document after another.
         
         Returns:
         dict: A dictionary representing distilled information from all documents.
         """
+        if max_concurrency is not None:
+            output_jsons = self.langchain_output_parser.batch_extract_information_as_json(
+                contexts=documents,
+                IE_query=IE_query,
+                output_data_structure=output_data_structure,
+                max_concurrency=max_concurrency)
+            return DocumentsDistiller.__combine_dicts(output_jsons)
+        
         output_jsons = list(
             map(
                 lambda context: self.langchain_output_parser.extract_information_as_json_for_context(
@@ -71,5 +126,85 @@ class DocumentsDistiller:
                 documents))
         
         return DocumentsDistiller.__combine_dicts(output_jsons)
-
-
+    
+    
+    async def adistill(self, documents: List[str], output_data_structure, IE_query:str, max_concurrency:int=4) -> dict:
+        """
+        Asynchronous version of `distill`, distilling the documents concurrently through the `abatch` method of the chain.
+        
+        Args:
+        documents (List[str]): A list of documents from which to extract information.
+        output_data_structure: The data structure definition for formatting the output JSON.
+        IE_query (str): The query to provide to the language model for extracting information.
+        max_concurrency (int): The maximum number of concurrent calls to the language model. Defaults to 4.
+        
+        Returns:
+        dict: A dictionary representing distilled information from all documents.
+        """
+        output_jsons = await self.langchain_output_parser.abatch_extract_information_as_json(
+            contexts=documents,
+            IE_query=IE_query,
+            output_data_structure=output_data_structure,
+            max_concurrency=max_concurrency)
+        return DocumentsDistiller.__combine_dicts(output_jsons)
+    
+    
+    def stream_distill(self, 
+                       documents: Iterable[str], 
+                       output_data_structure, 
+                       IE_query:str, 
+                       max_concurrency:int=None, 
+                       snapshot_every:int=None) -> Iterator[dict]:
+        """
+        Distill information from a stream of documents with a bounded memory: each output is folded into the combined 
+        dictionary as soon as it arrives, and the list items are deduplicated by hash. Only the combined dictionary is kept,
+        so corpora larger than the memory can be distilled.
+        
+        Args:
+        documents (Iterable[str]): An iterable (e.g. a generator reading files lazily) of the documents.
+        output_data_structure: The data structure definition for formatting the output JSON.
+        IE_query (str): The query to provide to the language model for extracting information.
+        max_concurrency (int, optional): When set, the documents are read and distilled in batches of max_concurrency documents.
+                                         Defaults to None, i.e. one document after another. Either way, a failed document is 
+                                         skipped without ending the stream.
+        snapshot_every (int, optional): When set, a copy of the combined dictionary is yielded every snapshot_every documents. 
+                                        Defaults to None.
+        
+        Yields:
+        dict: The snapshots of the combined dictionary, then the final combined dictionary (unless the last snapshot is already 
+              the final state).
+        """
+        combined_dict = {}
+        seen_items = {}
+        documents = iter(documents)
+        n_documents = 0
+        while True:
+            batch = list(islice(documents, max_concurrency or 1))
+            if not batch:
+                break
+            if max_concurrency is not None:
+                output_jsons = self.langchain_output_parser.batch_extract_information_as_json(
+                    contexts=batch,
+                    IE_query=IE_query,
+                    output_data_structure=output_data_structure,
+                    max_concurrency=max_concurrency)
+            else:
+                # As in the batches, a failed document is skipped without ending the stream.
+                try:
+                    output_jsons = [self.langchain_output_parser.extract_information_as_json_for_context(
+                        context=batch[0],
+                        IE_query=IE_query,
+                        output_data_structure=output_data_structure)]
+                except Exception as e:
+                    print(f"[INFO] The context {n_documents} failed with the error: {e}")
+                    output_jsons = [None]
+            
+            for output_json in output_jsons:
+                DocumentsDistiller.__combine_into(combined_dict, output_json, seen_items)
+                n_documents += 1
+                if snapshot_every and n_documents % snapshot_every == 0:
+                    yield copy.deepcopy(combined_dict)
+        
+        # The final state was already yielded by the last snapshot.
+        if not (snapshot_every and n_documents and n_documents % snapshot_every == 0):
+            yield combined_dict
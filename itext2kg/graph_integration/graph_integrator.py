@@ -1,12 +1,20 @@
 from neo4j import GraphDatabase
+import hashlib
+import json
+import os
 import numpy as np
-from typing import List
-from ..models import KnowledgeGraph
+import time
+from typing import Dict, List, Optional, Tuple
+from ..models import Entity, Relationship, KnowledgeGraph
+from ..models.knowledge_graph import EntityProperties, RelationshipProperties
 class GraphIntegrator:
     """
     A class to integrate and manage graph data in a Neo4j database.
     """
-    def __init__(self, uri: str, username: str, password: str):
+    # The condition on the nodes which can be loaded back as entities, formatted with the variable of the node.
+    LOADED_NODE = "{0}.name IS NOT NULL AND size(labels({0})) > 0"
+    
+    def __init__(self, uri: str, username: str, password: str, native_embeddings: bool = True):
         """
         Initializes the GraphIntegrator with database connection parameters.
         
@@ -14,10 +22,14 @@ class GraphIntegrator:
         uri (str): URI for the Neo4j database.
         username (str): Username for database access.
         password (str): Password for database access.
+        native_embeddings (bool): Whether ingest_graph stores the embeddings as native lists of floats, which can be 
+                                  indexed by vector indexes, instead of comma-separated strings. Defaults to True.
         """
         self.uri = uri
         self.username = username
         self.password = password
+        self.native_embeddings = native_embeddings
+        self.synced_state = None
         self.driver = self.connect()
         
 
@@ -125,22 +137,402 @@ class GraphIntegrator:
         return rels
     
 
-    def visualize_graph(self, knowledge_graph:KnowledgeGraph) -> None:
+    @staticmethod
+    def escape_name(name: str) -> str:
         """
-        Runs the necessary queries to visualize a graph structure from a KnowledgeGraph input.
+        Quotes a label or a relationship type with backticks, since they cannot be passed as query parameters.
         
         Args:
-        kg (KnowledgeGraph): The KnowledgeGraph object containing the graph structure.
+        name (str): A label or a relationship type.
+        
+        Returns:
+        str: The quoted name.
         """
-        self.connect()
-
-        nodes, relationships = (
-            self.create_nodes(knowledge_graph=knowledge_graph),
-            self.create_relationships(knowledge_graph=knowledge_graph),
+        return "`" + name.replace("`", "``") + "`"
+    
+    @staticmethod
+    def transform_embeddings_to_float_list(embeddings:np.array) -> Optional[List[float]]:
+        """
+        Transforms a NumPy array of embeddings into a list of floats, stored natively by Neo4j.
+        
+        Args:
+        embeddings (np.array): An array of embeddings.
+        
+        Returns:
+        Optional[List[float]]: The list of floats, or None without embeddings.
+        """
+        if embeddings is None:
+            return None
+        return np.asarray(embeddings, dtype=np.float64).tolist()
+    
+    @staticmethod
+    def _set_embeddings_row(matrix:Optional[np.ndarray], row:int, embedding, n_rows:int) -> np.ndarray:
+        """
+        Decodes an embedding read from Neo4j (a list of floats, or a comma-separated string written by the per-query path)
+        into a row of a contiguous matrix of embeddings, whose missing rows are NaN. The matrix is allocated with n_rows 
+        rows at the first embedding, and grown if more rows than expected are read.
+        
+        Returns:
+        np.ndarray: The matrix, reallocated when it was None or too small.
+        """
+        embedding = GraphIntegrator._decode_embedding(embedding)
+        if matrix is None:
+            matrix = np.full((max(n_rows, row + 1), len(embedding)), np.nan)
+        elif row >= len(matrix):
+            grown = np.full((max(2 * len(matrix), row + 1), matrix.shape[1]), np.nan)
+            grown[:len(matrix)] = matrix
+            matrix = grown
+        matrix[row] = embedding
+        return matrix
+    
+    @staticmethod
+    def _decode_embedding(embedding) -> object:
+        if isinstance(embedding, str):
+            return GraphIntegrator.transform_str_list_to_embeddings(embedding)
+        return embedding
+    
+    def transform_properties(self, properties: dict) -> dict:
+        """
+        Transforms the properties of a node or a relationship into query parameters. The embeddings are lists of floats,
+        or comma-separated strings as in the per-query path when native_embeddings is False.
+        
+        Args:
+        properties (dict): The dumped properties.
+        
+        Returns:
+        dict: The properties with their keys and values ready to be written.
+        """
+        transformed = {}
+        for key, value in properties.items():
+            if key == "embeddings":
+                value = (GraphIntegrator.transform_embeddings_to_float_list(value) if self.native_embeddings 
+                         else GraphIntegrator.transform_embeddings_to_str_list(value))
+            else:
+                value = str(value)
+            transformed[key.replace(" ", "_")] = value
+        return transformed
+    
+    def group_nodes(self, knowledge_graph:KnowledgeGraph) -> Dict[str, List[dict]]:
+        """
+        Groups the rows of the nodes of a KnowledgeGraph object by label.
+        
+        Args:
+        knowledge_graph (KnowledgeGraph): The KnowledgeGraph object containing entities.
+        
+        Returns:
+        Dict[str, List[dict]]: The rows ({name, properties}) of the nodes of each label.
+        """
+        groups = {}
+        for node in knowledge_graph.entities:
+            groups.setdefault(node.label, []).append(self._node_row(node))
+        return groups
+    
+    def group_relationships(self, knowledge_graph:KnowledgeGraph) -> Dict[Tuple[str, str, str], List[dict]]:
+        """
+        Groups the rows of the relationships of a KnowledgeGraph object by (type, start label, end label).
+        
+        Args:
+        knowledge_graph (KnowledgeGraph): The KnowledgeGraph object containing relationships.
+        
+        Returns:
+        Dict[Tuple[str, str, str], List[dict]]: The rows ({start, end, properties}) of the relationships of each group.
+        """
+        groups = {}
+        for rel in knowledge_graph.relationships:
+            groups.setdefault(self._relationship_group(rel), []).append(self._relationship_row(rel))
+        return groups
+    
+    def _node_row(self, node:Entity) -> dict:
+        return {"name": node.name, "properties": self.transform_properties(node.properties.model_dump())}
+    
+    def _relationship_row(self, rel:Relationship) -> dict:
+        return {"start": rel.startEntity.name, 
+                "end": rel.endEntity.name, 
+                "properties": self.transform_properties(rel.properties.model_dump())}
+    
+    @staticmethod
+    def _relationship_group(rel:Relationship) -> Tuple[str, str, str]:
+        return (rel.name, rel.startEntity.label, rel.endEntity.label)
+    
+    @staticmethod
+    def nodes_query(label: str) -> str:
+        return (
+            f"UNWIND $rows AS row "
+            f"MERGE (n:{GraphIntegrator.escape_name(label)} {{name: row.name}}) "
+            f"SET n += row.properties"
         )
+    
+    @staticmethod
+    def relationships_query(rel_type: str, start_label: str, end_label: str) -> str:
+        return (
+            f"UNWIND $rows AS row "
+            f"MATCH (n:{GraphIntegrator.escape_name(start_label)} {{name: row.start}}) "
+            f"MATCH (m:{GraphIntegrator.escape_name(end_label)} {{name: row.end}}) "
+            f"MERGE (n)-[r:{GraphIntegrator.escape_name(rel_type)}]->(m) "
+            f"SET r += row.properties"
+        )
+    
+    @staticmethod
+    def _write_batches(session, query: str, rows: List[dict], batch_size: int) -> int:
+        """
+        Writes rows with a parameterized query, one explicit transaction per batch of rows.
+        
+        Returns:
+        int: The number of batches.
+        """
+        n_batches = 0
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            session.execute_write(lambda tx: tx.run(query, rows=batch).consume())
+            n_batches += 1
+        return n_batches
+    
+    def create_vector_indexes(self, knowledge_graph:KnowledgeGraph, similarity_function:str="cosine") -> List[str]:
+        """
+        Creates (if they do not exist) the vector indexes of the embeddings of the nodes of each label and of the relationships
+        of each type of a KnowledgeGraph object. It requires Neo4j 5.13+ (5.18+ for the relationships) and native embeddings.
+        
+        Args:
+        knowledge_graph (KnowledgeGraph): The KnowledgeGraph object containing the graph structure.
+        similarity_function (str): The similarity function of the indexes, "cosine" or "euclidean". Defaults to "cosine".
+        
+        Returns:
+        List[str]: The names of the indexes, `node_<label>_embeddings` and `rel_<type>_embeddings`.
+        
+        Raises:
+        ValueError: If the embeddings are not native, or if the embeddings of a label or of a type have different dimensions.
+        """
+        if not self.native_embeddings:
+            raise ValueError("Vector indexes require the embeddings to be stored as native lists of floats.")
+        patterns = {}
+        
+        def add_pattern(name: str, pattern: str, dimension: int) -> None:
+            _, _, indexed_dimension = patterns.setdefault(name, (pattern, "n", dimension))
+            if indexed_dimension != dimension:
+                raise ValueError(f"The embeddings of the vector index {name} have different dimensions: "
+                                 f"{indexed_dimension} and {dimension}.")
+        
+        for node in knowledge_graph.entities:
+            if node.properties.embeddings is not None:
+                add_pattern(f"node_{node.label}_embeddings", f"(n:{GraphIntegrator.escape_name(node.label)})", len(node.properties.embeddings))
+        for rel in knowledge_graph.relationships:
+            if rel.properties.embeddings is not None:
+                add_pattern(f"rel_{rel.name}_embeddings", f"()-[n:{GraphIntegrator.escape_name(rel.name)}]-()", len(rel.properties.embeddings))
+        
+        with self.driver.session() as session:
+            for name, (pattern, variable, dimension) in patterns.items():
+                session.run(
+                    f"CREATE VECTOR INDEX {GraphIntegrator.escape_name(name)} IF NOT EXISTS "
+                    f"FOR {pattern} ON ({variable}.embeddings) "
+                    f"OPTIONS {{indexConfig: {{`vector.dimensions`: $dimension, `vector.similarity_function`: $similarity_function}}}}",
+                    dimension=dimension, similarity_function=similarity_function
+                ).consume()
+        return list(patterns)
+    
+    def load_graph(self, fetch_size:int=10_000) -> KnowledgeGraph:
+        """
+        Streams the graph of the Neo4j database back into a KnowledgeGraph object, e.g. to pass it to 
+        iText2KG.build_graph(existing_knowledge_graph=...). The embeddings of the entities and of the relationships are
+        decoded, as the records are fetched, into two contiguous matrices preallocated from the counts of the nodes and 
+        relationships, the embeddings of each object being a row of them. The nodes without label or name are skipped.
+        
+        Args:
+        fetch_size (int): The number of records fetched at a time from the database. Defaults to 10 000.
+        
+        Returns:
+        KnowledgeGraph: The graph of the database.
+        """
+        # The nodes without label (or name) cannot be entities: they are skipped, with their relationships.
+        with self.driver.session(fetch_size=fetch_size) as session:
+            n_nodes = session.run(f"MATCH (n) WHERE {self.LOADED_NODE.format('n')} RETURN count(n) AS count").single()["count"]
+            entities: Dict[Tuple[str, str], Entity] = {}
+            embedded_entities, entities_matrix = [], None
+            for row, record in enumerate(session.run(
+                f"MATCH (n) WHERE {self.LOADED_NODE.format('n')} RETURN head(labels(n)) AS label, n.name AS name, n.embeddings AS embeddings"
+            )):
+                entity = entities.setdefault((record["label"], record["name"]), Entity.model_construct(
+                    label=record["label"], name=record["name"], properties=EntityProperties.model_construct(embeddings=None)))
+                if record["embeddings"] not in (None, ""):
+                    entities_matrix = self._set_embeddings_row(entities_matrix, row, record["embeddings"], n_nodes)
+                    embedded_entities.append((entity, row))
+            
+            n_relationships = session.run(
+                f"MATCH (n)-[r]->(m) WHERE {self.LOADED_NODE.format('n')} AND {self.LOADED_NODE.format('m')} "
+                "RETURN count(r) AS count").single()["count"]
+            relationships, embedded_relationships, relationships_matrix = [], [], None
+            for record in session.run(
+                f"MATCH (n)-[r]->(m) WHERE {self.LOADED_NODE.format('n')} AND {self.LOADED_NODE.format('m')} "
+                "RETURN head(labels(n)) AS start_label, n.name AS start, type(r) AS type, "
+                "head(labels(m)) AS end_label, m.name AS end, r.embeddings AS embeddings"
+            ):
+                start, end = entities.get((record["start_label"], record["start"])), entities.get((record["end_label"], record["end"]))
+                if start is None or end is None:
+                    continue
+                relationship = Relationship.model_construct(startEntity=start, endEntity=end, name=record["type"], 
+                                                            properties=RelationshipProperties.model_construct(embeddings=None))
+                if record["embeddings"] not in (None, ""):
+                    relationships_matrix = self._set_embeddings_row(relationships_matrix, len(relationships), record["embeddings"], n_relationships)
+                    embedded_relationships.append((relationship, len(relationships)))
+                relationships.append(relationship)
+        
+        # The rows are attached once the matrices have their final size.
+        for entity, row in embedded_entities:
+            entity.properties.embeddings = entities_matrix[row]
+        for relationship, row in embedded_relationships:
+            relationship.properties.embeddings = relationships_matrix[row]
+        return KnowledgeGraph.model_construct(entities=list(entities.values()), relationships=relationships)
+    
+    def ingest_graph(self, knowledge_graph:KnowledgeGraph, batch_size:int=1000, create_vector_indexes:bool=False) -> dict:
+        """
+        Writes a KnowledgeGraph object in bulk: the nodes are grouped by label and the relationships by type, then each
+        group is sent as parameterized `UNWIND $rows` batches, in explicit transactions over a single session. The idempotent
+        MERGE statements make a re-ingestion update the graph instead of duplicating it, and the parameterized queries
+        are planned once per group.
+        
+        Args:
+        knowledge_graph (KnowledgeGraph): The KnowledgeGraph object containing the graph structure.
+        batch_size (int): The number of rows per transaction. Defaults to 1000.
+        create_vector_indexes (bool): Whether to create the vector indexes of the embeddings (see `create_vector_indexes`). 
+                                      Defaults to False.
         
-        for node in nodes:
-            self.run_query(node)
+        Returns:
+        dict: The statistics of the ingestion: the number of nodes, relationships and batches, the batch size, 
+              the duration and the write throughput (rows per second).
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1.")
+        start_time = time.perf_counter()
+        node_groups = self.group_nodes(knowledge_graph)
+        relationship_groups = self.group_relationships(knowledge_graph)
+        n_batches = 0
+        with self.driver.session() as session:
+            for label, rows in node_groups.items():
+                n_batches += self._write_batches(session, self.nodes_query(label), rows, batch_size)
+            for (rel_type, start_label, end_label), rows in relationship_groups.items():
+                n_batches += self._write_batches(session, self.relationships_query(rel_type, start_label, end_label), rows, batch_size)
+        
+        if create_vector_indexes:
+            self.create_vector_indexes(knowledge_graph)
+        duration = time.perf_counter() - start_time
+        n_nodes = sum(len(rows) for rows in node_groups.values())
+        n_relationships = sum(len(rows) for rows in relationship_groups.values())
+        stats = {
+            "nodes": n_nodes,
+            "relationships": n_relationships,
+            "batches": n_batches,
+            "batch_size": batch_size,
+            "duration_s": duration,
+            "rows_per_second": (n_nodes + n_relationships) / duration if duration else 0.0,
+        }
+        print(f"[INFO] Wrote {n_nodes} nodes and {n_relationships} relationships in {n_batches} batches of at most {batch_size} rows "
+              f"({stats['rows_per_second']:.0f} rows/s)")
+        return stats
 
-        for relation in relationships:
-            self.run_query(relation)
\ No newline at end of file
+    def visualize_graph(self, knowledge_graph:KnowledgeGraph, batch_size:int=1000) -> dict:
+        """
+        Runs the necessary queries to visualize a graph structure from a KnowledgeGraph input, through the bulk ingestion
+        of `ingest_graph`.
+        
+        Args:
+        kg (KnowledgeGraph): The KnowledgeGraph object containing the graph structure.
+        batch_size (int): The number of rows per transaction. Defaults to 1000.
+        
+        Returns:
+        dict: The statistics of the ingestion (see `ingest_graph`).
+        """
+        return self.ingest_graph(knowledge_graph=knowledge_graph, batch_size=batch_size)
+    
+    @staticmethod
+    def content_hash(row: dict) -> str:
+        """
+        The content hash of the row of a node or a relationship, which changes when one of its properties changes.
+        """
+        return hashlib.sha1(json.dumps(row, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    
+    def sync_graph(self, knowledge_graph:KnowledgeGraph, batch_size:int=1000, state_path:str=None) -> dict:
+        """
+        Synchronizes the database with a KnowledgeGraph object by writing only the delta since the last synchronization:
+        the nodes and relationships added or changed (according to their content hashes) are merged, and the removed ones
+        are deleted. The cost of a continuous ingestion is then proportional to what changed, not to the size of the graph.
+        
+        The synced state (the content hash of each node and relationship) is kept in `synced_state` and, when state_path is
+        provided, in a JSON file, so that the synchronization can be resumed by another process. Without state, the first
+        synchronization writes the whole graph.
+        
+        Args:
+        knowledge_graph (KnowledgeGraph): The KnowledgeGraph object containing the graph structure.
+        batch_size (int): The number of rows per transaction. Defaults to 1000.
+        state_path (str, optional): The path of the JSON file of the synced state. Defaults to None.
+        
+        Returns:
+        dict: The number of nodes and relationships added, changed, removed and unchanged, the number of batches and the duration.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1.")
+        start_time = time.perf_counter()
+        state = self.synced_state
+        if state is None and state_path is not None and os.path.exists(state_path):
+            with open(state_path) as file:
+                state = json.load(file)
+        state = state or {"nodes": {}, "relationships": {}}
+        
+        node_rows, relationship_rows = {}, {}
+        for node in knowledge_graph.entities:
+            node_rows[json.dumps([node.label, node.name])] = (node.label, self._node_row(node))
+        for rel in knowledge_graph.relationships:
+            group = self._relationship_group(rel)
+            relationship_rows[json.dumps([*group, rel.startEntity.name, rel.endEntity.name])] = (group, self._relationship_row(rel))
+        new_state = {
+            "nodes": {key: self.content_hash(row) for key, (_, row) in node_rows.items()},
+            "relationships": {key: self.content_hash(row) for key, (_, row) in relationship_rows.items()},
+        }
+        
+        stats = {}
+        upserts, deletions = {}, {}
+        for kind, rows in [("nodes", node_rows), ("relationships", relationship_rows)]:
+            old_hashes, new_hashes = state[kind], new_state[kind]
+            # The added and changed items are written in the order of the graph.
+            upserted = [key for key in new_hashes if old_hashes.get(key) != new_hashes[key]]
+            removed = [key for key in old_hashes if key not in new_hashes]
+            n_added = sum(key not in old_hashes for key in upserted)
+            stats[kind] = {"added": n_added, "changed": len(upserted) - n_added, "removed": len(removed), 
+                           "unchanged": len(new_hashes) - len(upserted)}
+            upserts[kind] = {}
+            for key in upserted:
+                group, row = rows[key]
+                upserts[kind].setdefault(group, []).append(row)
+            deletions[kind] = {}
+            for key in removed:
+                if kind == "nodes":
+                    label, name = json.loads(key)
+                    deletions[kind].setdefault(label, []).append({"name": name})
+                else:
+                    rel_type, start_label, end_label, start, end = json.loads(key)
+                    deletions[kind].setdefault((rel_type, start_label, end_label), []).append({"start": start, "end": end})
+        
+        n_batches = 0
+        with self.driver.session() as session:
+            for (rel_type, start_label, end_label), rows in deletions["relationships"].items():
+                query = (f"UNWIND $rows AS row "
+                         f"MATCH (n:{GraphIntegrator.escape_name(start_label)} {{name: row.start}})"
+                         f"-[r:{GraphIntegrator.escape_name(rel_type)}]->"
+                         f"(m:{GraphIntegrator.escape_name(end_label)} {{name: row.end}}) "
+                         f"DELETE r")
+                n_batches += self._write_batches(session, query, rows, batch_size)
+            for label, rows in deletions["nodes"].items():
+                query = f"UNWIND $rows AS row MATCH (n:{GraphIntegrator.escape_name(label)} {{name: row.name}}) DETACH DELETE n"
+                n_batches += self._write_batches(session, query, rows, batch_size)
+            for label, rows in upserts["nodes"].items():
+                n_batches += self._write_batches(session, self.nodes_query(label), rows, batch_size)
+            for (rel_type, start_label, end_label), rows in upserts["relationships"].items():
+                n_batches += self._write_batches(session, self.relationships_query(rel_type, start_label, end_label), rows, batch_size)
+        
+        self.synced_state = new_state
+        if state_path is not None:
+            with open(state_path, "w") as file:
+                json.dump(new_state, file)
+        
+        stats["batches"] = n_batches
+        stats["duration_s"] = time.perf_counter() - start_time
+        print(f"[INFO] Synced nodes {stats['nodes']} and relationships {stats['relationships']} in {n_batches} batches")
+        return stats
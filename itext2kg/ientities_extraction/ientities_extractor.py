@@ -1,28 +1,43 @@
-from ..utils import LangchainOutputParser, EntitiesExtractor
+from ..utils import LangchainOutputParser, EmbeddingsCache, ResponseCache, RateLimiter, TokenBudget, EntitiesExtractor, ModelCall, run_model_calls, arun_model_calls
 from ..models import Entity, KnowledgeGraph
-from typing import List
+from functools import partial
+from typing import Any, Generator, List
 class iEntitiesExtractor():
     """
     A class to extract entities from text using natural language processing tools and embeddings.
     """
-    def __init__(self, llm_model, embeddings_model, sleep_time:int=5) -> None:        
+    IE_query  = '''
+        # DIRECTIVES : 
+        - Act like an experienced knowledge graph builder.
+        '''
+    
+    def __init__(self, llm_model, embeddings_model, sleep_time:int=5, normalize_embeddings:bool=False, embeddings_cache:EmbeddingsCache=None, response_cache:ResponseCache=None, rate_limiter:RateLimiter=None) -> None:        
         """
         Initializes the iEntitiesExtractor with specified language model, embeddings model, and operational parameters.
         
         Args:
         llm_model: The language model instance to be used for extracting entities from text.
         embeddings_model: The embeddings model instance to be used for generating vector representations of text entities.
-        sleep_time (int): The time to wait (in seconds) when encountering rate limits or errors. Defaults to 5 seconds.
+        sleep_time (int): Kept for compatibility: the waits after rate limit errors are the backoff of the rate limiter.
+        normalize_embeddings (bool): Whether to store the embeddings L2-normalized as float32. Defaults to False.
+        embeddings_cache (EmbeddingsCache, optional): A cache of the embeddings already computed. Defaults to None.
+        response_cache (ResponseCache, optional): A cache of the LLM responses already computed. Defaults to None.
+        rate_limiter (RateLimiter, optional): The rate limiter of the LLM calls. Defaults to None, i.e. `RateLimiter.default()`.
         """
+        self.normalize_embeddings = normalize_embeddings
     
         self.langchain_output_parser =  LangchainOutputParser(llm_model=llm_model,
                                                               embeddings_model=embeddings_model,
-                                                       sleep_time=sleep_time) 
+                                                       sleep_time=sleep_time,
+                                                       embeddings_cache=embeddings_cache,
+                                                       response_cache=response_cache,
+                                                       rate_limiter=rate_limiter) 
     
     def extract_entities(self, context: str, 
                          max_tries:int=5,
                          entity_name_weight:float=0.6,
-                         entity_label_weight:float=0.4) -> List[Entity]:
+                         entity_label_weight:float=0.4,
+                         budget:TokenBudget=None) -> List[Entity]:
         """
         Extract entities from a given context.
         
@@ -33,48 +48,62 @@ class iEntitiesExtractor():
                                      relative importance in the overall evaluation process.
             entity_label_weight (float): The weight of the entity label, set to 0.4, reflecting its
                                       secondary significance in the evaluation process.
+            budget (TokenBudget, optional): The budget of the document, spent by the LLM calls. Defaults to None.
         
         Returns:
             List[Entity]: A list of extracted entities with embeddings.
         
         Raises:
             ValueError: If entity extraction fails after the specified maximum number of attempts.
+            BudgetExceededError: If the budget of the document is spent.
         
         """
-        tries = 0
-        entities = None
-        IE_query  = '''
-        # DIRECTIVES : 
-        - Act like an experienced knowledge graph builder.
-        '''
- 
-        while tries < max_tries:
-            try:
-                entities = self.langchain_output_parser.extract_information_as_json_for_context(
-                    context=context, 
-                    output_data_structure=EntitiesExtractor,
-                    IE_query=IE_query
-                )
-
-                if entities and "entities" in entities.keys():
-                    break
-                
-            except Exception as e:
-                print(f"Not Formatted in the desired format. Error occurred: {e}. Retrying... (Attempt {tries + 1}/{max_tries})")
-
-            tries += 1
+        return run_model_calls(self._extract_entities_steps(context, max_tries, entity_name_weight, entity_label_weight, budget))
     
+    async def aextract_entities(self, context: str, 
+                                max_tries:int=5,
+                                entity_name_weight:float=0.6,
+                                entity_label_weight:float=0.4,
+                                budget:TokenBudget=None) -> List[Entity]:
+        """
+        Asynchronous version of `extract_entities`, relying on the `ainvoke` and `aembed_documents` methods of the models.
+        """
+        return await arun_model_calls(self._extract_entities_steps(context, max_tries, entity_name_weight, entity_label_weight, budget))
+    
+    def _extract_entities_steps(self, context: str, 
+                                max_tries:int,
+                                entity_name_weight:float,
+                                entity_label_weight:float,
+                                budget:TokenBudget) -> Generator[ModelCall, Any, List[Entity]]:
+        """
+        The steps of `extract_entities` and `aextract_entities`, which only differ in how they call the models.
+        """
+        entities = yield from self.langchain_output_parser.extraction_steps(
+            output_data_structure=EntitiesExtractor,
+            context=context,
+            IE_query=self.IE_query,
+            required_key="entities",
+            max_tries=max_tries,
+            budget=budget
+        )
+    
+        kg = self._build_knowledge_graph(entities)
+        yield ModelCall(partial(kg.embed_entities, self.langchain_output_parser.calculate_embeddings),
+                        partial(kg.aembed_entities, self.langchain_output_parser.acalculate_embeddings),
+                        dict(entity_label_weight=entity_label_weight,
+                             entity_name_weight=entity_name_weight,
+                             normalize=self.normalize_embeddings))
+        return kg.entities
+    
+    @staticmethod
+    def _build_knowledge_graph(entities:dict) -> KnowledgeGraph:
+        """
+        Check the output of the LLM and build the (not yet embedded) knowledge graph of the extracted entities.
+        """
         if not entities or "entities" not in entities:
             raise ValueError("Failed to extract entities after multiple attempts.")
 
         print (entities)
         entities = [Entity(label=entity["label"], name = entity["name"]) 
                     for entity in entities["entities"]]
-        #print(entities)
-        kg = KnowledgeGraph(entities = entities, relationships=[])
-        kg.embed_entities(
-            embeddings_function=lambda x:self.langchain_output_parser.calculate_embeddings(x),
-            entity_label_weight=entity_label_weight,
-            entity_name_weight=entity_name_weight
-            )
-        return kg.entities
\ No newline at end of file
+        return KnowledgeGraph(entities = entities, relationships=[])
@@ -1,24 +1,33 @@
-from typing import List
-from ..utils import LangchainOutputParser, RelationshipsExtractor, Matcher
+from functools import partial
+from typing import Any, Dict, Generator, List, Tuple
+from ..utils import LangchainOutputParser, EmbeddingsCache, ResponseCache, RateLimiter, TokenBudget, RelationshipsExtractor, Matcher, ModelCall, run_model_calls, arun_model_calls
 from ..models import Entity, Relationship, KnowledgeGraph
 
 class iRelationsExtractor:
     """
     A class to extract relationships between entities
     """
-    def __init__(self, llm_model, embeddings_model, sleep_time:int=5) -> None:        
+    def __init__(self, llm_model, embeddings_model, sleep_time:int=5, normalize_embeddings:bool=False, embeddings_cache:EmbeddingsCache=None, response_cache:ResponseCache=None, rate_limiter:RateLimiter=None) -> None:        
         """
         Initializes the iRelationsExtractor with specified language model, embeddings model, and operational parameters.
         
         Args:
         llm_model: The language model instance used for extracting relationships between entities.
         embeddings_model: The embeddings model instance used for generating vector representations of entities and relationships.
-        sleep_time (int): The time to wait (in seconds) when encountering rate limits or errors. Defaults to 5 seconds.
+        sleep_time (int): Kept for compatibility: the waits after rate limit errors are the backoff of the rate limiter.
+        normalize_embeddings (bool): Whether to store the embeddings L2-normalized as float32. Defaults to False.
+        embeddings_cache (EmbeddingsCache, optional): A cache of the embeddings already computed. Defaults to None.
+        response_cache (ResponseCache, optional): A cache of the LLM responses already computed. Defaults to None.
+        rate_limiter (RateLimiter, optional): The rate limiter of the LLM calls. Defaults to None, i.e. `RateLimiter.default()`.
         """
+        self.normalize_embeddings = normalize_embeddings
         self.langchain_output_parser =  LangchainOutputParser(llm_model=llm_model,
                                                               embeddings_model=embeddings_model,
-                                                       sleep_time=sleep_time)
-        self.matcher = Matcher()
+                                                       sleep_time=sleep_time,
+                                                       embeddings_cache=embeddings_cache,
+                                                       response_cache=response_cache,
+                                                       rate_limiter=rate_limiter)
+        self.matcher = Matcher(normalized_embeddings=normalize_embeddings)
     
     
     def extract_relations(self, 
@@ -28,6 +37,7 @@ class iRelationsExtractor:
                           max_tries:int=5,
                           entity_name_weight:float=0.6,
                           entity_label_weight:float=0.4,
+                          budget:TokenBudget=None,
                           ) -> List[Relationship]:
         """
         Extract relationships from a given context for specified entities and add embeddings. This method handles the invented entities.
@@ -41,12 +51,82 @@ class iRelationsExtractor:
                                      relative importance in the overall evaluation process.
             entity_label_weight (float): The weight of the entity label, set to 0.4, reflecting its
                                       secondary significance in the evaluation process.
+            budget (TokenBudget, optional): The budget of the document, spent by the LLM calls. Defaults to None.
         
         Returns:
             List[Relationship]: A list of extracted Relationship instances with embeddings.
         
         Raises:
             ValueError: If relationship extraction fails after multiple attempts.
+            BudgetExceededError: If the budget of the document is spent.
+        """
+        return run_model_calls(self._extract_relations_steps(context, entities, isolated_entities_without_relations, max_tries, 
+                                                             entity_name_weight, entity_label_weight, budget))
+    
+    
+    async def aextract_relations(self, 
+                                 context: str, 
+                                 entities: List[Entity], 
+                                 isolated_entities_without_relations: List[Entity] = None,
+                                 max_tries:int=5,
+                                 entity_name_weight:float=0.6,
+                                 entity_label_weight:float=0.4,
+                                 budget:TokenBudget=None,
+                                 ) -> List[Relationship]:
+        """
+        Asynchronous version of `extract_relations`, relying on the `ainvoke` and `aembed_documents` methods of the models.
+        """
+        return await arun_model_calls(self._extract_relations_steps(context, entities, isolated_entities_without_relations, max_tries, 
+                                                                    entity_name_weight, entity_label_weight, budget))
+    
+    
+    def _extract_relations_steps(self, 
+                                 context: str, 
+                                 entities: List[Entity], 
+                                 isolated_entities_without_relations: List[Entity],
+                                 max_tries:int,
+                                 entity_name_weight:float,
+                                 entity_label_weight:float,
+                                 budget:TokenBudget,
+                                 ) -> Generator[ModelCall, Any, List[Relationship]]:
+        """
+        The steps of `extract_relations` and `aextract_relations`, which only differ in how they call the models.
+        """
+        formatted_context, IE_query = self._build_prompt(context, entities, isolated_entities_without_relations)
+        relationships = yield from self.langchain_output_parser.extraction_steps(
+            output_data_structure=RelationshipsExtractor,
+            context=formatted_context,
+            IE_query=IE_query,
+            required_key="relationships",
+            max_tries=max_tries,
+            budget=budget
+        )
+    
+        extracted_relationships, invented_entities = self._verify_entities(relationships, entities)
+        
+        # The invented entities are embedded in a single batch and resolved with a single similarity computation.
+        if invented_entities:
+            invented_kg = KnowledgeGraph(entities=list(invented_entities), relationships=[])
+            yield ModelCall(partial(invented_kg.embed_entities, self.langchain_output_parser.calculate_embeddings),
+                            partial(invented_kg.aembed_entities, self.langchain_output_parser.acalculate_embeddings),
+                            dict(entity_label_weight=entity_label_weight,
+                                 entity_name_weight=entity_name_weight,
+                                 normalize=self.normalize_embeddings))
+            invented_entities = self._resolve_invented_entities(invented_kg.entities, entities)
+        
+        kg = self._build_knowledge_graph(extracted_relationships, invented_entities, entities)
+        yield ModelCall(partial(kg.embed_relationships, self.langchain_output_parser.calculate_embeddings),
+                        partial(kg.aembed_relationships, self.langchain_output_parser.acalculate_embeddings),
+                        dict(normalize=self.normalize_embeddings))
+        return kg.relationships
+    
+    
+    @staticmethod
+    def _build_prompt(context: str, 
+                      entities: List[Entity], 
+                      isolated_entities_without_relations: List[Entity] = None) -> Tuple[str, str]:
+        """
+        Build the context and the query given to the LLM to extract the relationships.
         """
         # we would not give the LLM complex data structure as context to avoid the hallucination as much as possible
         entities_simplified = [(entity.name, entity.label) for entity in entities]
@@ -67,25 +147,18 @@ class iRelationsExtractor:
                     - Based on the provided context, link the entities: \n {isolated_entities_without_relations_simplified} \n to the following entities: \n {entities_simplified}.
                     - Avoid reflexive relations.
                     '''
-        tries = 0
-        relationships = None
-        curated_relationships:List[Relationship]= []
-        
-        while tries < max_tries:
-            try:
-                relationships = self.langchain_output_parser.extract_information_as_json_for_context(
-                    context=formatted_context, output_data_structure=RelationshipsExtractor,
-                    IE_query=IE_query
-                )
-
-                if relationships and "relationships" in relationships.keys():
-                    break
-                
-            except Exception as e:
-                print(f"Not Formatted in the desired format. Error occurred: {e}. Retrying... (Attempt {tries + 1}/{max_tries})")
-
-            tries += 1
+        return formatted_context, IE_query
+    
     
+    @staticmethod
+    def _verify_entities(relationships: dict, entities: List[Entity]) -> Tuple[List[Tuple[Entity, Entity, str]], Dict[Entity, Entity]]:
+        """
+        Check the output of the LLM and replace the endpoints of the extracted relationships by the input entities.
+        
+        Returns:
+            Tuple[List[Tuple[Entity, Entity, str]], Dict[Entity, Entity]]: The (startEntity, endEntity, name) of the extracted 
+                                                                           relationships and the (unique) invented entities.
+        """
         if not relationships or "relationships" not in relationships:
             raise ValueError("Failed to extract relationships after multiple attempts.")
         print(relationships)
@@ -93,6 +166,8 @@ class iRelationsExtractor:
         
         # -------- Verification of invented entities and matching to the closest ones from the input entities-------- #
         print("[INFO] Verification of invented entities")
+        extracted_relationships = []
+        invented_entities = {}
         for relationship in relationships["relationships"]:
             startEntity = Entity(label=relationship["startNode"]["label"], name = relationship["startNode"]["name"])
             endEntity = Entity(label=relationship["endNode"]["label"], name = relationship["endNode"]["name"])
@@ -103,54 +178,34 @@ class iRelationsExtractor:
             startEntity_in_input_entities = kg_llm_output.get_entity(startEntity)
             endEntity_in_input_entities = kg_llm_output.get_entity(endEntity)
             
-            if startEntity_in_input_entities is not None and endEntity_in_input_entities is not None :
-                curated_relationships.append(Relationship(startEntity= startEntity_in_input_entities, 
-                                      endEntity = endEntity_in_input_entities,
-                                      name = relationship["name"]))
-                
-            elif startEntity_in_input_entities is None and endEntity_in_input_entities is None:
-                print(f"[INFO][INVENTED ENTITIES] Aie; the entities {startEntity} and {endEntity} are invented. Solving them ...")
-                startEntity.embed_Entity(embeddings_function=self.langchain_output_parser.calculate_embeddings, 
-                                         entity_label_weight=entity_label_weight, 
-                                         entity_name_weight=entity_name_weight)
-                endEntity.embed_Entity(embeddings_function=self.langchain_output_parser.calculate_embeddings,
-                                       entity_label_weight=entity_label_weight,
-                                       entity_name_weight=entity_name_weight)
-                
-                startEntity = self.matcher.find_match(obj1=startEntity, list_objects=entities, threshold=0.5)
-                endEntity = self.matcher.find_match(obj1=endEntity, list_objects=entities, threshold=0.5)
-                
-                curated_relationships.append(Relationship(startEntity= startEntity, 
-                                      endEntity = endEntity,
-                                      name = relationship["name"]))
-                
-            elif startEntity_in_input_entities is None:
+            if startEntity_in_input_entities is None:
                 print(f"[INFO][INVENTED ENTITIES] Aie; the entities {startEntity} is invented. Solving it ...")
-                startEntity.embed_Entity(embeddings_function=self.langchain_output_parser.calculate_embeddings,
-                                         entity_label_weight=entity_label_weight,
-                                         entity_name_weight=entity_name_weight)
-                startEntity = self.matcher.find_match(obj1=startEntity, list_objects=entities, threshold=0.5)
-                
-                curated_relationships.append(Relationship(startEntity= startEntity, 
-                                      endEntity = endEntity,
-                                      name = relationship["name"]))
-                
-            elif endEntity_in_input_entities is None:
+                startEntity_in_input_entities = invented_entities.setdefault(startEntity, startEntity)
+            if endEntity_in_input_entities is None:
                 print(f"[INFO][INVENTED ENTITIES] Aie; the entities {endEntity} is invented. Solving it ...")
-                endEntity.embed_Entity(embeddings_function=self.langchain_output_parser.calculate_embeddings,
-                                       entity_label_weight=entity_label_weight,
-                                       entity_name_weight=entity_name_weight)
-                endEntity = self.matcher.find_match(obj1=endEntity, list_objects=entities, threshold=0.5)
+                endEntity_in_input_entities = invented_entities.setdefault(endEntity, endEntity)
                 
-                curated_relationships.append(Relationship(startEntity= startEntity, 
-                                      endEntity = endEntity,
-                                      name = relationship["name"]))
-        
-        kg = KnowledgeGraph(relationships = curated_relationships, entities=entities)
-        kg.embed_relationships(
-            embeddings_function=lambda x:self.langchain_output_parser.calculate_embeddings(x)
-            )
-        return kg.relationships
+            extracted_relationships.append((startEntity_in_input_entities, endEntity_in_input_entities, relationship["name"]))
+        return extracted_relationships, invented_entities
+    
+    
+    def _resolve_invented_entities(self, invented_entities: List[Entity], entities: List[Entity]) -> Dict[Entity, Entity]:
+        """
+        Match the (embedded) invented entities to the closest input entities.
+        """
+        return dict(zip(invented_entities, 
+                        self.matcher.find_matches(list1=invented_entities, list_objects=entities, threshold=0.5)))
+    
+    
+    @staticmethod
+    def _build_knowledge_graph(extracted_relationships: List[Tuple[Entity, Entity, str]], 
+                               resolved_entities: Dict[Entity, Entity], 
+                               entities: List[Entity]) -> KnowledgeGraph:
+        curated_relationships = [Relationship(startEntity= resolved_entities.get(startEntity, startEntity), 
+                                              endEntity = resolved_entities.get(endEntity, endEntity),
+                                              name = name)
+                                 for startEntity, endEntity, name in extracted_relationships]
+        return KnowledgeGraph(relationships = curated_relationships, entities=entities)
     
     
     def extract_verify_and_correct_relations(self,
@@ -160,7 +215,8 @@ class iRelationsExtractor:
                           max_tries:int=5,
                           max_tries_isolated_entities:int=3,
                           entity_name_weight:float=0.6,
-                          entity_label_weight:float=0.4) -> List[Relationship]:
+                          entity_label_weight:float=0.4,
+                          budget:TokenBudget=None) -> List[Relationship]:
         """
         Extract, verify, and correct relationships between entities in the given context.
 
@@ -174,32 +230,77 @@ class iRelationsExtractor:
                                      relative importance in the overall evaluation process.
             entity_label_weight (float): The weight of the entity label, set to 0.4, reflecting its
                                       secondary significance in the evaluation process.
+            budget (TokenBudget, optional): The budget of the document, spent by the LLM calls. It also decides whether another 
+                                            round for the isolated entities is worth doing. Defaults to None.
         
         Returns:
             List[Relationship]: A list of curated Relationship instances after verification and correction.
         """
+        return run_model_calls(self._extract_verify_and_correct_relations_steps(context, entities, rel_threshold, max_tries, 
+                                                                                max_tries_isolated_entities, entity_name_weight, 
+                                                                                entity_label_weight, budget))
+
+
+    async def aextract_verify_and_correct_relations(self,
+                          context: str, 
+                          entities: List[Entity],
+                          rel_threshold:float = 0.7,
+                          max_tries:int=5,
+                          max_tries_isolated_entities:int=3,
+                          entity_name_weight:float=0.6,
+                          entity_label_weight:float=0.4,
+                          budget:TokenBudget=None) -> List[Relationship]:
+        """
+        Asynchronous version of `extract_verify_and_correct_relations`.
+        """
+        return await arun_model_calls(self._extract_verify_and_correct_relations_steps(context, entities, rel_threshold, max_tries, 
+                                                                                       max_tries_isolated_entities, entity_name_weight, 
+                                                                                       entity_label_weight, budget))
+
+
+    def _extract_verify_and_correct_relations_steps(self,
+                          context: str, 
+                          entities: List[Entity],
+                          rel_threshold:float,
+                          max_tries:int,
+                          max_tries_isolated_entities:int,
+                          entity_name_weight:float,
+                          entity_label_weight:float,
+                          budget:TokenBudget) -> Generator[ModelCall, Any, List[Relationship]]:
+        """
+        The steps of `extract_verify_and_correct_relations` and `aextract_verify_and_correct_relations`.
+        """
         tries = 0
         isolated_entities_without_relations:List[Entity]= []
-        curated_relationships = self.extract_relations(context=context,
-                                                   entities=entities,
-                                                   max_tries=max_tries,
-                                                   entity_name_weight=entity_name_weight,
-                                                   entity_label_weight=entity_label_weight)
+        # The extractions are model calls of their own: extract_relations or aextract_relations.
+        curated_relationships = yield ModelCall(self.extract_relations, self.aextract_relations,
+                                                dict(context=context,
+                                                     entities=entities,
+                                                     max_tries=max_tries,
+                                                     entity_name_weight=entity_name_weight,
+                                                     entity_label_weight=entity_label_weight,
+                                                     budget=budget))
         
         # -------- Verification of isolated entities without relations and re-prompting the LLM accordingly-------- #   
-        isolated_entities_without_relations = KnowledgeGraph(entities=entities, 
-                                                             relationships=curated_relationships).find_isolated_entities()
+        # The graph of the curated relationships indexes the degrees of the entities, updated as relationships are appended.
+        curated_kg = KnowledgeGraph(entities=entities, relationships=curated_relationships)
+        isolated_entities_without_relations = curated_kg.find_isolated_entities()
         
         while tries < max_tries_isolated_entities and isolated_entities_without_relations:
+            if budget is not None and not budget.allows_isolated_entities_round(len(isolated_entities_without_relations), len(entities)):
+                print(f"[INFO][ISOLATED ENTITIES] The budget does not allow another round for {len(isolated_entities_without_relations)} isolated entities.")
+                break
             print(f"[INFO][ISOLATED ENTITIES][TRY-{tries+1}] Aie; there are some isolated entities without relations {isolated_entities_without_relations}. Solving them ...")  
-            corrected_relationships = self.extract_relations(context = context, 
-                                entities=isolated_entities_without_relations,
-                                isolated_entities_without_relations=isolated_entities_without_relations,
-                                entity_name_weight=entity_name_weight,
-                                entity_label_weight=entity_label_weight)
-            matched_corrected_relationships, _ = self.matcher.process_lists(list1 = corrected_relationships, list2=curated_relationships, threshold=rel_threshold)
-            curated_relationships.extend(matched_corrected_relationships)
+            corrected_relationships = yield ModelCall(self.extract_relations, self.aextract_relations,
+                                                      dict(context = context, 
+                                                           entities=isolated_entities_without_relations,
+                                                           isolated_entities_without_relations=isolated_entities_without_relations,
+                                                           entity_name_weight=entity_name_weight,
+                                                           entity_label_weight=entity_label_weight,
+                                                           budget=budget))
+            matched_corrected_relationships, _ = self.matcher.process_lists(list1 = corrected_relationships, list2=curated_kg.relationships, threshold=rel_threshold)
+            curated_kg.relationships.extend(matched_corrected_relationships)
                 
-            isolated_entities_without_relations = KnowledgeGraph(entities=entities, relationships=corrected_relationships).find_isolated_entities()
+            isolated_entities_without_relations = curated_kg.find_isolated_entities()
             tries += 1
-        return curated_relationships
\ No newline at end of file
+        return curated_kg.relationships
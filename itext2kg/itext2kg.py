@@ -1,33 +1,98 @@
-from typing import List
+import asyncio
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
 from .ientities_extraction import iEntitiesExtractor
 from .irelations_extraction import iRelationsExtractor
-from .utils import Matcher, LangchainOutputParser
-from .models import KnowledgeGraph
+from .utils import Matcher, LangchainOutputParser, VectorIndex, EmbeddingsCache, ResponseCache, RateLimiter, BuildCheckpoint, EntityStore, TokenBudget
+from .models import Entity, Relationship, KnowledgeGraph, KnowledgeGraphDelta
+
+def _build_document_graph(itext2kg:"iText2KG", sections:List[str], build_options:dict) -> Tuple[KnowledgeGraph, TokenBudget]:
+    """
+    Build the graph of one document of iText2KG.build_graphs, returning it with the budget of the document (None without 
+    budget), whose counters a process worker could not update in place. The workers are module-level functions, so 
+    that they can be sent to a ProcessPoolExecutor along with the builder.
+    """
+    return itext2kg.build_graph(sections, **build_options), build_options.get("budget")
+
+
+def _merge_graph_pair(itext2kg:"iText2KG", 
+                      knowledge_graph1:KnowledgeGraph, 
+                      knowledge_graph2:KnowledgeGraph, 
+                      ent_threshold:float, 
+                      rel_threshold:float) -> KnowledgeGraph:
+    """
+    Merge two graphs of a level of iText2KG.build_graphs, see `_build_document_graph`.
+    """
+    return itext2kg._merge_graphs(knowledge_graph1, knowledge_graph2, ent_threshold, rel_threshold)
+
 
 class iText2KG:
     """
     A class designed to extract knowledge from text and structure it into a knowledge graph using
     entity and relationship extraction powered by language models.
     """
-    def __init__(self, llm_model, embeddings_model, sleep_time:int=5) -> None:        
+    def __init__(self, 
+                 llm_model, 
+                 embeddings_model, 
+                 sleep_time:int=5, 
+                 index_factory:Callable[[], VectorIndex]=None, 
+                 blocking:Union[str, Dict[str, Iterable[str]]]=None, 
+                 relationship_blocking:str=None,
+                 normalize_embeddings:bool=False,
+                 embeddings_cache:EmbeddingsCache=None,
+                 response_cache:ResponseCache=None,
+                 rate_limiter:RateLimiter=None) -> None:        
         """
         Initializes the iText2KG with specified language model, embeddings model, and operational parameters.
         
         Args:
         llm_model: The language model instance to be used for extracting entities and relationships from text.
         embeddings_model: The embeddings model instance to be used for creating vector representations of extracted entities.
-        sleep_time (int): The time to wait (in seconds) when encountering rate limits or errors. Defaults to 5 seconds.
+        sleep_time (int): Kept for compatibility: the waits after rate limit errors are the backoff of the rate limiter.
+        index_factory (Callable[[], VectorIndex], optional): Callable returning an empty nearest-neighbour index (e.g. IVFVectorIndex or 
+                                                             FaissVectorIndex) used to match against large global and existing entity 
+                                                             lists. Defaults to None, i.e. exact search.
+        blocking (Union[str, Dict[str, Iterable[str]]], optional): Restricts the entity matching to the same label ("label") or to compatible 
+                                                                   labels (a dict mapping a label to its compatible labels). Defaults to None.
+        relationship_blocking (str, optional): Restricts the relationship matching across sections to the relationships between the same 
+                                               (startEntity, endEntity) pair ("endpoints") or sharing their start or their end entity 
+                                               ("endpoint"), so that it scales with the local density of the graph. Defaults to None.
+        normalize_embeddings (bool, optional): Whether to store the embeddings L2-normalized as float32, which halves their memory and turns 
+                                               the cosine similarity into a dot product. The embeddings of an existing knowledge graph passed 
+                                               to build_graph must then be normalized too (see KnowledgeGraph.normalize_embeddings). Defaults to False.
+        embeddings_cache (EmbeddingsCache, optional): A cache shared by the extractors, so that the texts already embedded (labels, 
+                                                      relation names, ...) are not sent again to the embeddings model. Defaults to None.
+        response_cache (ResponseCache, optional): A cache shared by the extractors, so that re-running build_graph over unchanged sections 
+                                                  with the same model does not call the model again. Defaults to None.
+        rate_limiter (RateLimiter, optional): The token-bucket rate limiter shared by all the LLM calls (e.g. RateLimiter(requests_per_minute=500, 
+                                              tokens_per_minute=200_000)). Defaults to None, i.e. the process-wide `RateLimiter.default()`, 
+                                              also shared with the DocumentsDistiller instances created without a rate limiter.
         """
+        if rate_limiter is None:
+            rate_limiter = RateLimiter.default()
+        self.rate_limiter = rate_limiter
         self.ientities_extractor =  iEntitiesExtractor(llm_model=llm_model, 
                                                        embeddings_model=embeddings_model,
-                                                       sleep_time=sleep_time) 
+                                                       sleep_time=sleep_time,
+                                                       normalize_embeddings=normalize_embeddings,
+                                                       embeddings_cache=embeddings_cache,
+                                                       response_cache=response_cache,
+                                                       rate_limiter=rate_limiter) 
         
         self.irelations_extractor = iRelationsExtractor(llm_model=llm_model, 
                                                         embeddings_model=embeddings_model,
-                                                        sleep_time=sleep_time)
+                                                        sleep_time=sleep_time,
+                                                        normalize_embeddings=normalize_embeddings,
+                                                        embeddings_cache=embeddings_cache,
+                                                        response_cache=response_cache,
+                                                        rate_limiter=rate_limiter)
 
-        self.matcher = Matcher()
-        self.langchain_output_parser = LangchainOutputParser(llm_model=llm_model, embeddings_model=embeddings_model)
+        self.matcher = Matcher(index_factory=index_factory, 
+                               blocking=blocking, 
+                               normalized_embeddings=normalize_embeddings, 
+                               relationship_blocking=relationship_blocking)
+        self.langchain_output_parser = LangchainOutputParser(llm_model=llm_model, embeddings_model=embeddings_model, embeddings_cache=embeddings_cache, response_cache=response_cache, rate_limiter=rate_limiter)
 
 
     def build_graph(self, 
@@ -39,6 +104,8 @@ class iText2KG:
                     max_tries_isolated_entities:int=3,
                     entity_name_weight:float=0.6,
                     entity_label_weight:float=0.4,
+                    checkpoint_dir:str=None,
+                    budget:TokenBudget=None,
                     ) -> KnowledgeGraph:
         """
         Builds a knowledge graph from text by extracting entities and relationships, then integrating them into a structured graph.
@@ -60,45 +127,368 @@ class iText2KG:
         max_tries (int, optional): The maximum number of attempts to extract entities and relationships. Defaults to 5.
         max_tries_isolated_entities (int, optional): The maximum number of attempts to process isolated entities 
                                                      (entities without relationships). Defaults to 3.
+        checkpoint_dir (str, optional): A directory where the entities and relationships extracted from each section and 
+                                        the global ones are saved after each section (see `BuildCheckpoint`). A rerun with 
+                                        the same sections and options resumes after the last completed section. Defaults to None.
+        budget (TokenBudget, optional): The budget of LLM calls and tokens of the document, restarted by this call. When it is 
+                                        spent, the build stops with a BudgetExceededError; it also decides whether another 
+                                        round for the isolated entities of a section is worth doing. Defaults to None.
         
 
         Returns:
         KnowledgeGraph: A constructed knowledge graph consisting of the merged entities and relationships extracted 
                         from the text.
         """
-        print("[INFO] ------- Extracting Entities from the Document", 1)
-        global_entities = self.ientities_extractor.extract_entities(context=sections[0],
-                                                                    entity_name_weight= entity_name_weight,
-                                                                    entity_label_weight=entity_label_weight)
-        print("[INFO] ------- Extracting Relations from the Document", 1)
-        global_relationships = self.irelations_extractor.extract_verify_and_correct_relations(context=sections[0], 
-                                                                                              entities = global_entities, 
-                                                                                              rel_threshold=rel_threshold, 
-                                                                                              max_tries=max_tries, 
-                                                                                              max_tries_isolated_entities=max_tries_isolated_entities,
-                                                                                              entity_name_weight= entity_name_weight,
-                                                                                              entity_label_weight=entity_label_weight)
+        global_entities, global_relationships = [], []
+        # The deltas of the sections add up to the global entities and relationships, in their insertion order.
+        for delta in self.stream_graph(sections=sections,
+                                       ent_threshold=ent_threshold,
+                                       rel_threshold=rel_threshold,
+                                       max_tries=max_tries,
+                                       max_tries_isolated_entities=max_tries_isolated_entities,
+                                       entity_name_weight=entity_name_weight,
+                                       entity_label_weight=entity_label_weight,
+                                       checkpoint_dir=checkpoint_dir,
+                                       budget=budget):
+            global_entities.extend(delta.added_entities)
+            global_relationships.extend(delta.added_relationships)
+        
+        return self._finalize_graph(global_entities=global_entities, 
+                                    global_relationships=global_relationships, 
+                                    existing_knowledge_graph=existing_knowledge_graph,
+                                    ent_threshold=ent_threshold,
+                                    rel_threshold=rel_threshold)
+    
+    
+    def stream_graph(self, 
+                     sections:Iterable[str], 
+                     existing_knowledge_graph:KnowledgeGraph=None, 
+                     ent_threshold:float = 0.7, 
+                     rel_threshold:float = 0.7, 
+                     max_tries:int=5, 
+                     max_tries_isolated_entities:int=3,
+                     entity_name_weight:float=0.6,
+                     entity_label_weight:float=0.4,
+                     checkpoint_dir:str=None,
+                     budget:TokenBudget=None,
+                     ) -> Iterator[KnowledgeGraphDelta]:
+        """
+        Streaming version of `build_graph`: the sections are consumed one by one from any iterable (e.g. a generator 
+        reading a feed), and the changes of the graph are yielded after each section, so that consumers such as a graph 
+        writer can start before the end of the document. Only the global entities and relationships are kept in memory.
+
+        The items of an existing knowledge graph are the initial global items, so the sections are matched against it
+        as they come, instead of being merged into it at the end.
+
+        Args:
+        sections (Iterable[str]): The sections of the document.
+        existing_knowledge_graph (KnowledgeGraph, optional): An existing knowledge graph to extend. Default is None.
+        ent_threshold (float, optional): The threshold for entity matching. Default is 0.7.
+        rel_threshold (float, optional): The threshold for relationship matching. Default is 0.7.
+        max_tries (int, optional): The maximum number of attempts to extract entities and relationships. Defaults to 5.
+        max_tries_isolated_entities (int, optional): The maximum number of attempts to process isolated entities. Defaults to 3.
+        entity_name_weight (float): The weight of the entity name. Defaults to 0.6.
+        entity_label_weight (float): The weight of the entity label. Defaults to 0.4.
+        checkpoint_dir (str, optional): A checkpoint directory (see `build_graph`). The sections are then read up front, since 
+                                        the checkpoint is fingerprinted with all of them. When the stream resumes, its first delta 
+                                        holds the whole restored graph, with the section of the last completed one, so that the 
+                                        deltas still add up to the graph. Defaults to None.
+        budget (TokenBudget, optional): The budget of LLM calls and tokens of the document (see `build_graph`). Defaults to None.
+
+        Yields:
+        KnowledgeGraphDelta: For each section, the entities and relationships added to the graph and the ones the items 
+                             of the section were merged into.
+        """
+        if budget is not None:
+            budget.start_document()
+        checkpoint = None
+        completed_sections = 0
+        entities = existing_knowledge_graph.entities if existing_knowledge_graph else []
+        relationships = existing_knowledge_graph.relationships if existing_knowledge_graph else []
+        if checkpoint_dir is not None:
+            sections = list(sections)
+            options = dict(ent_threshold=ent_threshold, 
+                           rel_threshold=rel_threshold, 
+                           max_tries=max_tries, 
+                           max_tries_isolated_entities=max_tries_isolated_entities, 
+                           entity_name_weight=entity_name_weight, 
+                           entity_label_weight=entity_label_weight)
+            if existing_knowledge_graph:
+                # The existing knowledge graph is part of the checkpointed state.
+                options["existing_knowledge_graph"] = ([(entity.name, entity.label) for entity in entities],
+                                                       [(rel.startEntity.name, rel.name, rel.endEntity.name) for rel in relationships])
+            checkpoint = BuildCheckpoint(checkpoint_dir, BuildCheckpoint.fingerprint(sections, **options))
+            completed_sections, restored_entities, restored_relationships = checkpoint.load_state()
+            if completed_sections:
+                print(f"[INFO] ------- Resuming from the checkpoint after {completed_sections} sections")
+                entities, relationships = restored_entities, restored_relationships
+        global_entities = self.matcher.create_store(entities)
+        global_relationships = self.matcher.create_store(relationships)
+        if completed_sections:
+            yield KnowledgeGraphDelta.model_construct(section=completed_sections - 1,
+                                                      added_entities=global_entities.to_list(),
+                                                      merged_entities=[],
+                                                      added_relationships=global_relationships.to_list(),
+                                                      merged_relationships=[])
         
-                
-        for i in range(1, len(sections)):
+        for i, section in enumerate(sections):
+            if i < completed_sections:
+                continue
             print("[INFO] ------- Extracting Entities from the Document", i+1)
-            entities = self.ientities_extractor.extract_entities(context= sections[i],
-                                                                 entity_name_weight= entity_name_weight,
-                                                                 entity_label_weight=entity_label_weight)
-            processed_entities, global_entities = self.matcher.process_lists(list1 = entities, list2=global_entities, threshold=ent_threshold)
+            entities = checkpoint.load_section_entities(i) if checkpoint else None
+            if entities is None:
+                entities = self.ientities_extractor.extract_entities(context= section,
+                                                                     entity_name_weight= entity_name_weight,
+                                                                     entity_label_weight=entity_label_weight,
+                                                                     budget=budget)
+                if checkpoint:
+                    checkpoint.save_section_entities(i, entities)
+            processed_entities, added_entities, merged_entities = self._merge_into_store(entities, global_entities, ent_threshold)
             
             print("[INFO] ------- Extracting Relations from the Document", i+1)
-            relationships = self.irelations_extractor.extract_verify_and_correct_relations(context= sections[i], 
-                                                                                           entities=processed_entities, 
-                                                                                           rel_threshold=rel_threshold,
-                                                                                           max_tries=max_tries, 
-                                                                                           max_tries_isolated_entities=max_tries_isolated_entities,
-                                                                                           entity_name_weight= entity_name_weight,
-                                                                                           entity_label_weight=entity_label_weight)
-            processed_relationships, _ = self.matcher.process_lists(list1 = relationships, list2=global_relationships, threshold=rel_threshold)
+            relationships = checkpoint.load_section_relationships(i) if checkpoint else None
+            if relationships is None:
+                relationships = self.irelations_extractor.extract_verify_and_correct_relations(context= section, 
+                                                                                               entities=processed_entities, 
+                                                                                               rel_threshold=rel_threshold,
+                                                                                               max_tries=max_tries, 
+                                                                                               max_tries_isolated_entities=max_tries_isolated_entities,
+                                                                                               entity_name_weight= entity_name_weight,
+                                                                                               entity_label_weight=entity_label_weight,
+                                                                                               budget=budget)
+                if checkpoint:
+                    checkpoint.save_section_relationships(i, relationships)
+            _, added_relationships, merged_relationships = self._merge_into_store(relationships, global_relationships, rel_threshold)
+            if checkpoint:
+                checkpoint.save_state(i + 1, global_entities.to_list(), global_relationships.to_list())
+            yield KnowledgeGraphDelta.model_construct(section=i,
+                                                      added_entities=added_entities,
+                                                      merged_entities=merged_entities,
+                                                      added_relationships=added_relationships,
+                                                      merged_relationships=merged_relationships)
+    
+    
+    def _merge_into_store(self, 
+                          objects:List[Union[Entity, Relationship]], 
+                          store:EntityStore, 
+                          threshold:float) -> Tuple[List[Union[Entity, Relationship]], List[Union[Entity, Relationship]], List[Union[Entity, Relationship]]]:
+        """
+        Match objects against a global store and insert the new ones. 
+        Returns the matched objects, the objects added to the store and the objects of the store they were merged into.
+        """
+        if not len(store):
+            added = store.add(objects)
+            return objects, added, []
+        size = len(store)
+        matched = self.matcher.process_store(list1=objects, store=store, threshold=threshold)
+        added = store.objects[size:]
+        added_set = set(added)
+        merged = [store.get(obj) for obj in dict.fromkeys(matched) if obj not in added_set]
+        return matched, added, merged
+    
+    
+    async def abuild_graph(self, 
+                           sections:List[str], 
+                           existing_knowledge_graph:KnowledgeGraph=None, 
+                           ent_threshold:float = 0.7, 
+                           rel_threshold:float = 0.7, 
+                           max_tries:int=5, 
+                           max_tries_isolated_entities:int=3,
+                           entity_name_weight:float=0.6,
+                           entity_label_weight:float=0.4,
+                           max_concurrency:int=4,
+                           budget:TokenBudget=None,
+                           ) -> KnowledgeGraph:
+        """
+        Asynchronous version of `build_graph`. The LLM extractions of the sections run concurrently, through the 
+        `ainvoke` and `aembed_documents` methods of the models, while the merges into the global entities and 
+        relationships are applied in the order of the sections, so the result matches the one of `build_graph`.
+        
+        The entities of all the sections are extracted concurrently. As soon as the entities of a section are merged
+        into the global entities, the extraction of its relations starts, since it only depends on the processed 
+        entities of that section. The relations are then merged in the order of the sections.
+
+        Args:
+        sections (List[str]): A list of strings where each string represents a section of the document.
+        existing_knowledge_graph (KnowledgeGraph, optional): An existing knowledge graph to merge the newly extracted 
+                                                             entities and relationships into. Default is None.
+        ent_threshold (float, optional): The threshold for entity matching. Default is 0.7.
+        rel_threshold (float, optional): The threshold for relationship matching. Default is 0.7.
+        max_tries (int, optional): The maximum number of attempts to extract entities and relationships. Defaults to 5.
+        max_tries_isolated_entities (int, optional): The maximum number of attempts to process isolated entities. Defaults to 3.
+        entity_name_weight (float): The weight of the entity name. Defaults to 0.6.
+        entity_label_weight (float): The weight of the entity label. Defaults to 0.4.
+        max_concurrency (int, optional): The maximum number of sections processed by the LLM at the same time. Defaults to 4.
+        budget (TokenBudget, optional): The budget of LLM calls and tokens of the document (see `build_graph`). Defaults to None.
+
+        Returns:
+        KnowledgeGraph: A constructed knowledge graph consisting of the merged entities and relationships extracted 
+                        from the text.
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1.")
+        if budget is not None:
+            budget.start_document()
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def extract_entities(i:int):
+            async with semaphore:
+                print("[INFO] ------- Extracting Entities from the Document", i+1)
+                return await self.ientities_extractor.aextract_entities(context=sections[i],
+                                                                        max_tries=max_tries,
+                                                                        entity_name_weight= entity_name_weight,
+                                                                        entity_label_weight=entity_label_weight,
+                                                                        budget=budget)
+        
+        async def extract_relations(i:int, entities):
+            async with semaphore:
+                print("[INFO] ------- Extracting Relations from the Document", i+1)
+                return await self.irelations_extractor.aextract_verify_and_correct_relations(context=sections[i], 
+                                                                                             entities=entities, 
+                                                                                             rel_threshold=rel_threshold,
+                                                                                             max_tries=max_tries, 
+                                                                                             max_tries_isolated_entities=max_tries_isolated_entities,
+                                                                                             entity_name_weight= entity_name_weight,
+                                                                                             entity_label_weight=entity_label_weight,
+                                                                                             budget=budget)
+        
+        entities_tasks = [asyncio.ensure_future(extract_entities(i)) for i in range(len(sections))]
+        relations_tasks = []
+        try:
+            # The stores start empty, as in stream_graph, so that a call without sections returns an empty graph.
+            global_entities = self.matcher.create_store([])
+            for i, entities_task in enumerate(entities_tasks):
+                entities = await entities_task
+                processed_entities, _, _ = self._merge_into_store(entities, global_entities, ent_threshold)
+                relations_tasks.append(asyncio.ensure_future(extract_relations(i, processed_entities)))
             
-            global_relationships.extend(processed_relationships)
+            global_relationships = self.matcher.create_store([])
+            for relations_task in relations_tasks:
+                relationships = await relations_task
+                self._merge_into_store(relationships, global_relationships, rel_threshold)
+        finally:
+            for task in entities_tasks + relations_tasks:
+                task.cancel()
         
+        return self._finalize_graph(global_entities=global_entities.to_list(), 
+                                    global_relationships=global_relationships.to_list(), 
+                                    existing_knowledge_graph=existing_knowledge_graph,
+                                    ent_threshold=ent_threshold,
+                                    rel_threshold=rel_threshold)
+    
+    
+    def build_graphs(self, 
+                     documents:List[List[str]], 
+                     existing_knowledge_graph:KnowledgeGraph=None, 
+                     ent_threshold:float = 0.7, 
+                     rel_threshold:float = 0.7, 
+                     max_tries:int=5, 
+                     max_tries_isolated_entities:int=3,
+                     entity_name_weight:float=0.6,
+                     entity_label_weight:float=0.4,
+                     max_workers:int=None,
+                     executor:Executor=None,
+                     checkpoint_dir:str=None,
+                     budget:TokenBudget=None,
+                     ) -> KnowledgeGraph:
+        """
+        Builds a knowledge graph from several documents. The graph of each document is built independently (see `build_graph`),
+        in parallel, then the graphs are merged pairwise in a tree: each level merges the graphs of consecutive documents with 
+        the semantics of `match_entities_and_update_relationships`, the earlier document playing the existing knowledge graph.
+        The merge work then grows as n log n with the number of documents, instead of n² when each document is merged into
+        an ever-growing graph, and the merges of a level run in parallel too.
+
+        Args:
+        documents (List[List[str]]): The documents, each one being a list of sections.
+        existing_knowledge_graph (KnowledgeGraph, optional): An existing knowledge graph to merge the graph of the documents 
+                                                             into. Default is None.
+        ent_threshold (float, optional): The threshold for entity matching. Default is 0.7.
+        rel_threshold (float, optional): The threshold for relationship matching. Default is 0.7.
+        max_tries (int, optional): The maximum number of attempts to extract entities and relationships. Defaults to 5.
+        max_tries_isolated_entities (int, optional): The maximum number of attempts to process isolated entities. Defaults to 3.
+        entity_name_weight (float): The weight of the entity name. Defaults to 0.6.
+        entity_label_weight (float): The weight of the entity label. Defaults to 0.4.
+        max_workers (int, optional): The number of workers of the default thread pool. Defaults to the default of ThreadPoolExecutor.
+        executor (Executor, optional): The executor running the builds and the merges. Defaults to None, i.e. a thread pool, which 
+                                       suits the builds since they mostly wait for the models, but runs the Python parts of the merges 
+                                       under the GIL. A ProcessPoolExecutor also runs the merges in parallel; the builder is then sent 
+                                       to the workers, so its models and index_factory must be picklable (the caches, the rate limiter 
+                                       and the matcher are, each worker getting its own rate limiter and reopening the on-disk caches).
+        checkpoint_dir (str, optional): A directory holding the checkpoint of each document (see `build_graph`) in its subdirectory 
+                                        `document-<i>`, so that a failed run resumes the documents where they stopped. Defaults to None.
+        budget (TokenBudget, optional): The budget of LLM calls and tokens of each document (see `build_graph`). Every document is 
+                                        built with a budget of the same limits and its own counters, whose totals are added to this 
+                                        budget once the documents are built. Defaults to None.
+
+        Returns:
+        KnowledgeGraph: A constructed knowledge graph consisting of the merged entities and relationships extracted 
+                        from the documents.
+        """
+        if not documents:
+            raise ValueError("Please provide at least one document.")
+        build_options = dict(ent_threshold=ent_threshold, 
+                             rel_threshold=rel_threshold, 
+                             max_tries=max_tries, 
+                             max_tries_isolated_entities=max_tries_isolated_entities,
+                             entity_name_weight=entity_name_weight,
+                             entity_label_weight=entity_label_weight)
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            builds = []
+            for i, sections in enumerate(documents):
+                document_options = dict(build_options,
+                                        checkpoint_dir=os.path.join(checkpoint_dir, f"document-{i}") if checkpoint_dir is not None else None,
+                                        budget=budget.document_budget() if budget is not None else None)
+                builds.append(executor.submit(_build_document_graph, self, sections, document_options))
+            graphs = []
+            for future in builds:
+                graph, document_budget = future.result()
+                graphs.append(graph)
+                if budget is not None:
+                    budget.add_totals(document_budget)
+            level = 1
+            while len(graphs) > 1:
+                print(f"[INFO] ------- Merging {len(graphs)} Knowledge Graphs (level {level})")
+                merges = [executor.submit(_merge_graph_pair, self, graphs[i], graphs[i + 1], ent_threshold, rel_threshold) 
+                          for i in range(0, len(graphs) - 1, 2)]
+                graphs = [future.result() for future in merges] + graphs[len(graphs) - len(graphs) % 2:]
+                level += 1
+        finally:
+            if own_executor:
+                executor.shutdown()
+        
+        if existing_knowledge_graph:
+            return self._merge_graphs(existing_knowledge_graph, graphs[0], ent_threshold, rel_threshold)
+        return graphs[0]
+    
+    
+    def _merge_graphs(self, 
+                      knowledge_graph1:KnowledgeGraph, 
+                      knowledge_graph2:KnowledgeGraph, 
+                      ent_threshold:float = 0.7, 
+                      rel_threshold:float = 0.7) -> KnowledgeGraph:
+        """
+        Merge knowledge_graph2 into knowledge_graph1, as build_graph merges a document into an existing knowledge graph.
+        """
+        return self._finalize_graph(global_entities=knowledge_graph2.entities, 
+                                    global_relationships=knowledge_graph2.relationships, 
+                                    existing_knowledge_graph=knowledge_graph1,
+                                    ent_threshold=ent_threshold,
+                                    rel_threshold=rel_threshold)
+    
+    
+    def _finalize_graph(self, 
+                        global_entities:List[Entity], 
+                        global_relationships:List[Relationship], 
+                        existing_knowledge_graph:KnowledgeGraph=None, 
+                        ent_threshold:float = 0.7, 
+                        rel_threshold:float = 0.7) -> KnowledgeGraph:
+        """
+        Merge the global entities and relationships of the document with the existing knowledge graph, if any,
+        and build the deduplicated knowledge graph.
+        """
         if existing_knowledge_graph:
             print(f"[INFO] ------- Matching the Document {1} Entities and Relationships with the Existing Global Entities/Relations")
             global_entities, global_relationships = self.matcher.match_entities_and_update_relationships(entities1=global_entities,
@@ -113,4 +503,3 @@ class iText2KG:
         constructed_kg.remove_duplicates_relationships()
          
         return constructed_kg
-    
\ No newline at end of file
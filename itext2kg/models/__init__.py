@@ -1,3 +1,4 @@
-from .knowledge_graph import Entity, Relationship, KnowledgeGraph
+from .knowledge_graph import Entity, Relationship, KnowledgeGraph, KnowledgeGraphDelta, normalize_embeddings
+from .compact_knowledge_graph import CompactKnowledgeGraph
 
-__all__ = ["Entity", "Relationship", "KnowledgeGraph"]
\ No newline at end of file
+__all__ = ["Entity", "Relationship", "KnowledgeGraph", "KnowledgeGraphDelta", "CompactKnowledgeGraph", "normalize_embeddings"]
\ No newline at end of file
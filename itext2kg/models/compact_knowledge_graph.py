@@ -0,0 +1,223 @@
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from .knowledge_graph import Entity, EntityProperties, Relationship, RelationshipProperties, KnowledgeGraph
+
+COLUMNAR_FORMAT_VERSION = 1
+
+def _stack_embeddings_column(embeddings:List[Optional[np.array]]) -> Tuple[np.array, np.array]:
+    """
+    Stack a column of embeddings into a matrix, with a mask of the rows having embeddings (the other rows are zeros).
+    """
+    mask = np.array([embedding is not None for embedding in embeddings], dtype=bool)
+    dimensions = {np.shape(embedding) for embedding in embeddings if embedding is not None}
+    if len(dimensions) > 1:
+        raise ValueError(f"All the embeddings must have the same shape, got {sorted(dimensions)}.")
+    dimension, = dimensions.pop() if dimensions else (0,)
+    dtype = np.result_type(*(np.asarray(embedding).dtype for embedding in embeddings if embedding is not None)) if mask.any() else np.float64
+    matrix = np.zeros((len(embeddings), dimension), dtype=dtype)
+    for row, embedding in enumerate(embeddings):
+        if embedding is not None:
+            matrix[row] = embedding
+    return matrix, mask
+
+def _encode_strings(strings:List[str]) -> Tuple[List[str], np.array]:
+    """
+    Encode a column of strings as a table of the unique strings and the int32 code of each string.
+    """
+    table = list(dict.fromkeys(strings))
+    codes = {string: code for code, string in enumerate(table)}
+    return table, np.array([codes[string] for string in strings], dtype=np.int32)
+
+def _same_embeddings(embeddings1:Optional[np.array], embeddings2:Optional[np.array]) -> bool:
+    if embeddings1 is None or embeddings2 is None:
+        return embeddings1 is None and embeddings2 is None
+    return np.array_equal(embeddings1, embeddings2)
+
+
+class CompactKnowledgeGraph:
+    """
+    An array-backed representation of a KnowledgeGraph. The entities are rows of parallel columns (names, label codes
+    into a table of labels) and of a contiguous embeddings matrix, the relationships reference them by row and share a
+    table of names. It has no per-item pydantic object, which makes large graphs cheap to keep in memory, to save and to
+    memory-map, and converts losslessly from and to KnowledgeGraph.
+
+    The first `n_entities` rows are the entities of the graph. The endpoints of relationships which are not entities of
+    the graph, or whose embeddings differ from them, are extra rows after them.
+    """
+    __slots__ = ("entity_names", "labels", "entity_labels", "entity_embeddings", "entity_embeddings_mask", "n_entities",
+                 "relationship_names", "relationship_name_codes", "relationship_starts", "relationship_ends",
+                 "relationship_embeddings", "relationship_embeddings_mask")
+
+    def __init__(self,
+                 entity_names:List[str],
+                 labels:List[str],
+                 entity_labels:np.array,
+                 entity_embeddings:np.array,
+                 entity_embeddings_mask:np.array,
+                 relationship_names:List[str],
+                 relationship_name_codes:np.array,
+                 relationship_starts:np.array,
+                 relationship_ends:np.array,
+                 relationship_embeddings:np.array,
+                 relationship_embeddings_mask:np.array,
+                 n_entities:int=None) -> None:
+        """
+        Args:
+        entity_names (List[str]): The name of each entity row.
+        labels (List[str]): The table of the labels.
+        entity_labels (np.array): The code of the label of each entity row, in the table of the labels.
+        entity_embeddings (np.array): The embeddings matrix of the entity rows.
+        entity_embeddings_mask (np.array): Whether each entity row has embeddings.
+        relationship_names (List[str]): The table of the relationship names.
+        relationship_name_codes (np.array): The code of the name of each relationship, in the table of the names.
+        relationship_starts (np.array): The entity row of the start of each relationship.
+        relationship_ends (np.array): The entity row of the end of each relationship.
+        relationship_embeddings (np.array): The embeddings matrix of the relationships.
+        relationship_embeddings_mask (np.array): Whether each relationship has embeddings.
+        n_entities (int, optional): The number of entity rows which are entities of the graph. Defaults to all of them.
+        """
+        self.entity_names = entity_names
+        self.labels = labels
+        self.entity_labels = entity_labels
+        self.entity_embeddings = entity_embeddings
+        self.entity_embeddings_mask = entity_embeddings_mask
+        self.n_entities = len(entity_names) if n_entities is None else n_entities
+        self.relationship_names = relationship_names
+        self.relationship_name_codes = relationship_name_codes
+        self.relationship_starts = relationship_starts
+        self.relationship_ends = relationship_ends
+        self.relationship_embeddings = relationship_embeddings
+        self.relationship_embeddings_mask = relationship_embeddings_mask
+
+    @property
+    def n_relationships(self) -> int:
+        return len(self.relationship_name_codes)
+
+    @classmethod
+    def from_knowledge_graph(cls, knowledge_graph:KnowledgeGraph) -> "CompactKnowledgeGraph":
+        """
+        Convert a KnowledgeGraph: its entities become the first rows and the endpoints of its relationships are mapped
+        to the rows of the equal entities with the same embeddings.
+        """
+        rows = list(knowledge_graph.entities)
+        positions: Dict[Entity, int] = {}
+        for row, entity in enumerate(rows):
+            positions.setdefault(entity, row)
+
+        def endpoint_row(entity:Entity) -> int:
+            row = positions.get(entity)
+            if row is not None:
+                stored = rows[row]
+                if stored is entity or _same_embeddings(stored.properties.embeddings, entity.properties.embeddings):
+                    return row
+            rows.append(entity)
+            if row is None:
+                positions[entity] = len(rows) - 1
+            return len(rows) - 1
+
+        relationships = knowledge_graph.relationships
+        starts = np.array([endpoint_row(rel.startEntity) for rel in relationships], dtype=np.int64)
+        ends = np.array([endpoint_row(rel.endEntity) for rel in relationships], dtype=np.int64)
+        labels, entity_labels = _encode_strings([entity.label for entity in rows])
+        relationship_names, relationship_name_codes = _encode_strings([rel.name for rel in relationships])
+        entity_embeddings, entity_embeddings_mask = _stack_embeddings_column([entity.properties.embeddings for entity in rows])
+        relationship_embeddings, relationship_embeddings_mask = _stack_embeddings_column([rel.properties.embeddings for rel in relationships])
+        return cls(entity_names=[entity.name for entity in rows],
+                   labels=labels,
+                   entity_labels=entity_labels,
+                   entity_embeddings=entity_embeddings,
+                   entity_embeddings_mask=entity_embeddings_mask,
+                   relationship_names=relationship_names,
+                   relationship_name_codes=relationship_name_codes,
+                   relationship_starts=starts,
+                   relationship_ends=ends,
+                   relationship_embeddings=relationship_embeddings,
+                   relationship_embeddings_mask=relationship_embeddings_mask,
+                   n_entities=len(knowledge_graph.entities))
+
+    def get_entity(self, row:int) -> Entity:
+        """
+        Build the Entity of a row. Its embeddings are a view of the embeddings matrix.
+        """
+        return Entity.model_construct(
+            label=self.labels[self.entity_labels[row]],
+            name=self.entity_names[row],
+            properties=EntityProperties.model_construct(
+                embeddings=self.entity_embeddings[row] if self.entity_embeddings_mask[row] else None))
+
+    def to_knowledge_graph(self) -> KnowledgeGraph:
+        """
+        Convert to a KnowledgeGraph, without pydantic validation. The endpoints of the relationships are the Entity objects
+        of their rows, and the embeddings are views of the embeddings matrices.
+        """
+        entities = [self.get_entity(row) for row in range(len(self.entity_names))]
+        relationships = [
+            Relationship.model_construct(
+                startEntity=entities[start],
+                endEntity=entities[end],
+                name=self.relationship_names[name_code],
+                properties=RelationshipProperties.model_construct(
+                    embeddings=self.relationship_embeddings[row] if self.relationship_embeddings_mask[row] else None))
+            for row, (name_code, start, end) in enumerate(zip(self.relationship_name_codes.tolist(),
+                                                              self.relationship_starts.tolist(),
+                                                              self.relationship_ends.tolist()))
+        ]
+        return KnowledgeGraph.model_construct(entities=entities[:self.n_entities], relationships=relationships)
+
+    def find_isolated_entities(self) -> np.array:
+        """
+        The rows of the entities of the graph which are endpoints of no relationship.
+        """
+        degrees = (np.bincount(self.relationship_starts, minlength=len(self.entity_names))
+                   + np.bincount(self.relationship_ends, minlength=len(self.entity_names)))
+        return np.flatnonzero(degrees[:self.n_entities] == 0)
+
+    def save(self, path:str) -> None:
+        """
+        Save the graph in a columnar directory: the string tables and the metadata in `graph.json`, the integer columns
+        (label and relationship name codes, relationship endpoints) and the embeddings matrices in `.npy` files.
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "entity_labels.npy"), self.entity_labels)
+        np.save(os.path.join(path, "entity_embeddings.npy"), self.entity_embeddings)
+        np.save(os.path.join(path, "entity_embeddings_mask.npy"), self.entity_embeddings_mask)
+        np.save(os.path.join(path, "relationship_names.npy"), self.relationship_name_codes)
+        np.save(os.path.join(path, "relationship_starts.npy"), self.relationship_starts)
+        np.save(os.path.join(path, "relationship_ends.npy"), self.relationship_ends)
+        np.save(os.path.join(path, "relationship_embeddings.npy"), self.relationship_embeddings)
+        np.save(os.path.join(path, "relationship_embeddings_mask.npy"), self.relationship_embeddings_mask)
+        with open(os.path.join(path, "graph.json"), "w") as file:
+            json.dump({
+                "version": COLUMNAR_FORMAT_VERSION,
+                "n_entities": self.n_entities,
+                "entity_names": self.entity_names,
+                "labels": self.labels,
+                "relationship_names": self.relationship_names,
+            }, file)
+
+    @classmethod
+    def load(cls, path:str, mmap:bool=True) -> "CompactKnowledgeGraph":
+        """
+        Load a graph saved by `save`. With mmap, the embeddings matrices are memory-mapped, so only the rows which are
+        used are paged in from the disk.
+        """
+        with open(os.path.join(path, "graph.json")) as file:
+            metadata = json.load(file)
+        if metadata.get("version") != COLUMNAR_FORMAT_VERSION:
+            raise ValueError(f"Unsupported knowledge graph format version: {metadata.get('version')}.")
+        mmap_mode = "r" if mmap else None
+        load = lambda name, mode=None: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode)
+        return cls(entity_names=metadata["entity_names"],
+                   labels=metadata["labels"],
+                   entity_labels=load("entity_labels"),
+                   entity_embeddings=load("entity_embeddings", mmap_mode),
+                   entity_embeddings_mask=load("entity_embeddings_mask"),
+                   relationship_names=metadata["relationship_names"],
+                   relationship_name_codes=load("relationship_names"),
+                   relationship_starts=load("relationship_starts"),
+                   relationship_ends=load("relationship_ends"),
+                   relationship_embeddings=load("relationship_embeddings", mmap_mode),
+                   relationship_embeddings_mask=load("relationship_embeddings_mask"),
+                   n_entities=metadata["n_entities"])
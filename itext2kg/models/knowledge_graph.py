@@ -1,8 +1,40 @@
-from pydantic import BaseModel, SkipValidation
-from typing import Callable
+from pydantic import BaseModel, PrivateAttr, SkipValidation, field_validator
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 import numpy as np
 import re
 
+def normalize_embeddings(embeddings:np.array) -> np.array:
+    """
+    L2-normalize embeddings (a single vector or one vector per row) and store them as float32,
+    so that the cosine similarity between them becomes a plain dot product.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+def _scatter_embeddings(unique_texts:List[str], unique_embeddings:np.array, texts_lists:Tuple[List[str], ...]) -> Tuple[np.array, ...]:
+    positions = {text: position for position, text in enumerate(unique_texts)}
+    return tuple(unique_embeddings[[positions[text] for text in texts]] for texts in texts_lists)
+
+def embed_unique_texts(embeddings_function:Callable[[List[str]], np.array], *texts_lists:List[str]) -> Tuple[np.array, ...]:
+    """
+    Embed several lists of texts with a single call of embeddings_function on their unique texts,
+    then scatter the embeddings back to each list.
+    """
+    unique_texts = list(dict.fromkeys(text for texts in texts_lists for text in texts))
+    if not unique_texts:
+        return tuple(np.array([]) for _ in texts_lists)
+    return _scatter_embeddings(unique_texts, np.asarray(embeddings_function(unique_texts)), texts_lists)
+
+async def aembed_unique_texts(aembeddings_function:Callable[[List[str]], Awaitable[np.array]], *texts_lists:List[str]) -> Tuple[np.array, ...]:
+    """
+    Asynchronous version of `embed_unique_texts`.
+    """
+    unique_texts = list(dict.fromkeys(text for texts in texts_lists for text in texts))
+    if not unique_texts:
+        return tuple(np.array([]) for _ in texts_lists)
+    return _scatter_embeddings(unique_texts, np.asarray(await aembeddings_function(unique_texts)), texts_lists)
+
 class EntityProperties(BaseModel):
     embeddings: SkipValidation[np.array]=None
     class Config:
@@ -26,13 +58,16 @@ class Entity(BaseModel):
     def embed_Entity(self,
                      embeddings_function:Callable[[str], np.array],
                      entity_name_weight:float=0.6,
-                     entity_label_weight:float=0.4)-> None:
+                     entity_label_weight:float=0.4,
+                     normalize:bool=False)-> None:
         self.process()
         self.properties.embeddings = (
             entity_name_weight * embeddings_function(self.name)
             +
             entity_label_weight * embeddings_function(self.label)
         )
+        if normalize:
+            self.properties.embeddings = normalize_embeddings(self.properties.embeddings)
         
     def __eq__(self, other) -> bool:
         if isinstance(other, Entity):
@@ -55,9 +90,11 @@ class Relationship(BaseModel):
         # Replace spaces, dashes, periods, and '&' in names with underscores or 'and'.
         self.name = re.sub(r'[^a-zA-Z0-9]', '_', self.name).replace("&", "and")
             
-    def embed_relationship(self, embeddings_function:Callable[[str], np.array]):
+    def embed_relationship(self, embeddings_function:Callable[[str], np.array], normalize:bool=False):
         self.process()
         self.properties.embeddings = embeddings_function(self.name)
+        if normalize:
+            self.properties.embeddings = normalize_embeddings(self.properties.embeddings)
         
     def __eq__(self, other) -> bool:
         if isinstance(other, Relationship):
@@ -74,60 +111,271 @@ class Relationship(BaseModel):
         return f"Relationship(name={self.name}, startEntity={self.startEntity}, endEntity={self.endEntity}, properties={self.properties})"
     
 
+class _TrackedList(list):
+    """
+    A list counting its mutations other than appends (item assignment, insertion, removal, sorting, ...), so that 
+    the indexes of a KnowledgeGraph, built incrementally over the appended items, know when they must be rebuilt.
+    """
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+        self.rewrites = 0
+
+    def _rewritten(method):
+        def rewrite(self, *args, **kwargs):
+            self.rewrites += 1
+            return method(self, *args, **kwargs)
+        rewrite.__name__ = method.__name__
+        return rewrite
+
+    __setitem__ = _rewritten(list.__setitem__)
+    __delitem__ = _rewritten(list.__delitem__)
+    __imul__ = _rewritten(list.__imul__)
+    insert = _rewritten(list.insert)
+    pop = _rewritten(list.pop)
+    remove = _rewritten(list.remove)
+    clear = _rewritten(list.clear)
+    sort = _rewritten(list.sort)
+    reverse = _rewritten(list.reverse)
+    del _rewritten
+
+
 class KnowledgeGraph(BaseModel):
     entities:list[Entity]= []
     relationships:list[Relationship] = []
+    # Lookup and adjacency indexes, synced lazily with the lists: the items appended since the last lookup are indexed 
+    # incrementally, and the indexes are rebuilt when a list is reassigned or mutated otherwise (the lists of a graph are
+    # _TrackedLists counting these mutations). Modifying the name or the label of an entity in place requires 
+    # `invalidate_indexes`.
+    _entities_index:Dict[Entity, Entity] = PrivateAttr(default_factory=dict)
+    _outgoing:Dict[Entity, List[Relationship]] = PrivateAttr(default_factory=dict)
+    _incoming:Dict[Entity, List[Relationship]] = PrivateAttr(default_factory=dict)
+    _degrees:Dict[Entity, int] = PrivateAttr(default_factory=dict)
+    _indexed_entities:Tuple[Optional[list], int, int] = PrivateAttr(default=(None, 0, 0))
+    _indexed_relationships:Tuple[Optional[list], int, int] = PrivateAttr(default=(None, 0, 0))
+    
+    @field_validator("entities", "relationships")
+    @classmethod
+    def _track_list(cls, value:list) -> list:
+        return _TrackedList(value)
+    
+    def __setattr__(self, name:str, value) -> None:
+        if name in ("entities", "relationships") and not isinstance(value, _TrackedList):
+            value = _TrackedList(value)
+        super().__setattr__(name, value)
+    
+    def _tracked(self, name:str) -> _TrackedList:
+        """
+        The list of entities or relationships, made a _TrackedList if the graph was built without validation.
+        """
+        value = getattr(self, name)
+        if not isinstance(value, _TrackedList):
+            value = _TrackedList(value)
+            setattr(self, name, value)
+        return value
     
     def embed_entities(self,
                        embeddings_function:Callable[[str], np.array],
                        entity_name_weight:float=0.6,
-                       entity_label_weight:float=0.4)-> None:
+                       entity_label_weight:float=0.4,
+                       normalize:bool=False)-> None:
+        """
+        Embed the entities as a weighted sum of the embeddings of their names and labels.
+        If normalize is True, the embeddings are L2-normalized once and stored as float32.
+        """
+        # The unique names and labels are embedded in a single batch, then scattered back to the entities.
+        names_embeddings, labels_embeddings = embed_unique_texts(embeddings_function, *self._prepare_entities_texts())
+        self._set_entities_embeddings(names_embeddings, labels_embeddings, entity_name_weight, entity_label_weight, normalize)
+    
+    async def aembed_entities(self,
+                              aembeddings_function:Callable[[List[str]], Awaitable[np.array]],
+                              entity_name_weight:float=0.6,
+                              entity_label_weight:float=0.4,
+                              normalize:bool=False)-> None:
+        """
+        Asynchronous version of `embed_entities`.
+        """
+        names_embeddings, labels_embeddings = await aembed_unique_texts(aembeddings_function, *self._prepare_entities_texts())
+        self._set_entities_embeddings(names_embeddings, labels_embeddings, entity_name_weight, entity_label_weight, normalize)
+    
+    def _prepare_entities_texts(self) -> Tuple[List[str], List[str]]:
         self.remove_duplicates_entities()
         for Entity in self.entities:
             Entity.process()
+        return [Entity.name for Entity in self.entities], [Entity.label for Entity in self.entities]
+    
+    def _set_entities_embeddings(self, 
+                                 names_embeddings:np.array, 
+                                 labels_embeddings:np.array, 
+                                 entity_name_weight:float, 
+                                 entity_label_weight:float, 
+                                 normalize:bool) -> None:
         entities_embeddings = (
-            entity_label_weight * embeddings_function([Entity.label for Entity in self.entities]) 
+            entity_label_weight * labels_embeddings
             +  
-            entity_name_weight * embeddings_function([Entity.name for Entity in self.entities])
+            entity_name_weight * names_embeddings
             )
+        if normalize:
+            entities_embeddings = normalize_embeddings(entities_embeddings)
         
         for Entity, embedding in zip(self.entities, entities_embeddings):
             Entity.properties.embeddings = embedding
             
         
-    def embed_relationships(self, embeddings_function:Callable[[str], np.array])-> None:
+    def embed_relationships(self, embeddings_function:Callable[[str], np.array], normalize:bool=False)-> None:
+        """
+        Embed the relationships by their names.
+        If normalize is True, the embeddings are L2-normalized once and stored as float32.
+        """
+        relationships_embeddings, = embed_unique_texts(embeddings_function, self._prepare_relationships_texts())
+        self._set_relationships_embeddings(relationships_embeddings, normalize)
+    
+    async def aembed_relationships(self, aembeddings_function:Callable[[List[str]], Awaitable[np.array]], normalize:bool=False)-> None:
+        """
+        Asynchronous version of `embed_relationships`.
+        """
+        relationships_embeddings, = await aembed_unique_texts(aembeddings_function, self._prepare_relationships_texts())
+        self._set_relationships_embeddings(relationships_embeddings, normalize)
+    
+    def _prepare_relationships_texts(self) -> List[str]:
         self.remove_duplicates_relationships()
         for relationship in self.relationships:
             relationship.process()
-        
-        relationships_embeddings = (
-            embeddings_function([relationship.name for relationship in self.relationships]) 
-            )
+        return [relationship.name for relationship in self.relationships]
+    
+    def _set_relationships_embeddings(self, relationships_embeddings:np.array, normalize:bool) -> None:
+        if normalize:
+            relationships_embeddings = normalize_embeddings(relationships_embeddings)
         
         for relationship, embedding in zip(self.relationships, relationships_embeddings):
             relationship.properties.embeddings = embedding
     
+    def normalize_embeddings(self) -> None:
+        """
+        Convert the embeddings of an already embedded graph (e.g. an existing knowledge graph) 
+        to L2-normalized float32 vectors, as produced by the embed methods with normalize=True.
+        """
+        for obj in [*self.entities, *self.relationships]:
+            if obj.properties.embeddings is not None:
+                obj.properties.embeddings = normalize_embeddings(obj.properties.embeddings)
+    
+    def invalidate_indexes(self) -> None:
+        """
+        Drop the lookup and adjacency indexes, e.g. after modifying the name or the label of entities in place.
+        They are rebuilt on the next lookup.
+        """
+        self._indexed_entities = (None, 0, 0)
+        self._indexed_relationships = (None, 0, 0)
+    
+    def _sync_entities_index(self) -> Dict[Entity, Entity]:
+        entities = self._tracked("entities")
+        indexed_list, n_indexed, rewrites = self._indexed_entities
+        if indexed_list is not entities or entities.rewrites != rewrites or len(entities) < n_indexed:
+            self._entities_index = {}
+            n_indexed = 0
+        for entity in entities[n_indexed:]:
+            self._entities_index.setdefault(entity, entity)
+        self._indexed_entities = (entities, len(entities), entities.rewrites)
+        return self._entities_index
+    
+    def _sync_relationships_index(self) -> None:
+        relationships = self._tracked("relationships")
+        indexed_list, n_indexed, rewrites = self._indexed_relationships
+        if indexed_list is not relationships or relationships.rewrites != rewrites or len(relationships) < n_indexed:
+            self._outgoing, self._incoming, self._degrees = {}, {}, {}
+            n_indexed = 0
+        for relationship in relationships[n_indexed:]:
+            self._outgoing.setdefault(relationship.startEntity, []).append(relationship)
+            self._incoming.setdefault(relationship.endEntity, []).append(relationship)
+            self._degrees[relationship.startEntity] = self._degrees.get(relationship.startEntity, 0) + 1
+            self._degrees[relationship.endEntity] = self._degrees.get(relationship.endEntity, 0) + 1
+        self._indexed_relationships = (relationships, len(relationships), relationships.rewrites)
+    
     def get_entity(self, other_entity:Entity):
-        for entity in self.entities:
-            if entity == other_entity : 
-                return entity
-        return None
+        """
+        Get the (first) entity of the graph equal to other_entity, or None, in O(1).
+        """
+        return self._sync_entities_index().get(other_entity)
+    
+    def get_outgoing_relationships(self, entity:Entity) -> List[Relationship]:
+        """
+        The relationships starting from an entity.
+        """
+        self._sync_relationships_index()
+        return list(self._outgoing.get(entity, []))
+    
+    def get_incoming_relationships(self, entity:Entity) -> List[Relationship]:
+        """
+        The relationships ending at an entity.
+        """
+        self._sync_relationships_index()
+        return list(self._incoming.get(entity, []))
+    
+    def get_neighbours(self, entity:Entity) -> List[Entity]:
+        """
+        The (unique) entities linked to an entity by a relationship, in either direction.
+        """
+        self._sync_relationships_index()
+        return list(dict.fromkeys([*(relationship.endEntity for relationship in self._outgoing.get(entity, [])),
+                                   *(relationship.startEntity for relationship in self._incoming.get(entity, []))]))
+    
+    def degree(self, entity:Entity) -> int:
+        """
+        The number of relationships starting from or ending at an entity.
+        """
+        self._sync_relationships_index()
+        return self._degrees.get(entity, 0)
         
     def remove_duplicates_entities(self) -> None:
         """
         Remove duplicate entities (entities) by relying on the `__hash__` and `__eq__` methods of the `Entity` class.
         This will update the `entities` attribute by filtering out duplicates.
         """
-        self.entities = list(set(self.entities))  # Using set to automatically remove duplicates based on hash and eq methods
+        self.entities = list(dict.fromkeys(self.entities))  # Using an ordered dict to remove duplicates based on hash and eq methods while keeping the order
 
     def remove_duplicates_relationships(self) -> None:
         """
         Remove duplicate relationships by relying on the `__hash__` and `__eq__` methods of the `Relationship` class.
         This will update the `relationships` attribute by filtering out duplicates.
         """
-        self.relationships = list(set(self.relationships))  # Using set to automatically remove duplicates based on hash and eq methods
+        self.relationships = list(dict.fromkeys(self.relationships))  # Using an ordered dict to remove duplicates based on hash and eq methods while keeping the order
     
     def find_isolated_entities(self):
-        relation_entities = set(rel.startEntity for rel in self.relationships) | set(rel.endEntity for rel in self.relationships)
-        isolated_entities = [ent for ent in self.entities if ent not in relation_entities]
-        return isolated_entities
\ No newline at end of file
+        self._sync_relationships_index()
+        isolated_entities = [ent for ent in self.entities if ent not in self._degrees]
+        return isolated_entities
+    
+    def save(self, path:str) -> None:
+        """
+        Save the graph in a columnar directory (see `CompactKnowledgeGraph.save`): string tables, integer columns and 
+        the embeddings matrices in `.npy` files.
+        """
+        from .compact_knowledge_graph import CompactKnowledgeGraph
+        CompactKnowledgeGraph.from_knowledge_graph(self).save(path)
+    
+    @classmethod
+    def load(cls, path:str, mmap:bool=True) -> "KnowledgeGraph":
+        """
+        Load a graph saved by `save`. With mmap, the embeddings matrices are memory-mapped: the embeddings of each entity
+        and relationship are read-only rows of them, paged in from the disk when they are used.
+        """
+        from .compact_knowledge_graph import CompactKnowledgeGraph
+        return CompactKnowledgeGraph.load(path, mmap=mmap).to_knowledge_graph()
+
+
+class KnowledgeGraphDelta(BaseModel):
+    """
+    The changes of a knowledge graph after one section of a streamed build (see iText2KG.stream_graph): the entities 
+    and relationships which were added to the graph, and the already known ones the items of the section were merged into.
+    """
+    section:int = 0
+    added_entities:list[Entity] = []
+    merged_entities:list[Entity] = []
+    added_relationships:list[Relationship] = []
+    merged_relationships:list[Relationship] = []
+    
+    def to_knowledge_graph(self) -> KnowledgeGraph:
+        """
+        The entities and relationships of the section as a KnowledgeGraph, e.g. to upsert them with GraphIntegrator.ingest_graph.
+        """
+        return KnowledgeGraph.model_construct(entities=self.added_entities + self.merged_entities, 
+                                              relationships=self.added_relationships + self.merged_relationships)
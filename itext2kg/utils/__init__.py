@@ -1,9 +1,33 @@
 from .llm_output_parser import LangchainOutputParser
 from .schemas import InformationRetriever, EntitiesExtractor, RelationshipsExtractor, Article, CV
 from .matcher import Matcher
+from .entity_store import EntityStore
+from .cache import EmbeddingsCache, ResponseCache
+from .rate_limiter import RateLimiter
+from .budget import TokenBudget, BudgetExceededError
+from .model_calls import ModelCall, run_model_calls, arun_model_calls
+from .checkpoint import BuildCheckpoint
+from .section_chunker import SectionChunker
+from .vector_index import VectorIndex, ExactVectorIndex, IVFVectorIndex, FaissVectorIndex, benchmark_vector_index
 
 __all__ = ["LangchainOutputParser", 
            "Matcher", 
+           "EntityStore",
+           "EmbeddingsCache",
+           "ResponseCache",
+           "RateLimiter",
+           "TokenBudget",
+           "BudgetExceededError",
+           "ModelCall",
+           "run_model_calls",
+           "arun_model_calls",
+           "BuildCheckpoint",
+           "SectionChunker",
+           "VectorIndex",
+           "ExactVectorIndex",
+           "IVFVectorIndex",
+           "FaissVectorIndex",
+           "benchmark_vector_index",
            "InformationRetriever", 
            "EntitiesExtractor", 
            "RelationshipsExtractor", 
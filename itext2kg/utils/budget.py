@@ -0,0 +1,165 @@
+import threading
+from typing import Any, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+
+class BudgetExceededError(ValueError):
+    """
+    Raised before an LLM call when the budget of the document is spent.
+    """
+
+
+class TokenBudget(BaseCallbackHandler):
+    """
+    A budget of LLM calls and tokens per document. It is a LangChain callback handler: the parser passes it to the calls of
+    the model, and it counts the calls and the tokens reported by the responses (`usage_metadata` of the messages, or the
+    `token_usage` of the provider). Before each call, the parser checks that the budget is not spent, and the isolated
+    entities loop of the relations extractor asks it whether another round is worth its cost, so that runaway documents
+    cannot blow the latency or the spend.
+    """
+    def __init__(self,
+                 max_tokens: int = None,
+                 max_calls: int = None,
+                 min_isolated_entities: int = 1,
+                 min_isolated_entities_ratio: float = 0.0) -> None:
+        """
+        Args:
+        max_tokens (int, optional): Maximum number of tokens (input and output) per document. Defaults to None, i.e. unlimited.
+        max_calls (int, optional): Maximum number of LLM calls per document. Defaults to None, i.e. unlimited.
+        min_isolated_entities (int): Minimum number of isolated entities for which another isolated entities round is done.
+                                     Defaults to 1.
+        min_isolated_entities_ratio (float): Minimum fraction of the entities of a section which must be isolated for another
+                                             isolated entities round. Defaults to 0.
+        """
+        self.max_tokens = max_tokens
+        self.max_calls = max_calls
+        self.min_isolated_entities = min_isolated_entities
+        self.min_isolated_entities_ratio = min_isolated_entities_ratio
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.last_call_tokens = 0
+        self.total_calls = 0
+        self.total_tokens = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # The lock is not sent to other processes, and the counters of a copy are not added back to the original.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def document_budget(self) -> "TokenBudget":
+        """
+        A budget with the same limits and its own counters, for a document built concurrently with others 
+        (see iText2KG.build_graphs). Its totals are added back with `add_totals`.
+        """
+        return TokenBudget(max_tokens=self.max_tokens,
+                           max_calls=self.max_calls,
+                           min_isolated_entities=self.min_isolated_entities,
+                           min_isolated_entities_ratio=self.min_isolated_entities_ratio)
+
+    def add_totals(self, other: "TokenBudget") -> None:
+        """
+        Add the total calls and tokens of another budget, e.g. of a document budget.
+        """
+        with self._lock:
+            self.total_calls += other.total_calls
+            self.total_tokens += other.total_tokens
+
+    @property
+    def tokens(self) -> int:
+        """
+        The number of tokens used by the current document.
+        """
+        return self.input_tokens + self.output_tokens
+
+    def start_document(self) -> None:
+        """
+        Reset the counters of the current document (the totals are kept).
+        """
+        with self._lock:
+            self.calls = self.input_tokens = self.output_tokens = self.last_call_tokens = 0
+
+    @staticmethod
+    def _usage(response: LLMResult) -> tuple:
+        """
+        The (input, output) tokens reported by a response, or (0, 0) when the model does not report them.
+        """
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        input_tokens, output_tokens = self._usage(response)
+        self.record(input_tokens, output_tokens)
+
+    def record(self, input_tokens: int, output_tokens: int) -> None:
+        """
+        Count one LLM call and its tokens.
+        """
+        with self._lock:
+            self.calls += 1
+            self.total_calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.last_call_tokens = input_tokens + output_tokens
+            self.total_tokens += input_tokens + output_tokens
+
+    def remaining_tokens(self) -> Optional[int]:
+        """
+        The number of tokens left for the current document, or None without token limit.
+        """
+        return None if self.max_tokens is None else max(self.max_tokens - self.tokens, 0)
+
+    def exhausted(self) -> bool:
+        """
+        Whether the calls or the tokens of the current document are spent.
+        """
+        return ((self.max_calls is not None and self.calls >= self.max_calls)
+                or (self.max_tokens is not None and self.tokens >= self.max_tokens))
+
+    def check(self) -> None:
+        """
+        Raises:
+        BudgetExceededError: If the budget of the current document is spent.
+        """
+        if self.exhausted():
+            raise BudgetExceededError(f"The budget of the document is spent: {self.calls} calls and {self.tokens} tokens "
+                                      f"(limits: {self.max_calls} calls, {self.max_tokens} tokens).")
+
+    def allows_isolated_entities_round(self, n_isolated_entities: int, n_entities: int) -> bool:
+        """
+        Whether another round of relations extraction for the isolated entities is worth doing: enough entities are still
+        isolated, and the budget can afford another call as costly as the last one (the round resends the section).
+        """
+        if n_isolated_entities < self.min_isolated_entities:
+            return False
+        if n_entities and n_isolated_entities / n_entities < self.min_isolated_entities_ratio:
+            return False
+        if self.max_calls is not None and self.calls + 1 > self.max_calls:
+            return False
+        remaining_tokens = self.remaining_tokens()
+        return remaining_tokens is None or remaining_tokens >= self.last_call_tokens
+
+    def stats(self) -> dict:
+        """
+        The counters of the current document and the totals.
+        """
+        return {
+            "calls": self.calls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "tokens": self.tokens,
+            "total_calls": self.total_calls,
+            "total_tokens": self.total_tokens,
+        }
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+
+
+def get_model_id(model) -> str:
+    """
+    Identify a LangChain model by its class and its model name (e.g. "OpenAIEmbeddings:text-embedding-3-large").
+    """
+    model_name = getattr(model, "model", None) or getattr(model, "model_name", None) or ""
+    return f"{type(model).__name__}:{model_name}"
+
+
+def get_model_params(model) -> dict:
+    """
+    The parameters identifying the behaviour of a LangChain model (model name, temperature, ...), or an empty dict.
+    """
+    params = getattr(model, "_identifying_params", None)
+    return params if isinstance(params, dict) else {}
+
+
+class SQLiteStore:
+    """
+    A minimal thread-safe key/value store of bytes persisted in a SQLite table.
+    """
+    def __init__(self, path: str, table: str) -> None:
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB)")
+
+    def __getstate__(self) -> dict:
+        # The connection is not sent to other processes: the copy opens its own connection to the same database.
+        return {"path": self.path, "table": self.table}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["path"], state["table"])
+
+    def get_many(self, keys: List[str]) -> dict:
+        values = {}
+        with self._lock:
+            # SQLite limits the number of variables of a query.
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, value FROM {self.table} WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                values.update(rows)
+        return values
+
+    def set_many(self, items: dict) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)", list(items.items()))
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(f"DELETE FROM {self.table}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class LRUStoreCache:
+    """
+    The base of the caches: a bounded in-memory LRU in front of an optional on-disk SQLite store, so the cache can be
+    shared across runs, with hit and miss counters. Subclasses define the keys and how their values are stored on disk
+    (`_encode` and `_decode`).
+    """
+    def __init__(self, path: str = None, table: str = "cache", max_memory_items: int = 10_000) -> None:
+        """
+        Args:
+        path (str, optional): Path of the SQLite database persisting the values. Defaults to None, i.e. in-memory only.
+        table (str): The table of the values in the database.
+        max_memory_items (int): Maximum number of values kept in the in-memory LRU.
+        """
+        self.max_memory_items = max_memory_items
+        self.store = SQLiteStore(path, table=table) if path else None
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # The lock is not sent to other processes. With a store on disk, neither is the memory: the copy reads the
+        # values from the store, which every process shares.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        if self.store is not None:
+            state["_memory"] = OrderedDict()
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _encode(self, value):
+        """
+        The value stored on disk for a value of the memory.
+        """
+        return value
+
+    def _decode(self, stored):
+        """
+        The value of the memory for a value stored on disk.
+        """
+        return stored
+
+    def _remember(self, key: str, value) -> None:
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _get_many(self, keys: List[str]) -> list:
+        """
+        Look up the values of keys, from the memory first and then from the disk.
+
+        Returns:
+        list: The value of each key, or None for the cache misses.
+        """
+        values = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    values[key] = self._memory[key]
+
+        missing_keys = [key for key in dict.fromkeys(keys) if key not in values]
+        if self.store is not None and missing_keys:
+            stored = self.store.get_many(missing_keys)
+            with self._lock:
+                for key, value in stored.items():
+                    values[key] = self._decode(value)
+                    self._remember(key, values[key])
+
+        results = [values.get(key) for key in keys]
+        with self._lock:
+            hits = sum(value is not None for value in results)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def _set_many(self, items: dict) -> None:
+        """
+        Store values by key in memory and on disk.
+        """
+        with self._lock:
+            for key, value in items.items():
+                self._remember(key, value)
+        if self.store is not None:
+            self.store.set_many({key: self._encode(value) for key, value in items.items()})
+
+    def stats(self) -> dict:
+        """
+        The hit and miss counters of the cache.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "memory_items": len(self._memory),
+        }
+
+    def clear(self) -> None:
+        """
+        Empty the cache, in memory and on disk, and reset its counters.
+        """
+        with self._lock:
+            self._memory.clear()
+            self.hits = self.misses = 0
+        if self.store is not None:
+            self.store.clear()
+
+
+class EmbeddingsCache(LRUStoreCache):
+    """
+    A content-addressed cache of embeddings keyed by (embeddings model id, embedding method, normalized text).
+    The method ("query" or "documents") is part of the key since asymmetric embedders (e.g. E5, BGE or Cohere) embed queries
+    and documents differently.
+    A bounded in-memory LRU sits in front of an optional on-disk SQLite store, so the cache can be shared across runs.
+    """
+    def __init__(self, path: str = None, max_memory_items: int = 100_000) -> None:
+        """
+        Args:
+        path (str, optional): Path of the SQLite database persisting the embeddings. Defaults to None, i.e. in-memory only.
+        max_memory_items (int): Maximum number of embeddings kept in the in-memory LRU. Defaults to 100 000.
+        """
+        super().__init__(path, table="embeddings", max_memory_items=max_memory_items)
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """
+        Collapse the whitespaces of a text, so that texts differing only by their spacing share their embeddings.
+        """
+        return " ".join(text.split())
+
+    @staticmethod
+    def key(model_id: str, text: str, method: str = "documents") -> str:
+        return hashlib.sha256(f"{model_id}\x00{method}\x00{EmbeddingsCache.normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _encode(self, embedding: np.ndarray) -> bytes:
+        return embedding.tobytes()
+
+    def _decode(self, stored: bytes) -> np.ndarray:
+        return np.frombuffer(stored, dtype=np.float64)
+
+    def get_many(self, model_id: str, texts: List[str], method: str = "documents") -> List[Optional[np.ndarray]]:
+        """
+        Look up the embeddings of texts, from the memory first and then from the disk.
+
+        Args:
+        model_id (str): The id of the embeddings model.
+        texts (List[str]): The texts.
+        method (str): The embedding method, "query" (embed_query) or "documents" (embed_documents). Defaults to "documents".
+
+        Returns:
+        List[Optional[np.ndarray]]: The embedding of each text, or None for the cache misses.
+        """
+        return self._get_many([self.key(model_id, text, method) for text in texts])
+
+    def set_many(self, model_id: str, texts: List[str], embeddings: List[np.ndarray], method: str = "documents") -> None:
+        """
+        Store the embeddings of texts computed with an embedding method ("query" or "documents") in memory and on disk.
+        """
+        self._set_many({self.key(model_id, text, method): np.asarray(embedding, dtype=np.float64) for text, embedding in zip(texts, embeddings)})
+
+
+class ResponseCache(LRUStoreCache):
+    """
+    A cache of the parsed LLM responses keyed by a hash of (model id, model parameters, rendered prompt).
+    Re-running an extraction over unchanged texts with the same model then does not call the model again.
+    A bounded in-memory LRU sits in front of an optional on-disk SQLite store, so the cache can be shared across runs.
+    """
+    def __init__(self, path: str = None, max_memory_items: int = 10_000) -> None:
+        """
+        Args:
+        path (str, optional): Path of the SQLite database persisting the responses. Defaults to None, i.e. in-memory only.
+        max_memory_items (int): Maximum number of responses kept in the in-memory LRU. Defaults to 10 000.
+        """
+        super().__init__(path, table="responses", max_memory_items=max_memory_items)
+
+    @staticmethod
+    def key(model_id: str, model_params: dict, prompt: str) -> str:
+        params = json.dumps(model_params, sort_keys=True, default=str)
+        return hashlib.sha256(f"{model_id}\x00{params}\x00{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        Look up a response, from the memory first and then from the disk.
+
+        Returns:
+        The parsed response, or None for a cache miss.
+        """
+        # The responses are kept as JSON, so every hit returns a new copy.
+        response = self._get_many([key])[0]
+        return None if response is None else json.loads(response)
+
+    def set(self, key: str, response) -> None:
+        """
+        Store a (JSON-serializable) parsed response in memory and on disk.
+        """
+        self._set_many({key: json.dumps(response)})
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import List, Optional, Tuple
+from ..models import Entity, Relationship, KnowledgeGraph
+
+
+class BuildCheckpoint:
+    """
+    A checkpoint directory of an iText2KG.build_graph run, so that a run failing at some section (e.g. when the
+    extraction of relations exhausts its tries) resumes after the last completed section instead of calling the models
+    again for every section. It holds, in the columnar format of KnowledgeGraph.save:
+    - `sections/<i>/entities` and `sections/<i>/relationships`: the entities and relationships extracted from each section,
+      saved as soon as they are extracted, so that a section failing during the extraction of relations does not extract
+      its entities again;
+    - `state-<n>`: the global entities and relationships after the first n sections;
+    - `checkpoint.json`: the fingerprint of the run and the number of completed sections, replaced atomically. It is
+      written as soon as the checkpoint is created, so that the extractions saved before the first completed section
+      are never reused by a run with other inputs.
+    The extractions of a section are removed once the state including it is saved.
+    """
+    def __init__(self, path: str, fingerprint: str) -> None:
+        """
+        Args:
+        path (str): The checkpoint directory, created if needed.
+        fingerprint (str): The fingerprint of the inputs of the run (see `fingerprint`).
+
+        Raises:
+        ValueError: If the directory holds the checkpoint of a run with other inputs.
+        """
+        self.path = path
+        self.fingerprint = fingerprint
+        os.makedirs(path, exist_ok=True)
+        manifest = self._read_manifest()
+        if manifest is None:
+            self._write_manifest(0, None)
+        elif manifest.get("fingerprint") != fingerprint:
+            raise ValueError(f"The checkpoint directory {path} holds the checkpoint of a run with other inputs. "
+                             "Please remove it or use another directory.")
+
+    @staticmethod
+    def fingerprint(sections: List[str], **options) -> str:
+        """
+        A hash of the sections and the options (thresholds, weights, tries) of a run.
+        """
+        payload = json.dumps({"sections": list(sections), "options": options}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.path, "checkpoint.json")
+
+    def _read_manifest(self) -> Optional[dict]:
+        if not os.path.exists(self._manifest_path()):
+            return None
+        with open(self._manifest_path()) as file:
+            return json.load(file)
+
+    def _write_manifest(self, completed_sections: int, state: Optional[str]) -> None:
+        temporary_path = self._manifest_path() + ".tmp"
+        with open(temporary_path, "w") as file:
+            json.dump({"fingerprint": self.fingerprint, "completed_sections": completed_sections, "state": state}, file)
+        os.replace(temporary_path, self._manifest_path())
+
+    def _section_path(self, i: int, name: str) -> str:
+        return os.path.join(self.path, "sections", str(i), name)
+
+    @staticmethod
+    def _load_graph(path: str) -> Optional[KnowledgeGraph]:
+        # The files are not memory-mapped: they are overwritten when a section is checkpointed again.
+        return KnowledgeGraph.load(path, mmap=False) if os.path.exists(os.path.join(path, "graph.json")) else None
+
+    def save_section_entities(self, i: int, entities: List[Entity]) -> None:
+        """
+        Save the entities extracted from the section i.
+        """
+        KnowledgeGraph.model_construct(entities=entities, relationships=[]).save(self._section_path(i, "entities"))
+
+    def load_section_entities(self, i: int) -> Optional[List[Entity]]:
+        """
+        The entities extracted from the section i, or None if they were not saved.
+        """
+        graph = self._load_graph(self._section_path(i, "entities"))
+        return None if graph is None else graph.entities
+
+    def save_section_relationships(self, i: int, relationships: List[Relationship]) -> None:
+        """
+        Save the relationships extracted from the section i.
+        """
+        KnowledgeGraph.model_construct(entities=[], relationships=relationships).save(self._section_path(i, "relationships"))
+
+    def load_section_relationships(self, i: int) -> Optional[List[Relationship]]:
+        """
+        The relationships extracted from the section i, or None if they were not saved.
+        """
+        graph = self._load_graph(self._section_path(i, "relationships"))
+        return None if graph is None else graph.relationships
+
+    def save_state(self, completed_sections: int, entities: List[Entity], relationships: List[Relationship]) -> None:
+        """
+        Save the global entities and relationships after the first `completed_sections` sections, then mark them
+        as completed. A failure in between leaves the previous checkpoint valid. The previous state and the extractions
+        of the completed sections are then removed.
+        """
+        previous = self._read_manifest()
+        state = f"state-{completed_sections}"
+        KnowledgeGraph.model_construct(entities=entities, relationships=relationships).save(os.path.join(self.path, state))
+        self._write_manifest(completed_sections, state)
+        if previous is not None and previous["state"] not in (None, state):
+            shutil.rmtree(os.path.join(self.path, previous["state"]), ignore_errors=True)
+        first_section = previous["completed_sections"] if previous is not None else 0
+        for i in range(first_section, completed_sections):
+            shutil.rmtree(os.path.join(self.path, "sections", str(i)), ignore_errors=True)
+
+    def load_state(self) -> Tuple[int, List[Entity], List[Relationship]]:
+        """
+        The number of completed sections and the global entities and relationships after them (empty without checkpoint).
+        """
+        manifest = self._read_manifest()
+        if manifest is None or manifest["state"] is None:
+            return 0, [], []
+        graph = self._load_graph(os.path.join(self.path, manifest["state"]))
+        return manifest["completed_sections"], graph.entities, graph.relationships
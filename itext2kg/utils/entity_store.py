@@ -0,0 +1,143 @@
+import numpy as np
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, Union
+from ..models import Entity, Relationship
+from .vector_index import VectorIndex, normalize_rows
+
+
+class EntityStore:
+    """
+    A persistent, mutable pool of Entities or Relationships to match against, such as the global entities and
+    relationships of iText2KG.build_graph. It keeps, in sync with the objects, a dict of their exact keys,
+    their positions per block (label of the entities, endpoints of the relationships), their stacked normalized embeddings 
+    and the nearest-neighbour indexes.
+    Every structure is updated incrementally, so inserting an object costs amortized O(1) instead of rebuilding
+    the pool at every section.
+    """
+    def __init__(self,
+                 objects: Iterable[Union[Entity, Relationship]] = None,
+                 index_factory: Callable[[], VectorIndex] = None,
+                 normalized_embeddings: bool = False,
+                 deduplicate: bool = True) -> None:
+        """
+        :param objects: Initial Entities or Relationships of the store.
+        :param index_factory: Callable returning an empty VectorIndex, used by the Matcher for large stores.
+        :param normalized_embeddings: Set to True when the embeddings are already L2-normalized.
+        :param deduplicate: Whether objects equal to an object of the store (see their `__eq__`) are skipped when added.
+                            Without deduplication, the positions in the store are the positions of the added lists.
+        """
+        self.index_factory = index_factory
+        self.normalized_embeddings = normalized_embeddings
+        self.deduplicate = deduplicate
+        self.objects: List[Union[Entity, Relationship]] = []
+        self.keys: Dict[tuple, int] = {}
+        self.blocks: Dict[Hashable, List[int]] = {}
+        self._positions: Dict[Union[Entity, Relationship], int] = {}
+        self._matrix: np.ndarray = None
+        self._indexes: Dict[Hashable, Tuple[VectorIndex, int]] = {}
+        if objects is not None:
+            self.add(objects)
+
+    @staticmethod
+    def key(obj: Union[Entity, Relationship]) -> tuple:
+        """
+        The exact key of an object: (name, label) for Entities, (name, None) for Relationships.
+        """
+        return (obj.name, obj.label if isinstance(obj, Entity) else None)
+
+    @staticmethod
+    def blocks_of(obj: Union[Entity, Relationship]) -> Tuple[Hashable, ...]:
+        """
+        The blocks an object belongs to: its label for Entities; for Relationships, the pair of their endpoints 
+        ("pair", start key, end key), their start ("start", start key) and their end ("end", end key).
+        """
+        if isinstance(obj, Entity):
+            return (obj.label,)
+        start, end = EntityStore.key(obj.startEntity), EntityStore.key(obj.endEntity)
+        return (("pair", start, end), ("start", start), ("end", end))
+
+    def __len__(self) -> int:
+        return len(self.objects)
+
+    def __iter__(self) -> Iterator[Union[Entity, Relationship]]:
+        return iter(self.objects)
+
+    def __contains__(self, obj: Union[Entity, Relationship]) -> bool:
+        return obj in self._positions
+
+    def get(self, obj: Union[Entity, Relationship]) -> Optional[Union[Entity, Relationship]]:
+        """
+        Get the object of the store equal to obj, or None.
+        """
+        position = self._positions.get(obj)
+        return None if position is None else self.objects[position]
+
+    def to_list(self) -> List[Union[Entity, Relationship]]:
+        """
+        A copy of the objects of the store, in insertion order.
+        """
+        return list(self.objects)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        The normalized embeddings of the objects, one row per object.
+        """
+        return self._matrix[:len(self.objects)]
+
+    def add(self, objects: Iterable[Union[Entity, Relationship]]) -> List[Union[Entity, Relationship]]:
+        """
+        Insert objects in the store. The exact keys, the blocks and the embedding matrix are updated incrementally;
+        the nearest-neighbour indexes catch up lazily on their next use.
+        :param objects: Entities or Relationships to insert.
+        :return: The objects that were actually inserted.
+        """
+        new_objects = []
+        seen = set()
+        for obj in objects:
+            if self.deduplicate and (obj in self._positions or obj in seen):
+                continue
+            seen.add(obj)
+            new_objects.append(obj)
+        if not new_objects:
+            return new_objects
+
+        embeddings = np.vstack([np.asarray(obj.properties.embeddings).reshape(1, -1) for obj in new_objects])
+        if not self.normalized_embeddings:
+            embeddings = normalize_rows(embeddings)
+        size = len(self.objects)
+        if self._matrix is None:
+            self._matrix = np.empty((max(len(new_objects), 16), embeddings.shape[1]), dtype=embeddings.dtype)
+        elif size + len(new_objects) > len(self._matrix):
+            # Amortized O(1) inserts by doubling the capacity.
+            matrix = np.empty((max(2 * len(self._matrix), size + len(new_objects)), self._matrix.shape[1]), dtype=self._matrix.dtype)
+            matrix[:size] = self._matrix[:size]
+            self._matrix = matrix
+        self._matrix[size:size + len(new_objects)] = embeddings
+
+        for position, obj in enumerate(new_objects, start=size):
+            self.objects.append(obj)
+            self._positions.setdefault(obj, position)
+            self.keys.setdefault(self.key(obj), position)
+            for block in self.blocks_of(obj):
+                self.blocks.setdefault(block, []).append(position)
+        return new_objects
+
+    def positions(self, block: Hashable = None) -> List[int]:
+        """
+        The positions of the objects of a block, or of all the objects when block is None.
+        """
+        return range(len(self.objects)) if block is None else self.blocks.get(block, [])
+
+    def get_index(self, block: Hashable = None) -> VectorIndex:
+        """
+        Get the nearest-neighbour index of a block (or of all the objects when block is None),
+        inserting the objects added since its last use. Its ids are the ranks in `positions(block)`.
+        """
+        positions = self.positions(block)
+        index, n_indexed = self._indexes.get(block, (None, 0))
+        if index is None:
+            index = self.index_factory()
+        if n_indexed < len(positions):
+            index.add(self.matrix[np.asarray(positions[n_indexed:])])
+        self._indexes[block] = (index, len(positions))
+        return index
@@ -1,17 +1,28 @@
 from langchain_core.exceptions import OutputParserException
 from langchain.prompts import PromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
-import time
+from langchain_core.runnables import RunnableLambda
 import openai
-from typing import Union, List
+from typing import Generator, Union, List, Optional
 import numpy as np
+from .cache import EmbeddingsCache, ResponseCache, get_model_id, get_model_params
+from .rate_limiter import RateLimiter
+from .budget import TokenBudget, BudgetExceededError
+from .model_calls import ModelCall
 
 class LangchainOutputParser:
     """
     A parser class for extracting and embedding information using Langchain and OpenAI APIs.
     """
     
-    def __init__(self, llm_model, embeddings_model, sleep_time: int = 5) -> None:
+    TEMPLATE = """
+        Context: {context}
+
+        Question: {query}
+        Format_instructions : {format_instructions}
+        Answer: """
+    
+    def __init__(self, llm_model, embeddings_model, sleep_time: int = 5, embeddings_cache: EmbeddingsCache = None, response_cache: ResponseCache = None, rate_limiter: RateLimiter = None) -> None:
         """
         Initialize the LangchainOutputParser with specified API key, models, and operational parameters.
         
@@ -20,7 +31,13 @@ class LangchainOutputParser:
         embeddings_model_name (str): The model name for text embeddings.
         model_name (str): The model name for the Chat API.
         temperature (float): The temperature setting for the Chat API's responses.
-        sleep_time (int): The time to wait (in seconds) when encountering rate limits or errors.
+        sleep_time (int): Kept for compatibility: the waits after rate limit errors are the backoff of the rate limiter.
+        embeddings_cache (EmbeddingsCache, optional): A cache of the embeddings already computed. Only the cache misses are sent 
+                                                      to the embeddings model. Defaults to None.
+        response_cache (ResponseCache, optional): A cache of the parsed LLM responses, keyed by the rendered prompt and the model. 
+                                                  Defaults to None.
+        rate_limiter (RateLimiter, optional): The rate limiter of the LLM calls. Defaults to None, i.e. the process-wide 
+                                              `RateLimiter.default()`, shared with the other parsers of the process.
         """
         #self.model = ChatOpenAI(api_key=api_key, model_name=model_name, temperature=temperature)
         #self.embeddings_model = OpenAIEmbeddings(model=embeddings_model_name, api_key=api_key)
@@ -28,6 +45,10 @@ class LangchainOutputParser:
         self.model = llm_model
         self.embeddings_model = embeddings_model
         self.sleep_time = sleep_time
+        self.embeddings_cache = embeddings_cache
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter.default()
+        self._chains = {}
 
     def calculate_embeddings(self, text: Union[str, List[str]]) -> np.ndarray:
         """
@@ -42,12 +63,96 @@ class LangchainOutputParser:
         Raises:
         TypeError: If the input text is neither a string nor a list of strings.
         """
+        if not isinstance(text, (str, list)):
+            raise TypeError("Invalid text type, please provide a string or a list of strings.")
+        if self.embeddings_cache is not None:
+            return self._calculate_cached_embeddings(text)
         if isinstance(text, list):
             return np.array(self.embeddings_model.embed_documents(text))
-        elif isinstance(text, str):
-            return np.array(self.embeddings_model.embed_query(text))
-        else:
+        return np.array(self.embeddings_model.embed_query(text))
+
+    async def acalculate_embeddings(self, text: Union[str, List[str]]) -> np.ndarray:
+        """
+        Asynchronous version of `calculate_embeddings`, relying on the `aembed_documents` and `aembed_query` methods of the embeddings model.
+        """
+        if not isinstance(text, (str, list)):
             raise TypeError("Invalid text type, please provide a string or a list of strings.")
+        if self.embeddings_cache is None:
+            if isinstance(text, list):
+                return np.array(await self.embeddings_model.aembed_documents(text))
+            return np.array(await self.embeddings_model.aembed_query(text))
+
+        texts, embeddings, missing_texts = self._lookup_cached_embeddings(text)
+        missing_embeddings = []
+        if missing_texts:
+            if isinstance(text, str):
+                missing_embeddings = [await self.embeddings_model.aembed_query(text)]
+            else:
+                missing_embeddings = await self.embeddings_model.aembed_documents(missing_texts)
+        return self._complete_cached_embeddings(text, texts, embeddings, missing_texts, missing_embeddings)
+
+    def _calculate_cached_embeddings(self, text: Union[str, List[str]]) -> np.ndarray:
+        """
+        Calculate embeddings through the embeddings cache: only the (unique) cache misses are sent to the embeddings model.
+        """
+        texts, embeddings, missing_texts = self._lookup_cached_embeddings(text)
+        missing_embeddings = []
+        if missing_texts:
+            if isinstance(text, str):
+                missing_embeddings = [self.embeddings_model.embed_query(text)]
+            else:
+                missing_embeddings = self.embeddings_model.embed_documents(missing_texts)
+        return self._complete_cached_embeddings(text, texts, embeddings, missing_texts, missing_embeddings)
+
+    @staticmethod
+    def _embedding_method(text: Union[str, List[str]]) -> str:
+        # A single text is embedded with embed_query and a list with embed_documents, which differ for asymmetric embedders.
+        return "query" if isinstance(text, str) else "documents"
+
+    def _lookup_cached_embeddings(self, text: Union[str, List[str]]):
+        texts = [text] if isinstance(text, str) else text
+        embeddings = self.embeddings_cache.get_many(get_model_id(self.embeddings_model), texts, self._embedding_method(text))
+        missing_texts = list(dict.fromkeys(t for t, embedding in zip(texts, embeddings) if embedding is None))
+        return texts, embeddings, missing_texts
+
+    def _complete_cached_embeddings(self, text, texts, embeddings, missing_texts, missing_embeddings) -> np.ndarray:
+        if missing_texts:
+            self.embeddings_cache.set_many(get_model_id(self.embeddings_model), missing_texts, missing_embeddings, self._embedding_method(text))
+            computed = dict(zip(missing_texts, missing_embeddings))
+            embeddings = [computed[t] if embedding is None else embedding for t, embedding in zip(texts, embeddings)]
+        
+        if isinstance(text, str):
+            return np.array(embeddings[0])
+        return np.array(embeddings)
+
+    def _get_chain(self, output_data_structure):
+        """
+        Get the (prompt, prompt | model | JSON parser chain) of an output structure. They are built once per output structure,
+        the context and the query being variables of the prompt.
+        """
+        if output_data_structure not in self._chains:
+            # Set up a parser and inject instructions into the prompt template.
+            parser = JsonOutputParser(pydantic_object=output_data_structure)
+            prompt = PromptTemplate(
+                template=self.TEMPLATE,
+                input_variables=["context", "query"],
+                partial_variables={"format_instructions": parser.get_format_instructions()},
+            )
+            self._chains[output_data_structure] = (prompt, prompt | self.model | parser)
+        return self._chains[output_data_structure]
+
+    def _prepare_call(self, output_data_structure, context: str, IE_query: str):
+        """
+        Get the chain and the inputs of a call, with the key of its rendered prompt in the response cache (None without 
+        response cache) and its estimated number of tokens for the rate limiter.
+        """
+        prompt, chain = self._get_chain(output_data_structure)
+        inputs = {"context": context, "query": IE_query}
+        rendered_prompt = prompt.format(**inputs)
+        key = None
+        if self.response_cache is not None:
+            key = self.response_cache.key(get_model_id(self.model), get_model_params(self.model), rendered_prompt)
+        return chain, inputs, key, RateLimiter.estimate_tokens(rendered_prompt)
 
     def extract_information_as_json_for_context(
         self,
@@ -57,7 +162,8 @@ class LangchainOutputParser:
         # DIRECTIVES : 
         - Act like an experienced information extractor. 
         - If you do not find the right information, keep its place empty.
-        '''
+        ''',
+        budget: TokenBudget = None
         ):
         """
         Extract information from a given context and format it as JSON using a specified structure.
@@ -66,41 +172,244 @@ class LangchainOutputParser:
         output_data_structure: The data structure definition for formatting the JSON output.
         context (str): The context from which to extract information.
         IE_query (str): The query to provide to the language model for extracting information.
+        budget (TokenBudget, optional): The budget of the document, checked before each call and counting its tokens. 
+                                        Defaults to None.
         
         Returns:
         The structured JSON output based on the provided data structure and extracted information.
         
-        Note: Handles rate limit and bad request errors by waiting and retrying.
+        Note: The calls go through the rate limiter. Rate limit errors are retried after an exponential backoff shared by 
+        all the users of the rate limiter; bad request errors are raised, since the same request would fail again. With a 
+        response cache, the prompts already answered by the same model are not sent again.
         """
-        # Set up a parser and inject instructions into the prompt template.
-        parser = JsonOutputParser(pydantic_object=output_data_structure)
+        chain, inputs, key, tokens = self._prepare_call(output_data_structure, context, IE_query)
+        if key is not None:
+            response = self.response_cache.get(key)
+            if response is not None:
+                return response
         
-        template = f"""
-        Context: {context}
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            if budget is not None:
+                budget.check()
+            self.rate_limiter.acquire(tokens)
+            try:
+                response = chain.invoke(inputs, config={"callbacks": [budget]} if budget is not None else None)
+                self.rate_limiter.record_success()
+                break
+            except openai.RateLimitError as e:
+                if attempt == self.rate_limiter.max_retries:
+                    raise
+                delay = self.rate_limiter.backoff(attempt, e)
+                print(f"Too much requests exceeding rate limit, we are sleeping {delay:.1f}s!")
+                
+            except OutputParserException:
+                print(f"Error in parsing the instance {context}")
+                return None
+        
+        if key is not None and response is not None:
+            self.response_cache.set(key, response)
+        return response
 
-        Question: {{query}}
-        Format_instructions : {{format_instructions}}
-        Answer: """
 
-        prompt = PromptTemplate(
-            template=template,
-            input_variables=["query"],
-            partial_variables={"format_instructions": parser.get_format_instructions()},
-        )
-
-        chain = prompt | self.model | parser
-        try:
-            return chain.invoke({"query": IE_query})
-        except openai.BadRequestError as e:
-            print(f"Too much requests, we are sleeping! \n the error is {e}")
-            time.sleep(self.sleep_time)
-            return self.extract_information_as_json_for_context(context=context)
-
-        except openai.RateLimitError:
-            print("Too much requests exceeding rate limit, we are sleeping!")
-            time.sleep(self.sleep_time)
-            return self.extract_information_as_json_for_context(context=context)
-            
-        except OutputParserException:
-            print(f"Error in parsing the instance {context}")
-            pass
+    async def aextract_information_as_json_for_context(
+        self,
+        output_data_structure,
+        context: str,
+        IE_query: str = '''
+        # DIRECTIVES : 
+        - Act like an experienced information extractor. 
+        - If you do not find the right information, keep its place empty.
+        ''',
+        budget: TokenBudget = None
+        ):
+        """
+        Asynchronous version of `extract_information_as_json_for_context`, relying on the `ainvoke` method of the chain.
+        """
+        chain, inputs, key, tokens = self._prepare_call(output_data_structure, context, IE_query)
+        if key is not None:
+            response = self.response_cache.get(key)
+            if response is not None:
+                return response
+        
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            if budget is not None:
+                budget.check()
+            await self.rate_limiter.aacquire(tokens)
+            try:
+                response = await chain.ainvoke(inputs, config={"callbacks": [budget]} if budget is not None else None)
+                self.rate_limiter.record_success()
+                break
+            except openai.RateLimitError as e:
+                if attempt == self.rate_limiter.max_retries:
+                    raise
+                delay = self.rate_limiter.backoff(attempt, e)
+                print(f"Too much requests exceeding rate limit, we are sleeping {delay:.1f}s!")
+                
+            except OutputParserException:
+                print(f"Error in parsing the instance {context}")
+                return None
+        
+        if key is not None and response is not None:
+            self.response_cache.set(key, response)
+        return response
+
+
+    def extraction_steps(self,
+                         output_data_structure,
+                         context: str,
+                         IE_query: str,
+                         required_key: str,
+                         max_tries: int = 5,
+                         budget: TokenBudget = None) -> Generator[ModelCall, Optional[dict], Optional[dict]]:
+        """
+        The steps of an extraction retried until its output holds `required_key`, run by `run_model_calls` or 
+        `arun_model_calls` (see itext2kg.utils.model_calls), so that the sync and async extractors share their retries.
+        
+        Args:
+        output_data_structure: The data structure definition for formatting the JSON output.
+        context (str): The context from which to extract information.
+        IE_query (str): The query to provide to the language model for extracting information.
+        required_key (str): The key the structured JSON output must hold.
+        max_tries (int): The maximum number of attempts. Defaults to 5.
+        budget (TokenBudget, optional): The budget of the document. When it is spent, the extraction is not retried (nor is it 
+                                        after a bad request error). Defaults to None.
+        
+        Returns:
+        The structured JSON output of the last attempt, or None if every attempt failed.
+        """
+        output = None
+        for tries in range(max_tries):
+            try:
+                output = yield ModelCall(self.extract_information_as_json_for_context,
+                                         self.aextract_information_as_json_for_context,
+                                         dict(output_data_structure=output_data_structure,
+                                              context=context,
+                                              IE_query=IE_query,
+                                              budget=budget))
+                if output and required_key in output.keys():
+                    break
+                
+            except (BudgetExceededError, openai.BadRequestError):
+                raise
+            except Exception as e:
+                print(f"Not Formatted in the desired format. Error occurred: {e}. Retrying... (Attempt {tries + 1}/{max_tries})")
+        return output
+
+
+    def _prepare_batch(self, output_data_structure, contexts: List[str], IE_query: str):
+        """
+        Prepare the calls of a batch: the cached responses are looked up and the chain of the other calls is preceded 
+        by the rate limiter. The batch inputs are the positions of the contexts.
+        """
+        calls = [self._prepare_call(output_data_structure, context, IE_query) for context in contexts]
+        outputs = [None] * len(contexts)
+        pending = []
+        for position, (_, _, key, _) in enumerate(calls):
+            response = self.response_cache.get(key) if key is not None else None
+            if response is None:
+                pending.append(position)
+            else:
+                outputs[position] = response
+        return calls, outputs, pending
+
+    def _rate_limited_chain(self, calls):
+        """
+        The runnable of a batch: each call waits for the rate limiter, then invokes its chain. Its inputs are the positions 
+        of the calls. The calls are not batched step by step through the prompt | model | parser sequence, so that the 
+        failure of a call does not fail the others.
+        """
+        def call(position: int):
+            chain, inputs, _, tokens = calls[position]
+            self.rate_limiter.acquire(tokens)
+            return chain.invoke(inputs)
+        
+        async def acall(position: int):
+            chain, inputs, _, tokens = calls[position]
+            await self.rate_limiter.aacquire(tokens)
+            return await chain.ainvoke(inputs)
+        
+        return RunnableLambda(call, afunc=acall)
+
+    def _collect_batch(self, calls, outputs, pending, responses, attempt: int) -> List[int]:
+        """
+        Store the responses of a batch in the outputs (and in the response cache) and return the positions to retry, i.e. the
+        rate limited ones, retried after the backoff of the rate limiter. A failed context is isolated: its output is None 
+        and the other contexts are kept.
+        """
+        retry = []
+        rate_limited = None
+        for position, response in zip(pending, responses):
+            if not isinstance(response, Exception):
+                self.rate_limiter.record_success()
+                outputs[position] = response
+                key = calls[position][2]
+                if key is not None and response is not None:
+                    self.response_cache.set(key, response)
+            elif isinstance(response, openai.RateLimitError) and attempt < self.rate_limiter.max_retries:
+                # Only the rate limit errors are transient: a bad request would fail again.
+                retry.append(position)
+                rate_limited = response
+            elif isinstance(response, OutputParserException):
+                print(f"Error in parsing the instance {calls[position][1]['context']}")
+            else:
+                print(f"[INFO] The context {position} failed with the error: {response}")
+        if rate_limited is not None:
+            delay = self.rate_limiter.backoff(attempt, rate_limited)
+            print(f"Too much requests exceeding rate limit, we are sleeping {delay:.1f}s!")
+        return retry
+
+    def batch_extract_information_as_json(
+        self,
+        output_data_structure,
+        contexts: List[str],
+        IE_query: str = '''
+        # DIRECTIVES : 
+        - Act like an experienced information extractor. 
+        - If you do not find the right information, keep its place empty.
+        ''',
+        max_concurrency: int = 4,
+        ) -> List[Optional[dict]]:
+        """
+        Extract information from several contexts concurrently, through the `batch` method of the chain.
+        
+        Args:
+        output_data_structure: The data structure definition for formatting the JSON output.
+        contexts (List[str]): The contexts from which to extract information.
+        IE_query (str): The query to provide to the language model for extracting information.
+        max_concurrency (int): The maximum number of concurrent calls to the language model. Defaults to 4.
+        
+        Returns:
+        List[Optional[dict]]: The structured JSON output of each context, in the order of the contexts. The output of a context
+                              whose extraction failed is None, without aborting the other contexts.
+        """
+        calls, outputs, pending = self._prepare_batch(output_data_structure, contexts, IE_query)
+        chain = self._rate_limited_chain(calls)
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            if not pending:
+                break
+            responses = chain.batch(pending, config={"max_concurrency": max_concurrency}, return_exceptions=True)
+            pending = self._collect_batch(calls, outputs, pending, responses, attempt)
+        return outputs
+
+    async def abatch_extract_information_as_json(
+        self,
+        output_data_structure,
+        contexts: List[str],
+        IE_query: str = '''
+        # DIRECTIVES : 
+        - Act like an experienced information extractor. 
+        - If you do not find the right information, keep its place empty.
+        ''',
+        max_concurrency: int = 4,
+        ) -> List[Optional[dict]]:
+        """
+        Asynchronous version of `batch_extract_information_as_json`, through the `abatch` method of the chain.
+        """
+        calls, outputs, pending = self._prepare_batch(output_data_structure, contexts, IE_query)
+        chain = self._rate_limited_chain(calls)
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            if not pending:
+                break
+            responses = await chain.abatch(pending, config={"max_concurrency": max_concurrency}, return_exceptions=True)
+            pending = self._collect_batch(calls, outputs, pending, responses, attempt)
+        return outputs
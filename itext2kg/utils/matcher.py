@@ -1,52 +1,252 @@
+import threading
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from typing import List, Tuple, Union
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple, Union
 from ..models import Entity, Relationship
+from .vector_index import VectorIndex, normalize_rows
+from .entity_store import EntityStore
+
+
 class Matcher:
     """
     Class to handle the matching and processing of entities or relations based on cosine similarity or name matching.
     """
-    def __init__(self):
-        pass
+    def __init__(self, 
+                 index_factory: Callable[[], VectorIndex] = None, 
+                 index_min_size: int = 1000,
+                 max_cached_indexes: int = 4,
+                 blocking: Union[str, Dict[str, Iterable[str]]] = None,
+                 normalized_embeddings: bool = False,
+                 relationship_blocking: str = None):
+        """
+        :param index_factory: Callable returning an empty VectorIndex (e.g. IVFVectorIndex). When provided, the lists to match 
+                              against with at least `index_min_size` candidates are searched through the index instead of being scanned.
+                              Defaults to None, i.e. exact search.
+        :param index_min_size: Minimum number of candidates for the index to be used.
+        :param max_cached_indexes: Number of indexed lists kept in memory. An indexed list that grows by appending new objects 
+                                   (as the global entities do in iText2KG.build_graph) is updated incrementally.
+        :param blocking: Restricts the similarity search of entities to candidates with compatible labels. 
+                         "label" only compares entities sharing the same label; a dict mapping a label to its compatible labels 
+                         (e.g. {"Company": ["Organization"]}) compares entities sharing the same or a compatible label. 
+                         Defaults to None, i.e. all the entities are compared.
+        :param normalized_embeddings: Set to True when all the embeddings are already L2-normalized (see `normalize_embeddings` 
+                                      in itext2kg.models), the cosine similarity is then computed as a plain dot product.
+        :param relationship_blocking: Restricts the similarity search of relationships to candidates sharing their endpoints.
+                                      "endpoints" only compares relationships between the same (startEntity, endEntity) pair;
+                                      the looser "endpoint" compares relationships sharing their startEntity or their endEntity.
+                                      Defaults to None, i.e. all the relationships are compared.
+        """
+        if blocking is not None and blocking != "label" and not isinstance(blocking, dict):
+            raise ValueError(f"Invalid blocking {blocking!r}, please provide None, 'label' or a dict of compatible labels.")
+        if relationship_blocking not in (None, "endpoints", "endpoint"):
+            raise ValueError(f"Invalid relationship_blocking {relationship_blocking!r}, please provide None, 'endpoints' or 'endpoint'.")
+        self.index_factory = index_factory
+        self.index_min_size = index_min_size
+        self.max_cached_indexes = max_cached_indexes
+        self.blocking = blocking
+        self.normalized_embeddings = normalized_embeddings
+        self.relationship_blocking = relationship_blocking
+        self._indexed_lists: List[Tuple[list, Optional[int], EntityStore]] = []
+        self._lock = threading.Lock()
     
+    def __getstate__(self) -> dict:
+        # The lock and the cached indexes are not sent to other processes.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_indexed_lists"] = []
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def stack_embeddings(objects: List[Union[Entity, Relationship]]) -> np.ndarray:
+        """
+        Stack the embeddings of a list of Entities or Relationships into a single 2D matrix.
+        :param objects: List of Entities or Relationships carrying embeddings.
+        :return: A matrix of shape (len(objects), embedding_dim).
+        """
+        return np.vstack([np.asarray(obj.properties.embeddings).reshape(1, -1) for obj in objects])
+
+    @staticmethod
+    def cosine_similarity_matrix(matrix1: np.ndarray, matrix2: np.ndarray) -> np.ndarray:
+        """
+        Compute the full cosine similarity block between the rows of two matrices in one shot.
+        Rows with a null norm are left as zeros, as sklearn's `cosine_similarity` does.
+        :param matrix1: Matrix of shape (n1, dim).
+        :param matrix2: Matrix of shape (n2, dim).
+        :return: A (n1, n2) matrix of cosine similarities.
+        """
+        return normalize_rows(matrix1) @ normalize_rows(matrix2).T
+
+    def compatible_blocks(self, obj: Union[Entity, Relationship]) -> Optional[Tuple[Hashable, ...]]:
+        """
+        The blocks an object is compared with, or None when it is compared with every object.
+        """
+        if isinstance(obj, Relationship):
+            if self.relationship_blocking is None:
+                return None
+            start, end = EntityStore.key(obj.startEntity), EntityStore.key(obj.endEntity)
+            if self.relationship_blocking == "endpoints":
+                return (("pair", start, end),)
+            return (("start", start), ("end", end))
+        if self.blocking is None:
+            return None
+        if self.blocking == "label":
+            return (obj.label,)
+        return tuple(dict.fromkeys([obj.label, *self.blocking.get(obj.label, ())]))
+
+    def create_store(self, objects: Iterable[Union[Entity, Relationship]] = None) -> EntityStore:
+        """
+        Create an EntityStore sharing the index and normalization settings of the matcher.
+        :param objects: Initial Entities or Relationships of the store.
+        :return: A deduplicating EntityStore.
+        """
+        return EntityStore(objects, index_factory=self.index_factory, normalized_embeddings=self.normalized_embeddings)
+
+    def get_indexed_objects(self, list_objects: Union[List[Union[Entity, Relationship]], EntityStore]) -> EntityStore:
+        """
+        Get the lookup structures of a list of Entities or Relationships. When the list is large enough to be searched through 
+        an index, cached structures are reused when the list starts with the objects they already hold, in which case only the 
+        new objects are inserted; otherwise new ones are built. Smaller lists are stacked again on each call, which costs about 
+        as much as checking the cache, and are not kept alive by the matcher.
+        A list counting its mutations (the entities and relationships of a KnowledgeGraph) is found again in constant time while 
+        it is only appended to; other lists are compared object by object with the cached ones.
+        The cached structures hold the names, labels and embeddings of the objects when they were inserted: after changing them 
+        in place, call `invalidate_indexes`.
+        :param list_objects: List of Entities or Relationships to match against, or an EntityStore which is returned as is.
+        :return: A non-deduplicating EntityStore whose positions are the positions in list_objects.
+        """
+        if isinstance(list_objects, EntityStore):
+            return list_objects
+
+        if self.index_factory is None or len(list_objects) < self.index_min_size:
+            return EntityStore(list_objects, normalized_embeddings=self.normalized_embeddings, deduplicate=False)
+
+        # The cache is shared by the threads matching with the same matcher (see iText2KG.build_graphs).
+        # Its entries are (list, mutation count of the list or None, structures).
+        version = getattr(list_objects, "rewrites", None)
+        with self._lock:
+            position = next((position for position, (source, source_version, indexed_objects) in enumerate(self._indexed_lists)
+                             if source is list_objects and version is not None and source_version == version 
+                             and len(indexed_objects) <= len(list_objects)), None)
+            if position is None:
+                position = next((position for position, (_, _, indexed_objects) in enumerate(self._indexed_lists)
+                                 if len(indexed_objects) <= len(list_objects) 
+                                 and (not indexed_objects.objects or indexed_objects.objects[-1] is list_objects[len(indexed_objects) - 1])
+                                 and all(obj1 is obj2 for obj1, obj2 in zip(indexed_objects.objects, list_objects))), None)
+            if position is not None:
+                _, _, indexed_objects = self._indexed_lists.pop(position)
+                indexed_objects.add(list_objects[len(indexed_objects):])
+            else:
+                indexed_objects = EntityStore(list_objects, 
+                                              index_factory=self.index_factory, 
+                                              normalized_embeddings=self.normalized_embeddings, 
+                                              deduplicate=False)
+            self._indexed_lists.insert(0, (list_objects, version, indexed_objects))
+            del self._indexed_lists[self.max_cached_indexes:]
+            return indexed_objects
+
+    def invalidate_indexes(self) -> None:
+        """
+        Drop the cached lookup structures, e.g. after changing the names or the embeddings of objects of a cached list in place.
+        """
+        with self._lock:
+            self._indexed_lists = []
+
+    def get_index(self, list_objects: Union[List[Union[Entity, Relationship]], EntityStore]) -> VectorIndex:
+        """
+        Get the nearest-neighbour index of a list of Entities or Relationships, see `get_indexed_objects`.
+        :param list_objects: List of Entities or Relationships to index, or an EntityStore.
+        :return: A VectorIndex whose ids are the positions in list_objects.
+        """
+        return self.get_indexed_objects(list_objects).get_index()
+
+    def _merge(self, obj1: Union[Entity, Relationship], best_match: Union[Entity, Relationship]) -> Union[Entity, Relationship]:
+        """
+        Merge obj1 into its best match: Relationships take the name and embeddings of the match, 
+        Entities are replaced by the match.
+        """
+        if isinstance(obj1, Relationship):
+            print(f"[INFO] Wohoo! Relation was matched --- [{obj1.name}] --merged --> [{best_match.name}] ")
+            obj1.name = best_match.name
+            obj1.properties.embeddings = best_match.properties.embeddings
+            return obj1
+
+        print(f"[INFO] Wohoo! Entity was matched --- [{obj1.name}:{obj1.label}] --merged--> [{best_match.name}:{best_match.label}]")
+        return best_match
+
+    def _search(self, indexed_objects: EntityStore, queries: np.ndarray, blocks: Optional[Tuple[Hashable, ...]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search the most similar object of each query among the given blocks (or among all the objects when blocks is None).
+        :return: (best_similarities, best_positions). Queries without any candidate have a position of -1.
+        """
+        blocks = (None,) if blocks is None else blocks
+        n_candidates = sum(len(indexed_objects.positions(block)) for block in blocks)
+        best_similarities = np.full(len(queries), -np.inf)
+        best_positions = np.full(len(queries), -1)
+        if n_candidates == 0:
+            return best_similarities, best_positions
+
+        if self.index_factory is not None and n_candidates >= self.index_min_size:
+            for block in blocks:
+                positions = indexed_objects.positions(block)
+                if not positions:
+                    continue
+                similarities, ids = (column[:, 0] for column in indexed_objects.get_index(block).search(queries, k=1))
+                positions = np.where(ids >= 0, np.asarray(positions)[np.maximum(ids, 0)], -1)
+                better = (similarities > best_similarities) | ((similarities == best_similarities) & (positions < best_positions))
+                best_similarities = np.where(better, similarities, best_similarities)
+                best_positions = np.where(better, positions, best_positions)
+            return best_similarities, best_positions
+
+        # The blocks of a relationship may overlap: the positions are deduplicated (and sorted).
+        positions = np.unique(np.concatenate([np.asarray(indexed_objects.positions(block), dtype=np.int64) for block in blocks]))
+        if not self.normalized_embeddings:
+            queries = normalize_rows(queries)
+        similarities = queries @ indexed_objects.matrix[positions].T
+        # np.argmax keeps the first maximum, like the strict '>' comparison of the sequential scan.
+        best_ranks = np.argmax(similarities, axis=1)
+        return similarities[np.arange(len(queries)), best_ranks], positions[best_ranks]
+
+    def find_matches(self, list1: List[Union[Entity, Relationship]], list_objects: Union[List[Union[Entity, Relationship]], EntityStore], threshold: float = 0.8) -> List[Union[Entity, Relationship]]:
+        """
+        Vectorized version of `find_match`. Objects whose exact key exists in list_objects are resolved through a dict lookup 
+        without touching the embeddings. The similarities between the other objects of list1 and their candidates 
+        (all of list_objects, or their compatible blocks when blocking is enabled) are computed as matrix products, 
+        then the top-1 selection and the thresholding are done in NumPy.
+        :param list1: List of Entities or Relationships to find matches for.
+        :param list_objects: List of Entities or Relationships to match against, or an EntityStore.
+        :param threshold: Cosine similarity threshold.
+        :return: For each object of list1, its best match or the object itself if no match is found.
+        """
+        if not list1 or not len(list_objects):
+            return list(list1)
+
+        indexed_objects = self.get_indexed_objects(list_objects)
+        matches = list(list1)
+        groups: Dict[Optional[Tuple[Hashable, ...]], List[int]] = {}
+        for i, obj1 in enumerate(list1):
+            if EntityStore.key(obj1) not in indexed_objects.keys:
+                groups.setdefault(self.compatible_blocks(obj1), []).append(i)
+
+        for blocks, indices in groups.items():
+            queries = self.stack_embeddings([list1[i] for i in indices])
+            best_similarities, best_positions = self._search(indexed_objects, queries, blocks)
+            for i, best_position, best_similarity in zip(indices, best_positions, best_similarities):
+                if best_position >= 0 and best_similarity > threshold:
+                    matches[i] = self._merge(list1[i], indexed_objects.objects[best_position])
+        return matches
+
     def find_match(self, obj1: Union[Entity, Relationship], list_objects: List[Union[Entity, Relationship]], threshold: float = 0.8) -> Union[Entity, Relationship]:
         """
         Find a matching Entity or Relationship object based on name or high cosine similarity.
         :param obj1: The Entity or Relationship to find matches for.
         :param list_objects: List of Entities or Relationships to match against.
-        :param match_type: Type of match to perform, either 'entity' or 'relation'.
         :param threshold: Cosine similarity threshold.
         :return: The best match or the original object if no match is found.
         """
-        name1 = obj1.name
-        label1 = obj1.label if isinstance(obj1, Entity) else None
-        emb1 = np.array(obj1.properties.embeddings).reshape(1, -1)
-        best_match = None
-        best_cosine_sim = threshold
-
-        for obj2 in list_objects:
-            name2 = obj2.name
-            label2 = obj2.label if isinstance(obj2, Entity) else None
-            emb2 = np.array(obj2.properties.embeddings).reshape(1, -1)
-
-            if name1 == name2 and label1 == label2:
-                return obj1
-            cosine_sim = cosine_similarity(emb1, emb2)[0][0]
-            if cosine_sim > best_cosine_sim:
-                best_cosine_sim = cosine_sim
-                best_match = obj2
-
-        if best_match:
-            if isinstance(obj1, Relationship):
-                print(f"[INFO] Wohoo! Relation was matched --- [{obj1.name}] --merged --> [{best_match.name}] ")
-                obj1.name = best_match.name
-                obj1.properties.embeddings = best_match.properties.embeddings
-                
-            elif isinstance(obj1, Entity):
-                print(f"[INFO] Wohoo! Entity was matched --- [{obj1.name}:{obj1.label}] --merged--> [{best_match.name}:{best_match.label}]")
-                return best_match
-
-        return obj1
+        return self.find_matches([obj1], list_objects, threshold=threshold)[0]
 
     def create_union_list(self, list1: List[Union[Entity, Relationship]], list2: List[Union[Entity, Relationship]]) -> List[Union[Entity, Relationship]]:
         """
@@ -89,12 +289,31 @@ class Matcher:
         Process two lists to generate new lists based on specified conditions.
         :param list1: First list to process (local items).
         :param list2: Second list to be compared against (global items).
-        :param for_entity_or_relation: Specifies whether the processing is for entities or relations.
-        :return: (matched_local_items, new_global_items)
+        :param threshold: Cosine similarity threshold.
+        :return: (matched_local_items, new_global_items). The new global items keep the order of list2 and 
+                 the newly added items come last, so that an index over list2 can be updated incrementally.
         """
-        list3 = [self.find_match(obj1, list2, threshold=threshold) for obj1 in list1] #matched_local_items
+        list3 = self.find_matches(list1, list2, threshold=threshold) #matched_local_items
         list4 = self.create_union_list(list3, list2) #new_global_items
-        return list3, list(set(list4))
+        kept_items = set(list4)
+        return list3, list(dict.fromkeys([obj for obj in list2 if obj in kept_items] + list4))
+
+    def process_store(self, 
+                      list1: List[Union[Entity, Relationship]], 
+                      store: EntityStore, 
+                      threshold: float = 0.8
+                      ) -> List[Union[Entity, Relationship]]:
+        """
+        In-place counterpart of `process_lists` for a global EntityStore: the local items are matched against the store, 
+        then the ones that are not already in it are inserted, without re-materializing the global items.
+        :param list1: List to process (local items).
+        :param store: EntityStore of the global items, updated in place.
+        :param threshold: Cosine similarity threshold.
+        :return: matched_local_items
+        """
+        list3 = self.find_matches(list1, store, threshold=threshold) #matched_local_items
+        store.add(list3)
+        return list3
     
     
     def match_entities_and_update_relationships(
@@ -0,0 +1,47 @@
+from typing import Any, Awaitable, Callable, Generator, NamedTuple
+
+
+class ModelCall(NamedTuple):
+    """
+    A call of a model requested by the steps of an extraction: `function` is called by `run_model_calls`, and the
+    coroutine function `afunction` is awaited by `arun_model_calls`, with the same keyword arguments.
+    """
+    function: Callable[..., Any]
+    afunction: Callable[..., Awaitable[Any]]
+    kwargs: dict
+
+
+def run_model_calls(steps: Generator[ModelCall, Any, Any]) -> Any:
+    """
+    Run the steps of an extraction, written once as a generator yielding the ModelCalls to make: each call is made
+    synchronously and its result is sent back to the steps (or its exception is raised inside them).
+
+    Returns:
+    Any: The value returned by the steps.
+    """
+    result, error = None, None
+    while True:
+        try:
+            call = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            result, error = call.function(**call.kwargs), None
+        except Exception as e:
+            result, error = None, e
+
+
+async def arun_model_calls(steps: Generator[ModelCall, Any, Any]) -> Any:
+    """
+    Asynchronous version of `run_model_calls`, awaiting the asynchronous version of each call.
+    """
+    result, error = None, None
+    while True:
+        try:
+            call = steps.send(result) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            result, error = await call.afunction(**call.kwargs), None
+        except Exception as e:
+            result, error = None, e
@@ -0,0 +1,185 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+
+class RateLimiter:
+    """
+    A token-bucket rate limiter shared by all the LLM calls of a process (entities and relations extraction, distillation).
+    Every call first takes one request and its estimated number of tokens from the buckets, which refill continuously
+    at the configured requests/tokens per minute, so that concurrent pipelines stay under the provider's limits.
+    When the provider still answers with a rate limit error, every caller pauses for an exponential backoff with jitter
+    (or for the retry-after hint of the provider) and the refill rate is halved, then recovers after successful calls.
+    The parsers, extractors, distillers and builders created without a rate limiter share the process-wide one of
+    `default`, which `set_default` replaces, e.g. to configure the limits of the provider once.
+    """
+    _default: Optional["RateLimiter"] = None
+    _default_lock = threading.Lock()
+
+    def __init__(self,
+                 requests_per_minute: float = None,
+                 tokens_per_minute: float = None,
+                 max_retries: int = 6,
+                 initial_backoff: float = 1.0,
+                 max_backoff: float = 60.0,
+                 min_rate_factor: float = 0.1,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Args:
+        requests_per_minute (float, optional): Maximum number of requests per minute. Defaults to None, i.e. unlimited.
+        tokens_per_minute (float, optional): Maximum number of (estimated) tokens per minute. Defaults to None, i.e. unlimited.
+        max_retries (int): Maximum number of retries of a call failing with a rate limit error. Defaults to 6.
+        initial_backoff (float): The backoff (in seconds) after the first rate limit error, doubled at every retry. Defaults to 1.
+        max_backoff (float): The maximum backoff in seconds. Defaults to 60.
+        min_rate_factor (float): The lowest fraction of the configured rates used after repeated rate limit errors. Defaults to 0.1.
+        clock (Callable[[], float]): The monotonic clock, in seconds. Defaults to time.monotonic.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.min_rate_factor = min_rate_factor
+        self.clock = clock
+        self.rate_factor = 1.0
+        self._requests = requests_per_minute
+        self._tokens = tokens_per_minute
+        self._last_refill = clock()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        # The lock is not sent to other processes: a copy of the rate limiter in another process (e.g. a worker of
+        # iText2KG.build_graphs) limits the calls of that process only.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def default(cls) -> "RateLimiter":
+        """
+        The process-wide rate limiter, created without limits on first use.
+        """
+        with cls._default_lock:
+            if RateLimiter._default is None:
+                RateLimiter._default = cls(initial_backoff=5.0)
+            return RateLimiter._default
+
+    @classmethod
+    def set_default(cls, rate_limiter: Optional["RateLimiter"]) -> None:
+        """
+        Replace the process-wide rate limiter used by the objects created afterwards without a rate limiter
+        (None restores a rate limiter without limits on next use).
+        """
+        with cls._default_lock:
+            RateLimiter._default = rate_limiter
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """
+        A rough estimate of the number of tokens of a text (about 4 characters per token).
+        """
+        return len(text) // 4 + 1
+
+    def _refill(self, now: float) -> None:
+        elapsed = max(now - self._last_refill, 0.0)
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.rate_factor * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.rate_factor * self.tokens_per_minute / 60)
+
+    def _reserve(self, tokens: int) -> float:
+        """
+        Take one request and `tokens` tokens from the buckets if they are available.
+
+        Returns:
+        float: 0 when the request is allowed, otherwise the time to wait (in seconds) before trying again.
+        """
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            wait = max(self._paused_until - now, 0.0)
+            if self.requests_per_minute and self._requests < 1:
+                wait = max(wait, (1 - self._requests) * 60 / (self.rate_factor * self.requests_per_minute))
+            if self.tokens_per_minute:
+                # A request larger than the bucket waits for a full bucket rather than forever.
+                tokens = min(tokens, self.tokens_per_minute)
+                if self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / (self.rate_factor * self.tokens_per_minute))
+            if wait > 0:
+                return wait
+            if self.requests_per_minute:
+                self._requests -= 1
+            if self.tokens_per_minute:
+                self._tokens -= tokens
+            return 0.0
+
+    def acquire(self, tokens: int = 1) -> None:
+        """
+        Block until one request of `tokens` tokens is allowed.
+        """
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 1) -> None:
+        """
+        Asynchronous version of `acquire`, which does not block the event loop.
+        """
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    @staticmethod
+    def retry_after(error: Exception) -> Optional[float]:
+        """
+        The retry-after hint (in seconds) of a provider error, read from the `retry-after-ms` or `retry-after` headers of its response.
+        """
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if not headers:
+            return None
+        try:
+            if headers.get("retry-after-ms") is not None:
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after") is not None:
+                return float(headers["retry-after"])
+        except (TypeError, ValueError):
+            return None
+        return None
+
+    def backoff(self, attempt: int, error: Exception = None) -> float:
+        """
+        Record a rate limit error: pause every caller and halve the refill rate.
+
+        Args:
+        attempt (int): The number of the retry, starting at 0.
+        error (Exception, optional): The provider error, whose retry-after hint is honoured.
+
+        Returns:
+        float: The pause in seconds, an exponential backoff with full jitter unless the provider gave a hint.
+        """
+        delay = self.retry_after(error) if error is not None else None
+        if delay is None:
+            delay = random.uniform(0, min(self.max_backoff, self.initial_backoff * 2 ** attempt))
+        with self._lock:
+            self.rate_factor = max(self.min_rate_factor, self.rate_factor / 2)
+            self._paused_until = max(self._paused_until, self.clock() + delay)
+        return delay
+
+    def record_success(self) -> None:
+        """
+        Record a successful call: the refill rate recovers additively after a rate limit error.
+        """
+        with self._lock:
+            self.rate_factor = min(1.0, self.rate_factor + 0.05)
@@ -0,0 +1,152 @@
+import re
+from typing import Callable, Iterable, List, Tuple
+from .rate_limiter import RateLimiter
+
+
+class SectionChunker:
+    """
+    Split raw documents into sections sized to a target number of tokens, for iText2KG.build_graph.
+    The sections are cut on paragraph boundaries when possible, and on sentence boundaries otherwise: small adjacent
+    paragraphs are packed together, so that the document takes the fewest LLM calls, and a paragraph which does not fit
+    in a section is split between its sentences, so that no section overflows the context window of the model.
+    Consecutive sections can share their last/first sentences, so that the relations spanning a cut are not lost.
+    """
+    PARAGRAPH_SEPARATOR = re.compile(r"\n\s*\n")
+    SENTENCE_BOUNDARY = re.compile(r"(?:(?<=[.!?])|(?<=[.!?][\"')\]]))\s+")
+
+    def __init__(self,
+                 max_tokens: int = 1000,
+                 overlap_tokens: int = 0,
+                 token_counter: Callable[[str], int] = None) -> None:
+        """
+        Args:
+        max_tokens (int): The target (maximum) number of tokens of a section. Defaults to 1000.
+        overlap_tokens (int): The maximum number of tokens of the sentences repeated at the start of the next section
+                              when a paragraph is cut. Defaults to 0.
+        token_counter (Callable[[str], int], optional): The number of tokens of a text, e.g. from the tokenizer of the model.
+                                                        Defaults to the estimate of the rate limiter (about 4 characters per token).
+
+        Raises:
+        ValueError: If max_tokens is not positive or overlap_tokens is not smaller than max_tokens.
+        """
+        if max_tokens < 1:
+            raise ValueError("max_tokens must be at least 1.")
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError("overlap_tokens must be non-negative and smaller than max_tokens.")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.token_counter = token_counter if token_counter is not None else RateLimiter.estimate_tokens
+
+    @classmethod
+    def split_paragraphs(cls, text: str) -> List[str]:
+        """
+        The non-empty paragraphs of a text, separated by blank lines, with their whitespaces collapsed.
+        """
+        return [" ".join(paragraph.split()) for paragraph in cls.PARAGRAPH_SEPARATOR.split(text) if paragraph.strip()]
+
+    @classmethod
+    def split_sentences(cls, paragraph: str) -> List[str]:
+        """
+        The sentences of a paragraph, cut after the ".", "!" and "?" followed by a whitespace.
+        """
+        return [sentence for sentence in (match.strip() for match in cls.SENTENCE_BOUNDARY.split(paragraph)) if sentence]
+
+    def _split_long_sentence(self, sentence: str) -> List[str]:
+        """
+        Cut a sentence longer than a section between its words.
+        """
+        pieces, words = [], []
+        for word in sentence.split():
+            if words and self.token_counter(" ".join(words + [word])) > self.max_tokens:
+                pieces.append(" ".join(words))
+                words = []
+            words.append(word)
+        if words:
+            pieces.append(" ".join(words))
+        return pieces
+
+    def _paragraph_units(self, paragraph: str) -> List[Tuple[str, int]]:
+        """
+        The sentences (or the pieces of the sentences longer than a section) of a paragraph with their number of tokens.
+        """
+        units = []
+        for sentence in self.split_sentences(paragraph):
+            tokens = self.token_counter(sentence)
+            if tokens <= self.max_tokens:
+                units.append((sentence, tokens))
+            else:
+                units.extend((piece, self.token_counter(piece)) for piece in self._split_long_sentence(sentence))
+        return units
+
+    def chunk(self, text: str) -> List[str]:
+        """
+        Split a document into sections of at most `max_tokens` tokens (as counted by the token counter, summed over
+        the sentences of the section).
+
+        Args:
+        text (str): The document, whose paragraphs are separated by blank lines.
+
+        Returns:
+        List[str]: The sections, whose paragraphs are separated by blank lines.
+        """
+        sections = []
+        # The paragraphs of the current section, each one a list of sentences, and its number of tokens.
+        current: List[List[Tuple[str, int]]] = []
+        current_tokens = 0
+
+        def flush() -> None:
+            nonlocal current, current_tokens
+            paragraphs = [" ".join(sentence for sentence, _ in paragraph) for paragraph in current if paragraph]
+            if paragraphs:
+                sections.append("\n\n".join(paragraphs))
+            current, current_tokens = [], 0
+
+        def start_with_overlap(next_tokens: int) -> None:
+            # The last sentences of the section which was just cut are repeated at the start of the next one,
+            # leaving room for the next sentence.
+            nonlocal current, current_tokens
+            overlap, overlap_tokens = [], 0
+            max_overlap_tokens = min(self.overlap_tokens, self.max_tokens - next_tokens)
+            for sentence, tokens in reversed(current[-1] if current else []):
+                if overlap_tokens + tokens > max_overlap_tokens:
+                    break
+                overlap.insert(0, (sentence, tokens))
+                overlap_tokens += tokens
+            flush()
+            current, current_tokens = [overlap], overlap_tokens
+
+        for paragraph in self.split_paragraphs(text):
+            units = self._paragraph_units(paragraph)
+            paragraph_tokens = sum(tokens for _, tokens in units)
+            if current_tokens + paragraph_tokens <= self.max_tokens:
+                # Small adjacent paragraphs are packed together.
+                current.append(units)
+                current_tokens += paragraph_tokens
+                continue
+            if paragraph_tokens <= self.max_tokens:
+                # The paragraph fits in a section of its own: it is not cut.
+                flush()
+                current, current_tokens = [units], paragraph_tokens
+                continue
+            # The paragraph is larger than a section: its sentences fill the current section, then the next ones.
+            current.append([])
+            for sentence, tokens in units:
+                if current_tokens + tokens > self.max_tokens:
+                    start_with_overlap(tokens)
+                current[-1].append((sentence, tokens))
+                current_tokens += tokens
+        flush()
+        return sections
+
+    def chunk_documents(self, texts: Iterable[str]) -> List[List[str]]:
+        """
+        Split several documents into sections, e.g. for iText2KG.build_graphs.
+        """
+        return [self.chunk(text) for text in texts]
+
+    def chunk_file(self, path: str, encoding: str = "utf-8") -> List[str]:
+        """
+        Split a text file (e.g. one of the `datasets/*.txt` files) into sections.
+        """
+        with open(path, encoding=encoding) as file:
+            return self.chunk(file.read())
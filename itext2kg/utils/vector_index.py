@@ -0,0 +1,281 @@
+import time
+import numpy as np
+from typing import Dict, List, Tuple
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize the rows of a matrix. Rows with a null norm are left as zeros.
+    :param matrix: Matrix of shape (n, dim).
+    :return: The row-normalized matrix.
+    """
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+class VectorIndex:
+    """
+    Base class of the nearest-neighbour indexes used by the Matcher over entity and relationship embeddings.
+    The similarity is the cosine similarity, vectors are identified by their insertion order (0, 1, 2, ...).
+    """
+    def add(self, embeddings: np.ndarray) -> None:
+        """
+        Insert new vectors in the index. Their ids follow the ones already indexed.
+        :param embeddings: Matrix of shape (n, dim).
+        """
+        raise NotImplementedError
+
+    def search(self, queries: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Search the k nearest neighbours of each query.
+        :param queries: Matrix of shape (n_queries, dim).
+        :param k: Number of neighbours to return.
+        :return: (similarities, ids), both of shape (n_queries, k), sorted by decreasing similarity.
+                 Missing neighbours have an id of -1 and a similarity of -inf.
+        """
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class ExactVectorIndex(VectorIndex):
+    """
+    Brute-force index: every query is compared to every indexed vector. It is the exact-search fallback
+    and the reference used by `benchmark_vector_index`.
+    """
+    def __init__(self, dtype: np.dtype = np.float64) -> None:
+        """
+        :param dtype: Storage type of the vectors, np.float32 halves the memory of the index.
+        """
+        self.dtype = dtype
+        self._vectors = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors[:self._size]
+
+    def add(self, embeddings: np.ndarray) -> None:
+        embeddings = normalize_rows(np.atleast_2d(np.asarray(embeddings, dtype=self.dtype)))
+        if self._vectors is None:
+            self._vectors = np.empty((max(len(embeddings), 16), embeddings.shape[1]), dtype=self.dtype)
+        elif self._size + len(embeddings) > len(self._vectors):
+            # Amortized O(1) inserts by doubling the capacity.
+            capacity = max(2 * len(self._vectors), self._size + len(embeddings))
+            vectors = np.empty((capacity, self._vectors.shape[1]), dtype=self.dtype)
+            vectors[:self._size] = self._vectors[:self._size]
+            self._vectors = vectors
+        self._vectors[self._size:self._size + len(embeddings)] = embeddings
+        self._size += len(embeddings)
+
+    @staticmethod
+    def _top_k(similarities: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k_eff = min(k, similarities.shape[1])
+        if k_eff == 1:
+            # np.argmax keeps the first maximum, which makes k=1 searches deterministic.
+            ids = np.argmax(similarities, axis=1)[:, None]
+        else:
+            ids = np.argsort(-similarities, axis=1, kind="stable")[:, :k_eff]
+        top_similarities = np.take_along_axis(similarities, ids, axis=1)
+        if k_eff < k:
+            pad = k - k_eff
+            ids = np.hstack([ids, np.full((len(ids), pad), -1)])
+            top_similarities = np.hstack([top_similarities, np.full((len(ids), pad), -np.inf)])
+        return top_similarities, ids
+
+    def search(self, queries: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        queries = normalize_rows(np.atleast_2d(np.asarray(queries, dtype=self.dtype)))
+        if self._size == 0:
+            return np.full((len(queries), k), -np.inf), np.full((len(queries), k), -1)
+        return self._top_k(queries @ self.vectors.T, k)
+
+
+class IVFVectorIndex(ExactVectorIndex):
+    """
+    Pure-NumPy inverted file index. The vectors are clustered with a spherical k-means and each query is only
+    compared to the vectors of its `n_probe` closest clusters. Until enough vectors are inserted to train the
+    clusters, the index behaves as an exact index.
+    """
+    def __init__(self,
+                 n_lists: int = None,
+                 n_probe: int = 8,
+                 min_train_size: int = 1000,
+                 retrain_growth: float = 2.0,
+                 n_iter: int = 10,
+                 seed: int = 0,
+                 dtype: np.dtype = np.float64) -> None:
+        """
+        :param n_lists: Number of clusters. Defaults to sqrt(number of vectors) at training time.
+        :param n_probe: Number of clusters visited per query. Higher is more accurate and slower.
+        :param min_train_size: Number of vectors needed before training the clusters.
+        :param retrain_growth: The clusters are retrained when the index grows by this factor since the last training.
+        :param n_iter: Number of k-means iterations.
+        :param seed: Seed of the k-means initialization.
+        :param dtype: Storage type of the vectors, np.float32 halves the memory of the index.
+        """
+        super().__init__(dtype=dtype)
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_train_size = min_train_size
+        self.retrain_growth = retrain_growth
+        self.n_iter = n_iter
+        self.seed = seed
+        self._centroids = None
+        self._lists: List[List[int]] = []
+        self._list_arrays: Dict[int, np.ndarray] = {}
+        self._trained_size = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    def train(self) -> None:
+        """
+        (Re)train the clusters on all the indexed vectors and reassign them.
+        """
+        vectors = self.vectors
+        n_lists = min(self.n_lists or max(int(np.sqrt(len(vectors))), 1), len(vectors))
+        rng = np.random.default_rng(self.seed)
+        centroids = vectors[rng.choice(len(vectors), size=n_lists, replace=False)]
+        for _ in range(self.n_iter):
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            empty = ~np.any(sums, axis=1)
+            sums[empty] = centroids[empty]
+            centroids = normalize_rows(sums)
+
+        self._centroids = centroids
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        self._lists = [[] for _ in range(n_lists)]
+        for vector_id, list_id in enumerate(assignments):
+            self._lists[list_id].append(vector_id)
+        self._list_arrays = {}
+        self._trained_size = len(vectors)
+
+    def add(self, embeddings: np.ndarray) -> None:
+        first_id = self._size
+        super().add(embeddings)
+        if not self.is_trained:
+            if self._size >= self.min_train_size:
+                self.train()
+            return
+        if self._size >= self.retrain_growth * self._trained_size:
+            self.train()
+            return
+        assignments = np.argmax(self.vectors[first_id:] @ self._centroids.T, axis=1)
+        for vector_id, list_id in enumerate(assignments, start=first_id):
+            self._lists[list_id].append(vector_id)
+            self._list_arrays.pop(list_id, None)
+
+    def _list_array(self, list_id: int) -> np.ndarray:
+        if list_id not in self._list_arrays:
+            self._list_arrays[list_id] = np.array(self._lists[list_id], dtype=np.int64)
+        return self._list_arrays[list_id]
+
+    def search(self, queries: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        if not self.is_trained:
+            return super().search(queries, k)
+
+        queries = normalize_rows(np.atleast_2d(np.asarray(queries, dtype=self.dtype)))
+        n_probe = min(self.n_probe, len(self._centroids))
+        probes = np.argsort(-(queries @ self._centroids.T), axis=1)[:, :n_probe]
+
+        similarities = np.full((len(queries), k), -np.inf)
+        ids = np.full((len(queries), k), -1)
+        for i, query in enumerate(queries):
+            candidates = np.sort(np.concatenate([self._list_array(list_id) for list_id in probes[i]]))
+            if len(candidates) == 0:
+                continue
+            candidate_similarities, candidate_positions = self._top_k((self.vectors[candidates] @ query)[None, :], k)
+            valid = candidate_positions[0] >= 0
+            similarities[i, :valid.sum()] = candidate_similarities[0][valid]
+            ids[i, :valid.sum()] = candidates[candidate_positions[0][valid]]
+        return similarities, ids
+
+
+class FaissVectorIndex(VectorIndex):
+    """
+    HNSW index backed by faiss (optional dependency, `pip install faiss-cpu`).
+    """
+    def __init__(self, hnsw_m: int = 32, ef_construction: int = 80, ef_search: int = 64) -> None:
+        """
+        :param hnsw_m: Number of neighbours per node of the HNSW graph.
+        :param ef_construction: Size of the candidate list while building the graph.
+        :param ef_search: Size of the candidate list while searching. Higher is more accurate and slower.
+        """
+        try:
+            import faiss
+        except ImportError as e:
+            raise ImportError("FaissVectorIndex requires faiss, please install it with `pip install faiss-cpu`.") from e
+        self._faiss = faiss
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._index = None
+
+    def __len__(self) -> int:
+        return 0 if self._index is None else self._index.ntotal
+
+    def add(self, embeddings: np.ndarray) -> None:
+        embeddings = normalize_rows(np.atleast_2d(np.asarray(embeddings, dtype=np.float32)))
+        if self._index is None:
+            self._index = self._faiss.IndexHNSWFlat(embeddings.shape[1], self.hnsw_m, self._faiss.METRIC_INNER_PRODUCT)
+            self._index.hnsw.efConstruction = self.ef_construction
+        self._index.add(np.ascontiguousarray(embeddings))
+
+    def search(self, queries: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        queries = normalize_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        if self._index is None:
+            return np.full((len(queries), k), -np.inf), np.full((len(queries), k), -1)
+        self._index.hnsw.efSearch = max(self.ef_search, k)
+        similarities, ids = self._index.search(np.ascontiguousarray(queries), k)
+        similarities = similarities.astype(np.float64)
+        similarities[ids < 0] = -np.inf
+        return similarities, ids.astype(np.int64)
+
+
+def benchmark_vector_index(index: VectorIndex, embeddings: np.ndarray, queries: np.ndarray = None, k: int = 10, n_queries: int = 100, seed: int = 0) -> dict:
+    """
+    Report the recall and latency of an index against the exact search, to pick the accuracy/speed trade-off.
+    :param index: An empty index to evaluate.
+    :param embeddings: Matrix of the vectors to index.
+    :param queries: Matrix of queries. Defaults to `n_queries` vectors sampled from the embeddings.
+    :param k: Number of neighbours used to compute the recall.
+    :param n_queries: Number of sampled queries when `queries` is not provided.
+    :param seed: Seed of the query sampling.
+    :return: A dictionary with the recall@k, the build time and the per-query latencies of both indexes.
+    """
+    if queries is None:
+        rng = np.random.default_rng(seed)
+        queries = embeddings[rng.choice(len(embeddings), size=min(n_queries, len(embeddings)), replace=False)]
+
+    exact_index = ExactVectorIndex()
+    exact_index.add(embeddings)
+    start = time.perf_counter()
+    _, exact_ids = exact_index.search(queries, k)
+    exact_latency = (time.perf_counter() - start) / len(queries)
+
+    start = time.perf_counter()
+    index.add(embeddings)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, ids = index.search(queries, k)
+    latency = (time.perf_counter() - start) / len(queries)
+
+    hits = sum(len(set(row[row >= 0]) & set(exact_row[exact_row >= 0])) for row, exact_row in zip(ids, exact_ids))
+    return {
+        "recall@k": hits / max(int((exact_ids >= 0).sum()), 1),
+        "k": k,
+        "n_vectors": len(embeddings),
+        "n_queries": len(queries),
+        "build_time_s": build_time,
+        "latency_ms": 1000 * latency,
+        "exact_latency_ms": 1000 * exact_latency,
+    }
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from pydantic import BaseModel
+from itext2kg.irelations_extraction import iRelationsExtractor
+from itext2kg.models import Entity, Relationship
+from itext2kg.utils import LangchainOutputParser, TokenBudget, BudgetExceededError
+
+
+class Person(BaseModel):
+    name: str
+
+
+def test_budget_counts_the_tokens_of_the_responses_and_caps_the_calls():
+    usage = {"input_tokens": 120, "output_tokens": 30, "total_tokens": 150}
+    llm_model = GenericFakeChatModel(messages=iter([AIMessage(content='{"name": "Elon Musk"}', usage_metadata=usage)] * 2))
+    parser = LangchainOutputParser(llm_model=llm_model, embeddings_model=None)
+    budget = TokenBudget(max_calls=2)
+
+    for _ in range(2):
+        output = parser.extract_information_as_json_for_context(output_data_structure=Person, context="Elon Musk is the CEO of SpaceX.", budget=budget)
+        assert output == {"name": "Elon Musk"}
+    assert budget.stats() == {"calls": 2, "input_tokens": 240, "output_tokens": 60, "tokens": 300, "total_calls": 2, "total_tokens": 300}
+
+    with pytest.raises(BudgetExceededError):
+        parser.extract_information_as_json_for_context(output_data_structure=Person, context="Tesla produces electric cars.", budget=budget)
+
+    # A new document starts with a fresh budget, the totals are kept.
+    budget.start_document()
+    assert not budget.exhausted() and budget.total_tokens == 300
+
+
+def test_budget_decides_the_isolated_entities_rounds():
+    budget = TokenBudget(max_tokens=1000, min_isolated_entities=2, min_isolated_entities_ratio=0.25)
+    budget.record(300, 100)
+    assert budget.allows_isolated_entities_round(n_isolated_entities=3, n_entities=10)
+    assert not budget.allows_isolated_entities_round(n_isolated_entities=1, n_entities=2)
+    assert not budget.allows_isolated_entities_round(n_isolated_entities=2, n_entities=10)
+    # The remaining 200 tokens cannot pay for another call of 400 tokens.
+    budget.record(300, 100)
+    assert not budget.allows_isolated_entities_round(n_isolated_entities=3, n_entities=10)
+
+
+def test_isolated_entities_rounds_stop_when_the_budget_does_not_allow_them():
+    elon_musk, spacex, tesla, starlink = (Entity(name=name, label=label) for name, label in 
+                                          [("elon musk", "Person"), ("spacex", "Organization"), ("tesla", "Organization"), ("starlink", "Product")])
+    relationship = Relationship(startEntity=elon_musk, endEntity=spacex, name="ceo_of")
+    relationship.properties.embeddings = np.array([1.0, 0.0])
+    relations_extractor = iRelationsExtractor(llm_model=MagicMock(), embeddings_model=MagicMock())
+
+    with patch.object(relations_extractor, 'extract_relations', return_value=[relationship]) as mock_extract_relations:
+        relationships = relations_extractor.extract_verify_and_correct_relations(context="", 
+                                                                                 entities=[elon_musk, spacex, tesla, starlink],
+                                                                                 budget=TokenBudget(min_isolated_entities=3))
+    # Only two entities are isolated: no round for them.
+    assert mock_extract_relations.call_count == 1
+    assert relationships == [relationship]
+
+    with patch.object(relations_extractor, 'extract_relations', return_value=[relationship]) as mock_extract_relations:
+        relations_extractor.extract_verify_and_correct_relations(context="", entities=[elon_musk, spacex, tesla, starlink], 
+                                                                 max_tries_isolated_entities=3, budget=TokenBudget())
+    assert mock_extract_relations.call_count == 4
@@ -0,0 +1,73 @@
+import numpy as np
+from unittest.mock import MagicMock
+from langchain_core.language_models import FakeListChatModel
+from pydantic import BaseModel
+from itext2kg.utils import LangchainOutputParser, EmbeddingsCache, ResponseCache
+
+
+class Person(BaseModel):
+    name: str
+
+
+def embeddings_model():
+    model = MagicMock()
+    model.model = "fake-embeddings"
+    model.embed_documents.side_effect = lambda texts: [[len(text), 1.0] for text in texts]
+    model.embed_query.side_effect = lambda text: [len(text), 1.0]
+    return model
+
+
+def test_embeddings_cache_only_embeds_misses(tmp_path):
+    model = embeddings_model()
+    cache = EmbeddingsCache(path=str(tmp_path / "embeddings.sqlite"))
+    parser = LangchainOutputParser(llm_model=None, embeddings_model=model, embeddings_cache=cache)
+
+    embeddings = parser.calculate_embeddings(["Person", "Skill", "Person"])
+    assert np.array_equal(embeddings, [[6, 1], [5, 1], [6, 1]])
+    model.embed_documents.assert_called_once_with(["Person", "Skill"])
+
+    embeddings = parser.calculate_embeddings(["Skill", "works_at", "Person "])
+    assert np.array_equal(embeddings, [[5, 1], [8, 1], [6, 1]])
+    assert model.embed_documents.call_args.args[0] == ["works_at"]
+    # Queries are embedded with embed_query and cached apart from the documents.
+    for _ in range(2):
+        assert np.array_equal(parser.calculate_embeddings("works_at"), [8, 1])
+    model.embed_query.assert_called_once_with("works_at")
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 5
+
+    # A new process reads the embeddings back from the disk.
+    persisted_cache = EmbeddingsCache(path=str(tmp_path / "embeddings.sqlite"))
+    other_model = embeddings_model()
+    parser = LangchainOutputParser(llm_model=None, embeddings_model=other_model, embeddings_cache=persisted_cache)
+    assert np.array_equal(parser.calculate_embeddings(["Person", "works_at"]), [[6, 1], [8, 1]])
+    other_model.embed_documents.assert_not_called()
+
+
+def test_embeddings_cache_is_keyed_by_model():
+    cache = EmbeddingsCache(max_memory_items=2)
+    cache.set_many("model-a", ["Person"], [np.ones(2)])
+    assert cache.get_many("model-b", ["Person"]) == [None]
+    assert cache.get_many("model-a", ["Person"], method="query") == [None]
+    cache.set_many("model-a", ["Skill", "Company"], [np.zeros(2), np.zeros(2)])
+    # The in-memory LRU is bounded.
+    assert cache.get_many("model-a", ["Person"]) == [None]
+
+
+def test_response_cache_skips_answered_prompts(tmp_path):
+    llm_model = FakeListChatModel(responses=['{"name": "Elon Musk"}'] * 3)
+    cache = ResponseCache(path=str(tmp_path / "responses.sqlite"))
+    parser = LangchainOutputParser(llm_model=llm_model, embeddings_model=None, response_cache=cache)
+
+    for _ in range(2):
+        output = parser.extract_information_as_json_for_context(output_data_structure=Person, context="Elon Musk is the CEO of SpaceX.")
+        assert output == {"name": "Elon Musk"}
+    # The chain is built once and the second call is answered by the cache.
+    assert len(parser._chains) == 1
+    assert llm_model.i == 1 and cache.stats()["hits"] == 1
+
+    # A new process reads the responses back from the disk, unless the prompt changes.
+    parser = LangchainOutputParser(llm_model=llm_model, embeddings_model=None, response_cache=ResponseCache(path=str(tmp_path / "responses.sqlite")))
+    parser.extract_information_as_json_for_context(output_data_structure=Person, context="Elon Musk is the CEO of SpaceX.")
+    assert llm_model.i == 1
+    parser.extract_information_as_json_for_context(output_data_structure=Person, context="Tesla produces electric cars.")
+    assert llm_model.i == 2
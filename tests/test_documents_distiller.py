@@ -0,0 +1,81 @@
+import asyncio
+from typing import List
+import httpx
+import openai
+import pytest
+from langchain_core.language_models import FakeListChatModel
+from pydantic import BaseModel
+from itext2kg import DocumentsDistiller
+
+
+class Article(BaseModel):
+    title: str
+    keywords: List[str]
+
+
+class FailingChatModel(FakeListChatModel):
+    def _call(self, messages, *args, **kwargs):
+        if "broken" in messages[0].content:
+            raise RuntimeError("The model failed.")
+        return super()._call(messages, *args, **kwargs)
+
+
+class BadRequestChatModel(FakeListChatModel):
+    calls: int = 0
+
+    def _call(self, messages, *args, **kwargs):
+        self.calls += 1
+        if "too long" in messages[0].content:
+            response = httpx.Response(400, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+            raise openai.BadRequestError("The context is too long.", response=response, body=None)
+        return super()._call(messages, *args, **kwargs)
+
+
+def test_batched_distill_keeps_order_and_isolates_failures():
+    documents = ["First document.", "A broken document.", "Second document."]
+    llm_model = FailingChatModel(responses=['{"title": "First", "keywords": ["a"]}', '{"title": "Second", "keywords": ["b"]}'])
+    distiller = DocumentsDistiller(llm_model=llm_model)
+
+    outputs = distiller.langchain_output_parser.batch_extract_information_as_json(
+        output_data_structure=Article, contexts=documents, max_concurrency=1)
+    assert outputs == [{"title": "First", "keywords": ["a"]}, None, {"title": "Second", "keywords": ["b"]}]
+
+    distilled = asyncio.run(distiller.adistill(documents=documents, output_data_structure=Article, IE_query="", max_concurrency=1))
+    assert distilled == {"title": "First Second", "keywords": ["a", "b"]}
+
+
+def test_stream_distill_deduplicates_list_items():
+    responses = ['{"title": "First", "keywords": ["a", "b"]}', '{"title": "Second", "keywords": ["b", "c"]}', '{"title": "", "keywords": ["a"]}']
+    distiller = DocumentsDistiller(llm_model=FakeListChatModel(responses=responses))
+    documents = (f"Document {i}." for i in range(3))
+
+    snapshots = list(distiller.stream_distill(documents=documents, output_data_structure=Article, IE_query="", snapshot_every=2))
+    assert snapshots == [{"title": "First Second", "keywords": ["a", "b", "c"]}, 
+                         {"title": "First Second", "keywords": ["a", "b", "c"]}]
+
+
+def test_batched_extraction_does_not_retry_bad_requests():
+    llm_model = BadRequestChatModel(responses=['{"title": "First", "keywords": ["a"]}'])
+    distiller = DocumentsDistiller(llm_model=llm_model)
+
+    outputs = distiller.langchain_output_parser.batch_extract_information_as_json(
+        output_data_structure=Article, contexts=["First document.", "A document too long."], max_concurrency=1)
+    assert outputs == [{"title": "First", "keywords": ["a"]}, None]
+    assert llm_model.calls == 2
+
+    # The single calls do not retry them either.
+    with pytest.raises(openai.BadRequestError):
+        distiller.langchain_output_parser.extract_information_as_json_for_context(output_data_structure=Article, 
+                                                                                  context="A document too long.")
+    assert llm_model.calls == 3
+
+
+def test_stream_distill_skips_failed_documents_and_yields_the_final_state_once():
+    llm_model = FailingChatModel(responses=['{"title": "First", "keywords": ["a"]}', '{"title": "Second", "keywords": ["b"]}'])
+    distiller = DocumentsDistiller(llm_model=llm_model)
+    documents = ["First document.", "A broken document.", "Second document."]
+
+    snapshots = list(distiller.stream_distill(documents=documents, output_data_structure=Article, IE_query="", snapshot_every=1))
+    assert snapshots == [{"title": "First", "keywords": ["a"]}, 
+                         {"title": "First", "keywords": ["a"]}, 
+                         {"title": "First Second", "keywords": ["a", "b"]}]
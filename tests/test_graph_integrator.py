@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+from unittest.mock import MagicMock, patch
+from itext2kg import GraphIntegrator
+from itext2kg.models import Entity, Relationship, KnowledgeGraph
+
+
+def test_ingest_graph_sends_parameterized_batches():
+    entities = [Entity(name=f"person {i}", label="Person") for i in range(3)] + [Entity(name="spacex", label="Organization")]
+    for entity in entities:
+        entity.properties.embeddings = np.array([0.5, 1.0])
+    relationships = [Relationship(startEntity=entity, endEntity=entities[3], name="works_at") for entity in entities[:3]]
+    kg = KnowledgeGraph(entities=entities, relationships=relationships)
+
+    with patch("itext2kg.graph_integration.graph_integrator.GraphDatabase.driver") as driver:
+        session = driver.return_value.session.return_value.__enter__.return_value
+        tx = MagicMock()
+        session.execute_write.side_effect = lambda work: work(tx)
+        stats = GraphIntegrator(uri="bolt://localhost:7687", username="neo4j", password="password").ingest_graph(kg, batch_size=2)
+
+    # Person (2 batches), Organization (1 batch), works_at (2 batches), all over a single session.
+    assert driver.return_value.session.call_count == 1
+    assert stats["nodes"] == 4 and stats["relationships"] == 3 and stats["batches"] == 5
+    queries = [call.args[0] for call in tx.run.call_args_list]
+    assert queries[0] == "UNWIND $rows AS row MERGE (n:`Person` {name: row.name}) SET n += row.properties"
+    assert queries[3].startswith("UNWIND $rows AS row MATCH (n:`Person` {name: row.start}) MATCH (m:`Organization` {name: row.end})")
+    assert tx.run.call_args_list[0].kwargs["rows"] == [
+        {"name": "person 0", "properties": {"embeddings": [0.5, 1.0]}}, {"name": "person 1", "properties": {"embeddings": [0.5, 1.0]}}
+    ]
+
+
+def test_vector_indexes_of_labels_and_types_do_not_collide():
+    person, company = Entity(name="elon musk", label="Person"), Entity(name="spacex", label="works_at")
+    for entity in [person, company]:
+        entity.properties.embeddings = np.array([0.5, 1.0])
+    relationship = Relationship(startEntity=person, endEntity=company, name="works_at")
+    relationship.properties.embeddings = np.array([0.5, 1.0, 0.0])
+    kg = KnowledgeGraph(entities=[person, company], relationships=[relationship])
+
+    with patch("itext2kg.graph_integration.graph_integrator.GraphDatabase.driver") as driver:
+        session = driver.return_value.session.return_value.__enter__.return_value
+        integrator = GraphIntegrator(uri="bolt://localhost:7687", username="neo4j", password="password")
+        names = integrator.create_vector_indexes(kg)
+        # The label and the type sharing a name get an index each, with their own dimension.
+        assert names == ["node_Person_embeddings", "node_works_at_embeddings", "rel_works_at_embeddings"]
+        assert [call.kwargs["dimension"] for call in session.run.call_args_list] == [2, 2, 3]
+
+        other_person = Entity(name="gwynne shotwell", label="Person")
+        other_person.properties.embeddings = np.array([0.5, 1.0, 0.0])
+        with pytest.raises(ValueError):
+            integrator.create_vector_indexes(KnowledgeGraph(entities=[person, other_person], relationships=[]))
+
+
+def test_load_graph_decodes_embeddings_into_a_matrix():
+    nodes = [{"label": "Person", "name": "elon musk", "embeddings": [1.0, 0.0]},
+             {"label": "Organization", "name": "spacex", "embeddings": "0.0,1.0"},
+             {"label": "Organization", "name": "tesla", "embeddings": None}]
+    rels = [{"start_label": "Person", "start": "elon musk", "type": "ceo_of", "end_label": "Organization", "end": "spacex", "embeddings": [0.5, 0.5]}]
+
+    with patch("itext2kg.graph_integration.graph_integrator.GraphDatabase.driver") as driver:
+        session = driver.return_value.session.return_value.__enter__.return_value
+        count = lambda n: MagicMock(**{"single.return_value": {"count": n}})
+        # The records are consumed as they are fetched.
+        session.run.side_effect = [count(len(nodes)), iter(nodes), count(len(rels)), iter(rels)]
+        kg = GraphIntegrator(uri="bolt://localhost:7687", username="neo4j", password="password").load_graph()
+        queries = [call.args[0] for call in session.run.call_args_list]
+
+    assert [(entity.label, entity.name) for entity in kg.entities] == [("Person", "elon musk"), ("Organization", "spacex"), ("Organization", "tesla")]
+    assert np.array_equal(kg.entities[1].properties.embeddings, [0.0, 1.0])
+    assert kg.entities[2].properties.embeddings is None
+    # The embeddings are rows of one contiguous matrix.
+    assert kg.entities[0].properties.embeddings.base is kg.entities[1].properties.embeddings.base
+    assert kg.relationships[0].startEntity is kg.entities[0] and kg.relationships[0].name == "ceo_of"
+    assert np.array_equal(kg.relationships[0].properties.embeddings, [0.5, 0.5])
+    # The nodes without label are not loaded.
+    assert all("size(labels(n)) > 0" in query for query in queries)
+    assert "size(labels(m)) > 0" in queries[3]
+
+
+def test_load_graph_grows_the_matrix_beyond_the_counted_rows():
+    nodes = [{"label": "Person", "name": f"person {i}", "embeddings": [float(i), 1.0]} for i in range(3)]
+
+    with patch("itext2kg.graph_integration.graph_integrator.GraphDatabase.driver") as driver:
+        session = driver.return_value.session.return_value.__enter__.return_value
+        count = lambda n: MagicMock(**{"single.return_value": {"count": n}})
+        # Nodes created between the count and the read.
+        session.run.side_effect = [count(1), iter(nodes), count(0), iter([])]
+        kg = GraphIntegrator(uri="bolt://localhost:7687", username="neo4j", password="password").load_graph()
+
+    assert [entity.properties.embeddings.tolist() for entity in kg.entities] == [[0.0, 1.0], [1.0, 1.0], [2.0, 1.0]]
+
+
+def test_sync_graph_only_writes_the_delta(tmp_path):
+    elon_musk, spacex, tesla = (Entity(name=name, label=label) for name, label in 
+                                [("elon musk", "Person"), ("spacex", "Organization"), ("tesla", "Organization")])
+    kg = KnowledgeGraph(entities=[elon_musk, spacex], relationships=[Relationship(startEntity=elon_musk, endEntity=spacex, name="ceo_of")])
+    state_path = str(tmp_path / "state.json")
+
+    with patch("itext2kg.graph_integration.graph_integrator.GraphDatabase.driver") as driver:
+        session = driver.return_value.session.return_value.__enter__.return_value
+        tx = MagicMock()
+        session.execute_write.side_effect = lambda work: work(tx)
+        stats = GraphIntegrator(uri="bolt://localhost:7687", username="neo4j", password="password").sync_graph(kg, state_path=state_path)
+        assert stats["nodes"]["added"] == 2 and stats["relationships"]["added"] == 1
+
+        # A new integrator resumes from the state file: only tesla, the changed spacex and the new relationship are written.
+        tx.run.reset_mock()
+        spacex.properties.embeddings = np.array([1.0, 0.0])
+        kg = KnowledgeGraph(entities=[elon_musk, spacex, tesla], relationships=[Relationship(startEntity=elon_musk, endEntity=tesla, name="ceo_of")])
+        stats = GraphIntegrator(uri="bolt://localhost:7687", username="neo4j", password="password").sync_graph(kg, state_path=state_path)
+
+    assert stats["nodes"] == {"added": 1, "changed": 1, "removed": 0, "unchanged": 1}
+    assert stats["relationships"] == {"added": 1, "changed": 0, "removed": 1, "unchanged": 0}
+    queries = [call.args[0] for call in tx.run.call_args_list]
+    assert queries[0].endswith("DELETE r") and tx.run.call_args_list[0].kwargs["rows"] == [{"start": "elon musk", "end": "spacex"}]
+    assert tx.run.call_args_list[1].kwargs["rows"] == [{"name": "spacex", "properties": {"embeddings": [1.0, 0.0]}}, 
+                                                       {"name": "tesla", "properties": {"embeddings": None}}]
+    assert len(queries) == 3
@@ -1,8 +1,15 @@
+import asyncio
+import json
 import pytest
 import pickle
+from concurrent.futures import ProcessPoolExecutor
 from unittest.mock import patch, MagicMock
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListChatModel
 from itext2kg import iText2KG
-from itext2kg.utils import Matcher
+from itext2kg.utils import Matcher, EmbeddingsCache, ResponseCache, RateLimiter, TokenBudget
+from itext2kg.models import Entity, Relationship, KnowledgeGraph, CompactKnowledgeGraph
+import numpy as np
 import os
 
 
@@ -22,6 +29,21 @@ expected_relations = ENTITIES_AND_RELATIONS[5]
 
 matcher = Matcher()
 
+
+class KeywordChatModel(FakeListChatModel):
+    """A picklable chat model extracting the known entities found in the prompt and linking the person to the companies."""
+    responses: list = []
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs) -> str:
+        prompt = messages[-1].content.lower()
+        companies = [name for name in ["spacex", "tesla", "neuralink"] if name in prompt]
+        if "knowledge graph builder" in prompt:
+            return json.dumps({"entities": [{"name": "elon musk", "label": "Person"}] + 
+                                           [{"name": name, "label": "Company"} for name in companies]})
+        return json.dumps({"relationships": [{"startNode": {"name": "elon musk", "label": "Person"}, 
+                                              "endNode": {"name": name, "label": "Company"}, 
+                                              "name": "leads"} for name in companies]})
+
 @pytest.fixture
 def itext2kg():
     """Fixture to initialize the iText2KG instance with mock models."""
@@ -54,4 +76,359 @@ def test_build_graph_multiple_sections_merge(itext2kg):
                 # Assert that the resulting knowledge graph matches the expected one (merged case)
                 assert set(result_graph.entities) == set(expected_entities)
                 expected_relations.extend(relations_1)
-                assert set(result_graph.relationships) == set(expected_relations)
\ No newline at end of file
+                assert set(result_graph.relationships) == set(expected_relations)
+
+def test_invented_entities_are_resolved_in_one_batch(itext2kg):
+    """Test that the invented entities of extract_relations are embedded with a single embed_documents call."""
+    elon_musk, spacex, tesla = (Entity(name=name, label=label) for name, label in 
+                                [("elon musk", "Person"), ("spacex", "Organization"), ("tesla", "Organization")])
+    for entity, embedding in zip([elon_musk, spacex, tesla], np.eye(3)):
+        entity.properties.embeddings = embedding
+    llm_output = {"relationships": [
+        {"startNode": {"name": "Elon Musk", "label": "Person"}, "endNode": {"name": "SpaceX Corp", "label": "Organization"}, "name": "CEO"},
+        {"startNode": {"name": "Elon R. Musk", "label": "Person"}, "endNode": {"name": "Tesla", "label": "Organization"}, "name": "CEO"},
+        {"startNode": {"name": "Elon R. Musk", "label": "Person"}, "endNode": {"name": "SpaceX Corp", "label": "Organization"}, "name": "founder"},
+    ]}
+    invented_embeddings = {"spacex corp": [0.1, 1, 0], "elon r. musk": [1, 0.1, 0], "Organization": [0, 1, 0], "Person": [1, 0, 0]}
+    embeddings_model = itext2kg.irelations_extractor.langchain_output_parser.embeddings_model
+    embeddings_model.embed_documents.side_effect = lambda texts: [invented_embeddings.get(text, [0, 0, 1]) for text in texts]
+
+    with patch.object(itext2kg.irelations_extractor.langchain_output_parser, 'extract_information_as_json_for_context', return_value=llm_output):
+        relationships = itext2kg.irelations_extractor.extract_relations(context="", entities=[elon_musk, spacex, tesla])
+
+    # One call for the two unique invented entities, one call for the relationship names.
+    assert embeddings_model.embed_documents.call_count == 2
+    assert embeddings_model.embed_documents.call_args_list[0].args[0] == ["spacex corp", "elon r. musk", "Organization", "Person"]
+    assert {(rel.startEntity, rel.endEntity, rel.name) for rel in relationships} == {
+        (elon_musk, spacex, "CEO"), (elon_musk, tesla, "CEO"), (elon_musk, spacex, "founder")
+    }
+
+
+def test_aextract_relations_shares_the_retries_of_extract_relations(itext2kg):
+    """Test that the sync and async extractions retry the same outputs and build the same relationships."""
+    elon_musk, spacex = (Entity(name=name, label=label) for name, label in [("elon musk", "Person"), ("spacex", "Organization")])
+    for entity, embedding in zip([elon_musk, spacex], np.eye(2)):
+        entity.properties.embeddings = embedding
+    llm_output = {"relationships": [
+        {"startNode": {"name": "Elon Musk", "label": "Person"}, "endNode": {"name": "SpaceX", "label": "Organization"}, "name": "CEO"},
+    ]}
+    outputs = [ValueError("not json"), {"entities": []}, llm_output]
+    embeddings = lambda texts: np.ones((len(texts), 2)) if isinstance(texts, list) else np.ones(2)
+    extractor = itext2kg.irelations_extractor
+    parser = extractor.langchain_output_parser
+
+    async def aembeddings(texts):
+        return embeddings(texts)
+
+    with patch.object(parser, 'extract_information_as_json_for_context', side_effect=outputs) as extract, \
+         patch.object(parser, 'aextract_information_as_json_for_context', side_effect=outputs) as aextract, \
+         patch.object(parser, 'calculate_embeddings', side_effect=embeddings), \
+         patch.object(parser, 'acalculate_embeddings', side_effect=aembeddings):
+        relationships = extractor.extract_relations(context="", entities=[elon_musk, spacex])
+        arelationships = asyncio.run(extractor.aextract_relations(context="", entities=[elon_musk, spacex]))
+
+    assert extract.call_count == aextract.call_count == 3
+    assert relationships == arelationships == [Relationship(startEntity=elon_musk, endEntity=spacex, name="CEO")]
+    assert np.array_equal(relationships[0].properties.embeddings, arelationships[0].properties.embeddings)
+
+    # Both fail the same way once the tries are exhausted.
+    with patch.object(parser, 'extract_information_as_json_for_context', return_value=None), \
+         patch.object(parser, 'aextract_information_as_json_for_context', return_value=None):
+        with pytest.raises(ValueError):
+            extractor.extract_relations(context="", entities=[elon_musk, spacex], max_tries=2)
+        with pytest.raises(ValueError):
+            asyncio.run(extractor.aextract_relations(context="", entities=[elon_musk, spacex], max_tries=2))
+
+
+def test_embed_entities_only_embeds_unique_texts():
+    """Test that embed_entities and embed_relationships send each distinct string once."""
+    embeddings_function = MagicMock(side_effect=lambda texts: np.array([[len(text), 1.0] for text in texts]))
+    entities = [Entity(name=name, label="Skill") for name in ["python", "java", "docker"]] + [Entity(name="python", label="Language")]
+    kg = KnowledgeGraph(entities=entities, relationships=[Relationship(startEntity=entities[0], endEntity=entity, name="related_to") 
+                                                          for entity in entities[1:]])
+    kg.embed_entities(embeddings_function=embeddings_function, entity_name_weight=1, entity_label_weight=0)
+    embeddings_function.assert_called_once_with(["python", "java", "docker", "Skill", "Language"])
+    assert [list(entity.properties.embeddings) for entity in kg.entities] == [[6, 1], [4, 1], [6, 1], [6, 1]]
+
+    kg.embed_relationships(embeddings_function=embeddings_function)
+    assert embeddings_function.call_args.args[0] == ["related_to"]
+    assert all(list(rel.properties.embeddings) == [10, 1] for rel in kg.relationships)
+
+
+def test_abuild_graph_matches_build_graph(itext2kg):
+    """Test that the concurrent build mode merges the sections like the sequential one."""
+    sections = ["Elon Musk is the CEO of SpaceX. Tesla produces electric cars.",
+                "Elon Musk leads SpaceX as its chief executive officer. Tesla Inc. manufactures electric vehicles."]
+    with patch.object(itext2kg.ientities_extractor, 'extract_entities', side_effect=[entities_1, entities_2]), \
+         patch.object(itext2kg.irelations_extractor, 'extract_verify_and_correct_relations', side_effect=[relations_1, relations_2]):
+        sequential_graph = itext2kg.build_graph(sections=sections, rel_threshold=0.6)
+
+    async def aextract_entities(context, **kwargs):
+        # The second section finishes first: the merge must still follow the order of the sections.
+        await asyncio.sleep(0.01 if context == sections[0] else 0)
+        return entities_1 if context == sections[0] else entities_2
+
+    async def aextract_verify_and_correct_relations(context, entities, **kwargs):
+        return relations_1 if context == sections[0] else relations_2
+
+    with patch.object(itext2kg.ientities_extractor, 'aextract_entities', side_effect=aextract_entities), \
+         patch.object(itext2kg.irelations_extractor, 'aextract_verify_and_correct_relations', side_effect=aextract_verify_and_correct_relations):
+        concurrent_graph = asyncio.run(itext2kg.abuild_graph(sections=sections, rel_threshold=0.6, max_concurrency=2))
+
+    assert concurrent_graph.entities == sequential_graph.entities
+    assert concurrent_graph.relationships == sequential_graph.relationships
+
+    # Without sections, both modes return the existing knowledge graph alone.
+    existing_graph = KnowledgeGraph(entities=entities_1, relationships=relations_1)
+    sequential_graph = itext2kg.build_graph(sections=[], existing_knowledge_graph=existing_graph)
+    concurrent_graph = asyncio.run(itext2kg.abuild_graph(sections=[], existing_knowledge_graph=existing_graph))
+    assert concurrent_graph.entities == sequential_graph.entities
+    assert concurrent_graph.relationships == sequential_graph.relationships
+    assert asyncio.run(itext2kg.abuild_graph(sections=[])).entities == []
+
+
+def test_save_and_load_columnar_knowledge_graph(tmp_path):
+    """Test that the columnar format round-trips a graph, memory-mapping its embeddings."""
+    elon_musk, spacex = Entity(name="elon musk", label="Person"), Entity(name="spacex", label="Organization")
+    elon_musk.properties.embeddings, spacex.properties.embeddings = np.array([1.0, 0.0]), np.array([0.0, 1.0])
+    # An endpoint equal to an entity of the graph but with other embeddings gets a row of its own.
+    other_spacex = Entity(name="spacex", label="Organization")
+    other_spacex.properties.embeddings = np.array([0.6, 0.8])
+    tesla = Entity(name="tesla", label="Organization")
+    relationships = [Relationship(startEntity=elon_musk, endEntity=spacex, name="ceo_of"),
+                     Relationship(startEntity=elon_musk, endEntity=other_spacex, name="founder_of"),
+                     Relationship(startEntity=elon_musk, endEntity=tesla, name="ceo_of")]
+    relationships[0].properties.embeddings = np.array([0.5, 0.5])
+    kg = KnowledgeGraph(entities=[elon_musk, spacex], relationships=relationships)
+
+    kg.save(str(tmp_path / "kg"))
+    loaded_kg = KnowledgeGraph.load(str(tmp_path / "kg"))
+
+    assert loaded_kg.entities == kg.entities and loaded_kg.relationships == kg.relationships
+    assert isinstance(loaded_kg.entities[0].properties.embeddings, np.memmap)
+    assert np.array_equal(loaded_kg.relationships[1].endEntity.properties.embeddings, [0.6, 0.8])
+    assert loaded_kg.relationships[0].endEntity is loaded_kg.entities[1]
+    assert loaded_kg.relationships[2].endEntity.properties.embeddings is None
+    assert np.array_equal(loaded_kg.relationships[0].properties.embeddings, [0.5, 0.5])
+    assert loaded_kg.relationships[1].properties.embeddings is None
+
+
+def test_compact_knowledge_graph_is_lossless():
+    """Test the conversions between KnowledgeGraph and CompactKnowledgeGraph."""
+    entities = [Entity(name=name, label=label) for name, label in [("elon musk", "Person"), ("spacex", "Organization"), ("tesla", "Organization")]]
+    for entity, embedding in zip(entities, np.eye(3)):
+        entity.properties.embeddings = embedding
+    relationships = [Relationship(startEntity=entities[0], endEntity=entities[1], name="ceo_of")]
+    kg = KnowledgeGraph(entities=entities, relationships=relationships)
+
+    compact_kg = CompactKnowledgeGraph.from_knowledge_graph(kg)
+    assert compact_kg.labels == ["Person", "Organization"] and compact_kg.entity_embeddings.shape == (3, 3)
+    assert list(compact_kg.relationship_starts) == [0] and list(compact_kg.relationship_ends) == [1]
+    assert list(compact_kg.find_isolated_entities()) == [2]
+
+    converted_kg = compact_kg.to_knowledge_graph()
+    assert converted_kg.entities == kg.entities and converted_kg.relationships == kg.relationships
+    assert all(np.array_equal(converted.properties.embeddings, entity.properties.embeddings) 
+               for converted, entity in zip(converted_kg.entities, kg.entities))
+    assert converted_kg.relationships[0].properties.embeddings is None
+
+
+def test_knowledge_graph_indexes_follow_the_lists():
+    """Test the lookup, adjacency and degree indexes of KnowledgeGraph."""
+    elon_musk, spacex, tesla = (Entity(name=name, label=label) for name, label in 
+                                [("elon musk", "Person"), ("spacex", "Organization"), ("tesla", "Organization")])
+    kg = KnowledgeGraph(entities=[elon_musk, spacex, tesla], relationships=[Relationship(startEntity=elon_musk, endEntity=spacex, name="ceo_of")])
+    assert kg.get_entity(Entity(name="spacex", label="Organization")) is spacex
+    assert kg.get_entity(Entity(name="spacex", label="Person")) is None
+    assert kg.find_isolated_entities() == [tesla]
+
+    # Appended relationships are indexed incrementally.
+    kg.relationships.append(Relationship(startEntity=tesla, endEntity=elon_musk, name="led_by"))
+    assert kg.find_isolated_entities() == []
+    assert kg.degree(elon_musk) == 2 and kg.get_neighbours(elon_musk) == [spacex, tesla]
+    assert [rel.name for rel in kg.get_incoming_relationships(elon_musk)] == ["led_by"]
+
+    # Reassigned lists are reindexed.
+    kg.relationships = kg.relationships[:1]
+    assert kg.degree(elon_musk) == 1 and kg.find_isolated_entities() == [tesla]
+
+    # Replaced, inserted and removed items are reindexed too.
+    kg.relationships[0] = Relationship(startEntity=spacex, endEntity=tesla, name="partner_of")
+    assert kg.degree(elon_musk) == 0 and kg.find_isolated_entities() == [elon_musk]
+    kg.relationships.pop()
+    kg.relationships.append(Relationship(startEntity=elon_musk, endEntity=tesla, name="ceo_of"))
+    assert kg.degree(elon_musk) == 1 and kg.find_isolated_entities() == [spacex]
+    kg.entities.remove(spacex)
+    kg.entities.insert(0, spacex)
+    del kg.entities[0]
+    assert kg.get_entity(spacex) is None and kg.get_entity(tesla) is tesla
+
+    # Graphs built without validation are tracked as well.
+    kg = KnowledgeGraph.model_construct(entities=[elon_musk, spacex], relationships=[])
+    assert kg.get_entity(spacex) is spacex
+    kg.entities[1] = tesla
+    assert kg.get_entity(spacex) is None and kg.get_entity(tesla) is tesla
+
+
+def test_isolated_entities_are_checked_against_all_the_relationships(itext2kg):
+    """Test that the isolated entities of a retry are the entities linked by none of the curated relationships."""
+    elon_musk, spacex, tesla = (Entity(name=name, label=label) for name, label in 
+                                [("elon musk", "Person"), ("spacex", "Organization"), ("tesla", "Organization")])
+    relations_extractor = itext2kg.irelations_extractor
+    first_relationships = [Relationship(startEntity=elon_musk, endEntity=spacex, name="ceo_of")]
+    corrected_relationships = [Relationship(startEntity=tesla, endEntity=elon_musk, name="led_by")]
+    for relationship in first_relationships + corrected_relationships:
+        relationship.properties.embeddings = np.array([1.0, 0.0]) if relationship.name == "ceo_of" else np.array([0.0, 1.0])
+
+    with patch.object(relations_extractor, 'extract_relations', side_effect=[first_relationships, corrected_relationships]) as mock_extract_relations:
+        relationships = relations_extractor.extract_verify_and_correct_relations(context="", entities=[elon_musk, spacex, tesla])
+
+    assert mock_extract_relations.call_count == 2
+    assert mock_extract_relations.call_args.kwargs["isolated_entities_without_relations"] == [tesla]
+    assert [rel.name for rel in relationships] == ["ceo_of", "led_by"]
+
+def test_build_graphs_merges_the_documents_in_a_tree(itext2kg):
+    """The graphs of the documents are built independently then merged pairwise."""
+    graphs = {
+        "doc1": KnowledgeGraph(entities=entities_1, relationships=relations_1),
+        "doc2": KnowledgeGraph(entities=entities_2, relationships=relations_2),
+        "doc3": KnowledgeGraph(entities=entities_1, relationships=relations_1),
+    }
+    with patch.object(itext2kg, 'build_graph', side_effect=lambda sections, **kwargs: graphs[sections[0]]) as mock_build_graph, \
+         patch.object(itext2kg, '_merge_graphs', wraps=itext2kg._merge_graphs) as mock_merge_graphs:
+        result_graph = itext2kg.build_graphs([["doc1"], ["doc2"], ["doc3"]], rel_threshold=0.6, max_workers=2)
+
+    assert mock_build_graph.call_count == 3
+    # ((doc1, doc2), doc3): two levels of merges.
+    assert mock_merge_graphs.call_count == 2
+    assert mock_merge_graphs.call_args_list[0].args[:2] == (graphs["doc1"], graphs["doc2"])
+
+    expected_graph = itext2kg._merge_graphs(itext2kg._merge_graphs(graphs["doc1"], graphs["doc2"], 0.7, 0.6), graphs["doc3"], 0.7, 0.6)
+    assert set(result_graph.entities) == set(expected_graph.entities)
+    assert set(result_graph.relationships) == set(expected_graph.relationships)
+    assert set(result_graph.entities) == set(expected_entities)
+
+    with pytest.raises(ValueError):
+        itext2kg.build_graphs([])
+
+def test_build_graph_resumes_from_its_checkpoint(itext2kg, tmp_path):
+    """A run failing at the second section resumes without extracting again what was already extracted."""
+    sections = ["Elon Musk is the CEO of SpaceX. Tesla produces electric cars.",
+                "Elon Musk leads SpaceX as its chief executive officer. Tesla Inc. manufactures electric vehicles."]
+    with patch.object(itext2kg.ientities_extractor, 'extract_entities', side_effect=[entities_1, entities_2]), \
+         patch.object(itext2kg.irelations_extractor, 'extract_verify_and_correct_relations', side_effect=[relations_1, relations_2]):
+        expected_graph = itext2kg.build_graph(sections=sections, rel_threshold=0.6)
+
+    checkpoint_dir = str(tmp_path / "checkpoint")
+    with patch.object(itext2kg.ientities_extractor, 'extract_entities', side_effect=[entities_1, entities_2]), \
+         patch.object(itext2kg.irelations_extractor, 'extract_verify_and_correct_relations', side_effect=[relations_1, ValueError("max_tries")]):
+        with pytest.raises(ValueError):
+            itext2kg.build_graph(sections=sections, rel_threshold=0.6, checkpoint_dir=checkpoint_dir)
+
+    with patch.object(itext2kg.ientities_extractor, 'extract_entities') as mock_extract_entities, \
+         patch.object(itext2kg.irelations_extractor, 'extract_verify_and_correct_relations', side_effect=[relations_2]) as mock_extract_relations:
+        result_graph = itext2kg.build_graph(sections=sections, rel_threshold=0.6, checkpoint_dir=checkpoint_dir)
+
+    assert mock_extract_entities.call_count == 0
+    assert mock_extract_relations.call_count == 1
+    assert set(result_graph.entities) == set(expected_graph.entities)
+    assert set(result_graph.relationships) == set(expected_graph.relationships)
+
+    # Every section is completed: nothing is extracted again.
+    with patch.object(itext2kg.ientities_extractor, 'extract_entities') as mock_extract_entities, \
+         patch.object(itext2kg.irelations_extractor, 'extract_verify_and_correct_relations') as mock_extract_relations:
+        assert set(itext2kg.build_graph(sections=sections, rel_threshold=0.6, checkpoint_dir=checkpoint_dir).relationships) == set(expected_graph.relationships)
+    assert mock_extract_entities.call_count == 0 and mock_extract_relations.call_count == 0
+
+    with pytest.raises(ValueError):
+        itext2kg.build_graph(sections=sections, rel_threshold=0.7, checkpoint_dir=checkpoint_dir)
+    # The extractions of the completed sections are removed.
+    assert not os.listdir(os.path.join(checkpoint_dir, "sections"))
+
+    # A run failing before completing any section is fingerprinted too: its extractions are not reused with other inputs.
+    checkpoint_dir = str(tmp_path / "failed_checkpoint")
+    with patch.object(itext2kg.ientities_extractor, 'extract_entities', side_effect=[entities_1]), \
+         patch.object(itext2kg.irelations_extractor, 'extract_verify_and_correct_relations', side_effect=ValueError("max_tries")):
+        with pytest.raises(ValueError):
+            itext2kg.build_graph(sections=sections, rel_threshold=0.6, checkpoint_dir=checkpoint_dir)
+    with pytest.raises(ValueError, match="other inputs"):
+        itext2kg.build_graph(sections=sections[::-1], rel_threshold=0.6, checkpoint_dir=checkpoint_dir)
+    with patch.object(itext2kg.ientities_extractor, 'extract_entities', side_effect=[entities_2]) as mock_extract_entities, \
+         patch.object(itext2kg.irelations_extractor, 'extract_verify_and_correct_relations', side_effect=[relations_1, relations_2]):
+        result_graph = itext2kg.build_graph(sections=sections, rel_threshold=0.6, checkpoint_dir=checkpoint_dir)
+    assert mock_extract_entities.call_count == 1
+    assert set(result_graph.relationships) == set(expected_graph.relationships)
+
+def test_stream_graph_yields_the_delta_of_each_section(itext2kg):
+    """The streamed deltas add up to the graph of build_graph."""
+    sections = ["Elon Musk is the CEO of SpaceX. Tesla produces electric cars.",
+                "Elon Musk leads SpaceX as its chief executive officer. Tesla Inc. manufactures electric vehicles."]
+    with patch.object(itext2kg.ientities_extractor, 'extract_entities', side_effect=[entities_1, entities_2]), \
+         patch.object(itext2kg.irelations_extractor, 'extract_verify_and_correct_relations', side_effect=[relations_1, relations_2]):
+        expected_graph = itext2kg.build_graph(sections=sections, rel_threshold=0.6)
+
+    with patch.object(itext2kg.ientities_extractor, 'extract_entities', side_effect=[entities_1, entities_2]) as mock_extract_entities, \
+         patch.object(itext2kg.irelations_extractor, 'extract_verify_and_correct_relations', side_effect=[relations_1, relations_2]):
+        stream = itext2kg.stream_graph(iter(sections), rel_threshold=0.6)
+        first_delta = next(stream)
+        # The second section is not processed before the first delta is consumed.
+        assert mock_extract_entities.call_count == 1
+        deltas = [first_delta] + list(stream)
+
+    assert [delta.section for delta in deltas] == [0, 1]
+    assert set(first_delta.added_entities) == set(entities_1)
+    assert first_delta.merged_entities == [] and first_delta.merged_relationships == []
+    assert set(deltas[1].merged_entities) <= set(first_delta.added_entities)
+    assert set(deltas[1].merged_entities)
+    assert set(entity for delta in deltas for entity in delta.added_entities) == set(expected_graph.entities)
+    assert set(relationship for delta in deltas for relationship in delta.added_relationships) == set(expected_graph.relationships)
+    assert set(deltas[1].to_knowledge_graph().entities) == set(deltas[1].added_entities + deltas[1].merged_entities)
+
+
+def test_stream_graph_resumes_from_its_checkpoint(itext2kg, tmp_path):
+    """A resumed stream starts with the restored graph, then streams the remaining sections."""
+    sections = ["Elon Musk is the CEO of SpaceX. Tesla produces electric cars.",
+                "Elon Musk leads SpaceX as its chief executive officer. Tesla Inc. manufactures electric vehicles."]
+    checkpoint_dir = str(tmp_path / "checkpoint")
+    with patch.object(itext2kg.ientities_extractor, 'extract_entities', side_effect=[entities_1, entities_2]), \
+         patch.object(itext2kg.irelations_extractor, 'extract_verify_and_correct_relations', side_effect=[relations_1, ValueError("max_tries")]):
+        stream = itext2kg.stream_graph(iter(sections), rel_threshold=0.6, checkpoint_dir=checkpoint_dir)
+        first_delta = next(stream)
+        with pytest.raises(ValueError):
+            next(stream)
+
+    with patch.object(itext2kg.ientities_extractor, 'extract_entities') as mock_extract_entities, \
+         patch.object(itext2kg.irelations_extractor, 'extract_verify_and_correct_relations', side_effect=[relations_2]):
+        deltas = list(itext2kg.stream_graph(iter(sections), rel_threshold=0.6, checkpoint_dir=checkpoint_dir))
+
+    assert mock_extract_entities.call_count == 0
+    assert [delta.section for delta in deltas] == [0, 1]
+    assert set(deltas[0].added_entities) == set(first_delta.added_entities)
+    assert set(deltas[0].added_relationships) == set(first_delta.added_relationships)
+
+
+def test_build_graphs_runs_in_a_process_pool(tmp_path):
+    """The builder, its caches and its rate limiter can be sent to the workers of a ProcessPoolExecutor."""
+    builder = iText2KG(llm_model=KeywordChatModel(), 
+                       embeddings_model=DeterministicFakeEmbedding(size=16),
+                       embeddings_cache=EmbeddingsCache(str(tmp_path / "embeddings.db")),
+                       response_cache=ResponseCache(str(tmp_path / "responses.db")),
+                       rate_limiter=RateLimiter(requests_per_minute=6000))
+    documents = [["Elon Musk leads SpaceX."], ["Elon Musk leads Tesla."], ["Elon Musk founded Neuralink."]]
+    for obj in [builder.rate_limiter, TokenBudget(max_calls=3), builder.ientities_extractor.langchain_output_parser.embeddings_cache]:
+        assert type(pickle.loads(pickle.dumps(obj))) is type(obj)
+
+    # Each document gets its own budget of 2 calls, and its own checkpoint.
+    budget = TokenBudget(max_calls=2)
+    expected_graph = builder.build_graphs(documents, max_workers=2, budget=budget, checkpoint_dir=str(tmp_path / "checkpoint"))
+    assert budget.total_calls == 6
+    assert sorted(os.listdir(tmp_path / "checkpoint")) == ["document-0", "document-1", "document-2"]
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        result_graph = builder.build_graphs(documents, executor=executor)
+
+    assert {(entity.name, entity.label) for entity in result_graph.entities} == {
+        ("elon musk", "Person"), ("spacex", "Company"), ("tesla", "Company"), ("neuralink", "Company")
+    }
+    assert set(result_graph.entities) == set(expected_graph.entities)
+    assert set(result_graph.relationships) == set(expected_graph.relationships)
+    assert len(result_graph.relationships) == 3
@@ -1,7 +1,9 @@
 import pytest
+import numpy as np
 import pickle
-from itext2kg.utils import Matcher
-from itext2kg.models import Entity
+from itext2kg.utils import Matcher, EntityStore
+from itext2kg.models import Entity, Relationship, normalize_embeddings
+from itext2kg.models.knowledge_graph import EntityProperties
 import os
 
 # Import current_entities.pkl
@@ -48,3 +50,95 @@ class Testor:
         assert(len(matched_entities) == len(current_entities))
         assert(len(global_entities_final) == len(GLOBAL_ENTITIES_FINAL))
         assert(set(global_entities_final) == set(GLOBAL_ENTITIES_FINAL))
+
+    @pytest.mark.parametrize(
+        "current_entities, global_entities",
+        [(CURRENT_ENTITIES, GLOBAL_ENTITIES)],
+        ids=["vectorized matching equals the pairwise scan"],
+    )
+    def test_vectorized_matching(self, current_entities, global_entities):
+        from sklearn.metrics.pairwise import cosine_similarity
+
+        def pairwise_find_match(obj1, list_objects, threshold):
+            best_match, best_cosine_sim = None, threshold
+            for obj2 in list_objects:
+                if obj1.name == obj2.name and obj1.label == obj2.label:
+                    return obj1
+                cosine_sim = cosine_similarity(obj1.properties.embeddings.reshape(1, -1),
+                                               obj2.properties.embeddings.reshape(1, -1))[0][0]
+                if cosine_sim > best_cosine_sim:
+                    best_cosine_sim, best_match = cosine_sim, obj2
+            return best_match if best_match else obj1
+
+        for threshold in [0.3, 0.5, 0.7, 0.9]:
+            expected = [pairwise_find_match(obj1, global_entities, threshold) for obj1 in current_entities]
+            matched = matcher.find_matches(current_entities, global_entities, threshold=threshold)
+            assert [(ent.name, ent.label) for ent in matched] == [(ent.name, ent.label) for ent in expected]
+
+    def test_label_blocking(self):
+        python_language = Entity(name='python', label='Language', properties={"embeddings": np.array([1.0, 0.0, 0.0])})
+        python_snake = Entity(name='python', label='Animal', properties={"embeddings": np.array([0.9, 0.1, 0.0])})
+        pythons = Entity(name='pythons', label='Animal', properties={"embeddings": np.array([0.0, 1.0, 0.0])})
+
+        # The exact (name, label) hit is resolved through the key index.
+        assert matcher.find_match(python_snake, [python_language, python_snake], threshold=0.5) is python_snake
+        # Without blocking, the Animal is merged with the Language which is the most similar.
+        assert matcher.find_match(python_snake, [python_language, pythons], threshold=0.5) == python_language
+
+        blocking_matcher = Matcher(blocking="label")
+        assert blocking_matcher.find_match(python_snake, [python_language, pythons], threshold=0.5) is python_snake
+        assert blocking_matcher.find_match(python_snake, [python_language, pythons], threshold=0.0) == pythons
+
+        compatible_matcher = Matcher(blocking={"Animal": ["Language"]})
+        assert compatible_matcher.find_match(python_snake, [python_language, pythons], threshold=0.5) == python_language
+
+    def test_relationship_endpoint_blocking(self):
+        elon_musk, spacex, tesla = Entity(name='elon musk', label='Person'), Entity(name='spacex', label='Company'), Entity(name='tesla', label='Company')
+        relationship = lambda start, end, name, embeddings: Relationship(startEntity=start, endEntity=end, name=name, 
+                                                                          properties={"embeddings": np.array(embeddings)})
+        ceo_of_tesla = relationship(elon_musk, tesla, "ceo_of", [1.0, 0.0])
+        founded_spacex = relationship(elon_musk, spacex, "founded", [0.0, 1.0])
+        tesla_led_by = relationship(tesla, elon_musk, "led_by", [0.8, 0.6])
+        store = EntityStore([ceo_of_tesla, founded_spacex, tesla_led_by])
+
+        chief_of_spacex = relationship(elon_musk, spacex, "chief_of", [1.0, 0.0])
+        assert Matcher().find_match(chief_of_spacex.model_copy(deep=True), store, threshold=0.5).name == "ceo_of"
+        # The pair blocking only compares the relationships between elon musk and spacex.
+        assert Matcher(relationship_blocking="endpoints").find_match(chief_of_spacex.model_copy(deep=True), store, threshold=0.5).name == "chief_of"
+        assert Matcher(relationship_blocking="endpoints").find_match(chief_of_spacex.model_copy(deep=True), store, threshold=-1).name == "founded"
+        # The endpoint blocking also compares the relationships starting from elon musk.
+        assert Matcher(relationship_blocking="endpoint").find_match(chief_of_spacex.model_copy(deep=True), store, threshold=0.5).name == "ceo_of"
+        # but not the relationships only sharing an entity in another role.
+        sends_to_mars = relationship(spacex, Entity(name='mars', label='Planet'), "sends_to", [0.0, 1.0])
+        assert Matcher(relationship_blocking="endpoint").find_match(sends_to_mars, store, threshold=0.5).name == "sends_to"
+
+    @pytest.mark.parametrize(
+        "current_entities, global_entities",
+        [(CURRENT_ENTITIES, GLOBAL_ENTITIES)],
+        ids=["normalized float32 embeddings give the same matches"],
+    )
+    def test_normalized_embeddings(self, current_entities, global_entities):
+        normalize = lambda entities: [entity.model_copy(update={"properties": EntityProperties(embeddings=normalize_embeddings(entity.properties.embeddings))}) 
+                                      for entity in entities]
+        normalized_current_entities, normalized_global_entities = normalize(current_entities), normalize(global_entities)
+        assert normalized_global_entities[0].properties.embeddings.dtype == np.float32
+
+        normalized_matcher = Matcher(normalized_embeddings=True)
+        for threshold in [0.3, 0.5, 0.7, 0.9]:
+            expected = matcher.find_matches(current_entities, global_entities, threshold=threshold)
+            matched = normalized_matcher.find_matches(normalized_current_entities, normalized_global_entities, threshold=threshold)
+            assert matched == expected
+
+    @pytest.mark.parametrize(
+        "current_entities, global_entities",
+        [(CURRENT_ENTITIES, GLOBAL_ENTITIES)],
+        ids=["merging concepts into a global store"],
+    )
+    def test_merging_concepts_into_store(self, current_entities, global_entities):
+        store = EntityStore(global_entities)
+        matched_entities = matcher.process_store(current_entities, store, threshold=0.5)
+        assert matched_entities == matcher.process_lists(current_entities, global_entities, threshold=0.5)[0]
+        assert set(store) == set(GLOBAL_ENTITIES_FINAL)
+        assert len(store) == len(GLOBAL_ENTITIES_FINAL) and len(store.matrix) == len(store)
+        # Inserting the same entities again is a no-op.
+        assert store.add(matched_entities) == []
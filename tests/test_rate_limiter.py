@@ -0,0 +1,74 @@
+import httpx
+import openai
+from unittest.mock import MagicMock
+from itext2kg import iText2KG, DocumentsDistiller
+from itext2kg.utils import LangchainOutputParser, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def rate_limit_error(retry_after: str) -> openai.RateLimitError:
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+def test_token_bucket_limits_requests_and_tokens():
+    clock = FakeClock()
+    rate_limiter = RateLimiter(requests_per_minute=2, tokens_per_minute=600, clock=clock)
+    assert rate_limiter._reserve(100) == 0
+    assert rate_limiter._reserve(100) == 0
+    # The request bucket is empty: one request is refilled every 30 seconds.
+    assert rate_limiter._reserve(100) == 30
+    clock.now = 30
+    # The token bucket holds 400 + 300 tokens refilled in 30 seconds, capped at 600.
+    assert rate_limiter._reserve(700) == 0
+    clock.now = 60
+    assert rate_limiter._reserve(400) == 10
+
+
+def test_rate_limit_errors_back_off_every_caller():
+    clock = FakeClock()
+    rate_limiter = RateLimiter(requests_per_minute=60, clock=clock)
+    assert rate_limiter.backoff(0, rate_limit_error("2")) == 2
+    assert rate_limiter.rate_factor == 0.5
+    assert rate_limiter._reserve(1) == 2
+    clock.now = 2
+    assert rate_limiter._reserve(1) == 0
+    rate_limiter.record_success()
+    assert rate_limiter.rate_factor == 0.55
+    # Without hint, the backoff is an exponential backoff with jitter.
+    assert 0 <= rate_limiter.backoff(3) <= 8
+
+
+def test_retries_keep_the_call_arguments():
+    parser = LangchainOutputParser(llm_model=MagicMock(), embeddings_model=None, rate_limiter=RateLimiter(max_retries=2))
+    chain = MagicMock()
+    chain.invoke.side_effect = [rate_limit_error("0"), {"name": "Elon Musk"}]
+    parser._chains[dict] = (MagicMock(format=MagicMock(return_value="prompt")), chain)
+
+    output = parser.extract_information_as_json_for_context(output_data_structure=dict, context="context", IE_query="query")
+    assert output == {"name": "Elon Musk"}
+    assert chain.invoke.call_count == 2
+    assert all(call.args[0] == {"context": "context", "query": "query"} for call in chain.invoke.call_args_list)
+
+
+def test_the_default_rate_limiter_is_shared_by_the_process():
+    builder = iText2KG(llm_model=MagicMock(), embeddings_model=MagicMock())
+    distiller = DocumentsDistiller(llm_model=MagicMock())
+    rate_limiter = RateLimiter.default()
+    assert builder.rate_limiter is rate_limiter
+    assert builder.ientities_extractor.langchain_output_parser.rate_limiter is rate_limiter
+    assert distiller.langchain_output_parser.rate_limiter is rate_limiter
+
+    limited = RateLimiter(requests_per_minute=500)
+    RateLimiter.set_default(limited)
+    try:
+        assert DocumentsDistiller(llm_model=MagicMock()).langchain_output_parser.rate_limiter is limited
+    finally:
+        RateLimiter.set_default(rate_limiter)
@@ -0,0 +1,43 @@
+import pytest
+from itext2kg.utils import SectionChunker
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_small_paragraphs_are_packed_together():
+    text = "Elon Musk is the CEO of SpaceX.\n\nTesla produces electric cars.\n\n\nSpaceX builds rockets."
+    chunker = SectionChunker(max_tokens=12, token_counter=count_words)
+    assert chunker.chunk(text) == ["Elon Musk is the CEO of SpaceX.\n\nTesla produces electric cars.", 
+                                   "SpaceX builds rockets."]
+    # A large window takes the whole document in one section.
+    assert SectionChunker(max_tokens=100, token_counter=count_words).chunk(text) == [
+        "Elon Musk is the CEO of SpaceX.\n\nTesla produces electric cars.\n\nSpaceX builds rockets."]
+
+
+def test_large_paragraphs_are_cut_between_sentences_with_overlap():
+    paragraph = "One two three. Four five six. Seven eight nine. Ten eleven twelve."
+    chunker = SectionChunker(max_tokens=7, overlap_tokens=3, token_counter=count_words)
+    sections = chunker.chunk("Intro.\n\n" + paragraph)
+    assert sections == ["Intro.\n\nOne two three. Four five six.", 
+                        "Four five six. Seven eight nine.", 
+                        "Seven eight nine. Ten eleven twelve."]
+    assert all(count_words(section) <= 7 for section in sections)
+
+    # Without overlap, the sentences fill the sections.
+    assert SectionChunker(max_tokens=7, token_counter=count_words).chunk(paragraph) == [
+        "One two three. Four five six.", "Seven eight nine. Ten eleven twelve."]
+
+
+def test_long_sentences_are_cut_between_words():
+    chunker = SectionChunker(max_tokens=4, token_counter=count_words)
+    assert chunker.chunk("a b c d e f g h i j") == ["a b c d", "e f g h", "i j"]
+    assert chunker.chunk_documents(["a b.", ""]) == [["a b."], []]
+
+
+def test_invalid_sizes():
+    with pytest.raises(ValueError):
+        SectionChunker(max_tokens=0)
+    with pytest.raises(ValueError):
+        SectionChunker(max_tokens=10, overlap_tokens=10)
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+from itext2kg.utils import Matcher, ExactVectorIndex, IVFVectorIndex, benchmark_vector_index
+from itext2kg.models import Entity, KnowledgeGraph
+
+rng = np.random.default_rng(42)
+CENTERS = rng.normal(size=(20, 64))
+EMBEDDINGS = np.vstack([center + 0.3 * rng.normal(size=(100, 64)) for center in CENTERS])
+
+
+def test_exact_index_matches_brute_force():
+    index = ExactVectorIndex()
+    index.add(EMBEDDINGS[:500])
+    index.add(EMBEDDINGS[500:])
+    queries = EMBEDDINGS[::97]
+    similarities, ids = index.search(queries, k=5)
+    expected = Matcher.cosine_similarity_matrix(queries, EMBEDDINGS)
+    assert (ids[:, 0] == np.argmax(expected, axis=1)).all()
+    assert np.allclose(similarities, -np.sort(-expected, axis=1)[:, :5])
+
+
+@pytest.mark.parametrize("n_probe, min_recall", [(4, 0.8), (100, 1.0)])
+def test_ivf_index_recall(n_probe, min_recall):
+    report = benchmark_vector_index(IVFVectorIndex(n_lists=20, n_probe=n_probe, min_train_size=200), EMBEDDINGS, k=10)
+    assert report["recall@k"] >= min_recall
+
+
+def test_ivf_index_incremental_inserts():
+    index = IVFVectorIndex(n_lists=20, n_probe=20, min_train_size=200)
+    for start in range(0, len(EMBEDDINGS), 150):
+        index.add(EMBEDDINGS[start:start + 150])
+    assert len(index) == len(EMBEDDINGS) and index.is_trained
+    _, ids = index.search(EMBEDDINGS[::50], k=1)
+    assert (ids[:, 0] == np.arange(0, len(EMBEDDINGS), 50)).all()
+
+
+def test_matcher_with_index_equals_exact_matcher():
+    global_entities = [Entity(name=f"entity {i}", label="Concept") for i in range(len(EMBEDDINGS))]
+    for entity, embedding in zip(global_entities, EMBEDDINGS):
+        entity.properties.embeddings = embedding
+    local_entities = [Entity(name=f"local {i}", label="Concept") for i in range(10)]
+    for i, entity in enumerate(local_entities):
+        entity.properties.embeddings = EMBEDDINGS[i * 150] + 0.01 * rng.normal(size=64)
+
+    exact_matches = Matcher().find_matches(local_entities, global_entities, threshold=0.5)
+    indexed_matcher = Matcher(index_factory=lambda: IVFVectorIndex(n_lists=20, n_probe=20), index_min_size=100)
+    matches, new_global_entities = indexed_matcher.process_lists(local_entities, global_entities, threshold=0.5)
+    assert matches == exact_matches
+    assert new_global_entities[:len(global_entities)] == global_entities
+
+    # The cached index is extended with the new global entities instead of being rebuilt.
+    index = indexed_matcher.get_index(global_entities)
+    assert indexed_matcher.get_index(new_global_entities + local_entities) is index
+    assert len(index) == len(new_global_entities) + len(local_entities)
+
+    # The lists too small for the index are not cached (nor kept alive) by the matcher.
+    indexed_matcher.get_indexed_objects(local_entities)
+    assert all(len(indexed_objects) >= 100 for _, _, indexed_objects in indexed_matcher._indexed_lists)
+    exact_matcher = Matcher()
+    exact_matcher.process_lists(local_entities, global_entities, threshold=0.5)
+    assert exact_matcher._indexed_lists == []
+
+
+def test_matcher_index_cache_follows_the_mutations_of_the_lists():
+    entities = [Entity(name=f"entity {i}", label="Concept") for i in range(200)]
+    for entity, embedding in zip(entities, EMBEDDINGS):
+        entity.properties.embeddings = embedding
+    kg = KnowledgeGraph(entities=entities, relationships=[])
+    matcher = Matcher(index_factory=lambda: IVFVectorIndex(n_lists=4, n_probe=4, min_train_size=100), index_min_size=100)
+    query = Entity(name="query", label="Concept")
+    query.properties.embeddings = EMBEDDINGS[500]
+
+    indexed_objects = matcher.get_indexed_objects(kg.entities)
+    # Appended objects are inserted in the cached structures.
+    appended = Entity(name="appended", label="Concept")
+    appended.properties.embeddings = EMBEDDINGS[500]
+    kg.entities.append(appended)
+    assert matcher.get_indexed_objects(kg.entities) is indexed_objects
+    assert matcher.find_matches([query], kg.entities, threshold=0.99) == [appended]
+
+    # A replaced object rebuilds them.
+    replaced = Entity(name="replaced", label="Concept")
+    replaced.properties.embeddings = EMBEDDINGS[500]
+    kg.entities[-1] = replaced
+    assert matcher.get_indexed_objects(kg.entities) is not indexed_objects
+    assert matcher.find_matches([query], kg.entities, threshold=0.99) == [replaced]
+
+    # Objects changed in place are only seen after invalidating the cache.
+    replaced.properties.embeddings = EMBEDDINGS[0]
+    assert matcher.find_matches([query], kg.entities, threshold=0.99) == [replaced]
+    matcher.invalidate_indexes()
+    assert matcher.find_matches([query], kg.entities, threshold=0.99) == [query]